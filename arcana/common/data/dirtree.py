@@ -2,17 +2,21 @@ from __future__ import annotations
 import os
 from pathlib import Path
 import re
+import time
+import hashlib
 import typing as ty
 import logging
 import json
+from collections import defaultdict
 import attrs
-from fileformats.core import FileSet, Field
+from fileformats.core import DataType, FileSet, Field
 from arcana.core.exceptions import ArcanaUsageError
 from arcana.core.data.set.base import DataTree
 from arcana.core.data.row import DataRow
 from arcana.core.data.entry import DataEntry
 from arcana.core.data.store import LocalStore
 from arcana.core.utils.misc import full_path
+from arcana.core.utils.transfer import transfer_fileset
 
 
 logger = logging.getLogger("arcana")
@@ -36,6 +40,16 @@ class DirTree(LocalStore):
     base_dir : str
         Path to the base directory of the "store", i.e. datasets are
         arranged by name as sub-directories of the base dir.
+    transfer_mode : str
+        how file-sets are transferred into the store, one of "copy", "reflink"
+        (copy-on-write clone), "hardlink" or "move", falling back to copying where
+        the mode isn't supported between the source and the store (e.g. different
+        devices). Note that hard-linked files are shared with their source, and moved
+        files are removed from it, by default "reflink"
+    conversion_cache_max_size : int, optional
+        the maximum size (in bytes) of the cache of converted inputs saved within
+        each dataset (see ``Pipeline.cache_conversions``), above which the least
+        recently used conversions are evicted. Unlimited by default
 
     """
 
@@ -66,13 +80,14 @@ class DirTree(LocalStore):
                 "root row of the dataset"
             )
         dpaths = sorted(d for d, _, _ in os.walk(tree.dataset_id))
-        for dpath in dpaths:
-            tree_path = tuple(Path(dpath).relative_to(tree.dataset_id).parts)
-            if len(tree_path) != len(tree.hierarchy):
-                continue
-            if self.ARCANA_DIR in tree_path:
-                continue
-            tree.add_leaf(tree_path)
+        tree_paths = (
+            tuple(Path(dpath).relative_to(tree.dataset_id).parts) for dpath in dpaths
+        )
+        tree.add_leaves(
+            p
+            for p in tree_paths
+            if len(p) == len(tree.hierarchy) and self.ARCANA_DIR not in p
+        )
 
     def populate_row(self, row: DataRow):
         """Scans the node in the data tree corresponding to the data row and populates
@@ -83,59 +98,26 @@ class DirTree(LocalStore):
         row : DataRow
             the data row to populate
         """
+        self._scan_row(row, full_path(row.dataset.id))
 
-        def filter_entry_dir(entry_dir):
-            for subpath in entry_dir.iterdir():
-                entry_name = subpath.name
-                if (
-                    not entry_name.startswith(".")
-                    and entry_name != self.ARCANA_DIR
-                    and entry_name
-                    not in (
-                        self.FIELDS_FNAME,
-                        self.FIELDS_PROV_FNAME,
-                        self.FIELDS_FNAME + self.LOCK_SUFFIX,
-                    )
-                    and not entry_name.endswith(self.PROV_SUFFIX)
-                ):
-                    yield subpath
-
-        root_dir = full_path(row.dataset.id)
+    def populate_rows(self, rows: ty.Iterable[DataRow]):
+        """Scans the nodes in the data tree corresponding to the data rows and populates
+        them with the data entries found, resolving the dataset root only once and
+        reusing the file-type information returned by ``os.scandir`` instead of
+        separately stat-ing each entry
 
-        # Iterate through all directories saved for the source and dataset derivatives
-        for dataset_name in self._row_dataset_names(row):
-            row_dir = root_dir / self._row_relpath(row, dataset_name=dataset_name)
-            if row_dir.exists():
-                # Filter contents of directory to omit fields JSON and provenance and
-                # add file-set entries
-                for entry_fspath in filter_entry_dir(row_dir):
-                    path = str(entry_fspath.relative_to(row_dir))
-                    if dataset_name is not None:
-                        path += "@" + dataset_name
-                    row.add_entry(
-                        path=path,
-                        datatype=FileSet,
-                        uri=str(entry_fspath.relative_to(root_dir)),
-                    )
-                # Add field entries
-                fields_json = row_dir / self.FIELDS_FNAME
-                try:
-                    with open(fields_json) as f:
-                        fields_dict = json.load(f)
-                except FileNotFoundError:
-                    pass
-                else:
-                    for name in fields_dict:
-                        path = (
-                            f"{name}@{dataset_name}"
-                            if dataset_name is not None
-                            else name
-                        )
-                        row.add_entry(
-                            path=path,
-                            datatype=Field,
-                            uri=str(fields_json.relative_to(root_dir)) + "::" + name,
-                        )
+        Parameters
+        ----------
+        rows : Iterable[DataRow]
+            the data rows to populate
+        """
+        root_dirs = {}
+        for row in rows:
+            try:
+                root_dir = root_dirs[row.dataset.id]
+            except KeyError:
+                root_dir = root_dirs[row.dataset.id] = full_path(row.dataset.id)
+            self._scan_row(row, root_dir)
 
     def get_field(self, entry: DataEntry, datatype: type) -> Field:
         """Retrieve the field associated with the given entry and return it cast
@@ -202,8 +184,10 @@ class DirTree(LocalStore):
                     "Cannot change extension of file-set when copying to dirtree store"
                 )
         # Create target directory if it doesn't exist already
-        copied_fileset = fileset.copy(
-            dest_dir=fspath.parent,
+        copied_fileset = transfer_fileset(
+            fileset,
+            fspath.parent,
+            mode=self.transfer_mode,
             collation=fileset.CopyCollation.adjacent,
             new_stem=new_stem,
             make_dirs=True,
@@ -225,6 +209,41 @@ class DirTree(LocalStore):
         fspath, key = self._fields_fspath_and_key(entry)
         self.update_json(fspath, key, field.primitive(field))
 
+    def put_items(
+        self,
+        items: ty.Iterable[ty.Tuple[DataType, DataEntry]],
+        max_workers: ty.Optional[int] = None,
+    ) -> ty.List[DataType]:
+        """Puts multiple items into their entries, appending the values of fields that
+        are stored in the same fields file in a single update
+
+        Parameters
+        ----------
+        items : Iterable[tuple[DataType, DataEntry]]
+            the items to put and the entries to put them in
+        max_workers : int, optional
+            not used, as local file-sets are copied one after the other
+
+        Returns
+        -------
+        list[DataType]
+            the copies of the items in the store
+        """
+        items = list(items)
+        field_updates = defaultdict(dict)
+        cached = []
+        for item, entry in items:
+            if entry.datatype.is_field:
+                fspath, key = self._fields_fspath_and_key(entry)
+                field = entry.datatype(item)
+                field_updates[fspath][key] = field.primitive(field)
+                cached.append(field)
+            else:
+                cached.append(self.put(item, entry))
+        for fspath, updates in field_updates.items():
+            self.append_to_json(fspath, updates)
+        return cached
+
     def get_fileset_provenance(
         self, entry: DataEntry
     ) -> ty.Union[ty.Dict[str, ty.Any], None]:
@@ -240,8 +259,11 @@ class DirTree(LocalStore):
         ty.Dict[str, ty.Any] or None
             the retrieved provenance or None if it doesn't exist
         """
-        with open(self._fileset_prov_fspath(entry)) as f:
-            provenance = json.load(f)
+        try:
+            with open(self._fileset_prov_fspath(entry)) as f:
+                provenance = json.load(f)
+        except FileNotFoundError:
+            return None
         return provenance
 
     def put_fileset_provenance(
@@ -275,9 +297,7 @@ class DirTree(LocalStore):
             the retrieved provenance or None if it doesn't exist
         """
         fspath, key = self._fields_prov_fspath_and_key(entry)
-        with open(fspath) as f:
-            fields_provenance = json.load(f)
-        return fields_provenance[key]
+        return self.load_json(fspath).get(key)
 
     def put_field_provenance(self, provenance: ty.Dict[str, ty.Any], entry: DataEntry):
         """Puts provenance associated with a field data entry into the store
@@ -360,6 +380,94 @@ class DirTree(LocalStore):
         for ids_tuple in leaves:
             root_dir.joinpath(*ids_tuple).mkdir(parents=True)
 
+    def tree_fingerprint(self, dataset) -> ty.Optional[str]:
+        """Fingerprints the data tree from the modification times of the directories
+        above the leaf layer, which change whenever leaf directories are added, removed
+        or renamed, so the contents of the leaf directories don't need to be walked
+
+        Parameters
+        ----------
+        dataset : Dataset
+            the dataset to fingerprint the data tree of
+
+        Returns
+        -------
+        fingerprint : str or None
+            the fingerprint, or None if the dataset directory doesn't exist or has
+            been modified too recently for the timestamps to be relied upon
+        """
+        root_dir = Path(dataset.id)
+        if not root_dir.exists():
+            return None
+        min_age_threshold = (time.time() - self.TREE_FINGERPRINT_MIN_AGE) * 1e9
+        depth = len(dataset.hierarchy)
+        hsh = hashlib.md5()
+        to_scan = [(root_dir, ())]
+        while to_scan:
+            dpath, tree_path = to_scan.pop()
+            mtime = os.stat(dpath).st_mtime_ns
+            if mtime > min_age_threshold:
+                return None
+            hsh.update(f"{'/'.join(tree_path)}:{mtime};".encode())
+            if len(tree_path) + 1 < depth:
+                with os.scandir(dpath) as it:
+                    subdirs = sorted(
+                        e.name
+                        for e in it
+                        if e.is_dir(follow_symlinks=False) and e.name != self.ARCANA_DIR
+                    )
+                to_scan.extend((dpath / n, tree_path + (n,)) for n in reversed(subdirs))
+        return hsh.hexdigest()
+
+    def row_fingerprint(self, row: DataRow) -> ty.Optional[str]:
+        """Fingerprints the entries of a row from the modification times of the
+        directories holding its source data and derivatives, which change whenever
+        file-sets are added, removed or renamed, along with the sizes and modification
+        times of the fields JSON (and its log) in each of them, so the directories
+        don't need to be listed and the fields loaded
+
+        Parameters
+        ----------
+        row : DataRow
+            the row to fingerprint the entries of
+
+        Returns
+        -------
+        fingerprint : str or None
+            the fingerprint, or None if any of the directories or fields have been
+            modified too recently for the timestamps to be relied upon
+        """
+        root_dir = full_path(row.dataset.id)
+        min_age_threshold = (time.time() - self.TREE_FINGERPRINT_MIN_AGE) * 1e9
+        derivs_relpath = self._row_relpath(row, dataset_name="").parent
+        relpaths = [self._row_relpath(row), derivs_relpath]
+        relpaths.extend(
+            derivs_relpath / n
+            for n in sorted(
+                e.name
+                for e in self._scandir(root_dir / derivs_relpath)
+                if e.name != self.ARCANA_DIR and e.is_dir()
+            )
+        )
+        hsh = hashlib.md5()
+        for relpath in relpaths:
+            for fspath in (
+                relpath,
+                relpath / self.FIELDS_FNAME,
+                relpath / (self.FIELDS_FNAME + self.JSON_LOG_SUFFIX),
+            ):
+                try:
+                    stat = os.stat(root_dir / fspath)
+                except (FileNotFoundError, NotADirectoryError):
+                    hsh.update(f"{fspath}:-;".encode())
+                    if fspath == relpath:
+                        break  # the directory doesn't exist
+                    continue
+                if stat.st_mtime_ns > min_age_threshold:
+                    return None
+                hsh.update(f"{fspath}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+        return hsh.hexdigest()
+
     ##################
     # Helper functions
     ##################
@@ -407,30 +515,97 @@ class DirTree(LocalStore):
                 relpath /= dataset_name
         return relpath
 
-    def _row_dataset_names(self, row: DataRow):
-        """list all dataset names stored in the given row
+    def _scan_row(self, row: DataRow, root_dir: Path):
+        """Adds entries for the items found in the directories of the source data and
+        all derivative datasets stored in the given row
 
         Parameters
         ----------
         row : DataRow
-            row to return the dataset names for
+            the row to populate
+        root_dir : Path
+            the (resolved) root directory of the dataset
+        """
+        self._scan_row_dir(row, root_dir, self._row_relpath(row), dataset_name=None)
+        derivs_relpath = self._row_relpath(row, dataset_name="").parent
+        for dir_entry in self._scandir(root_dir / derivs_relpath):
+            if dir_entry.name == self.ARCANA_DIR or not dir_entry.is_dir():
+                continue
+            dataset_name = (
+                "" if dir_entry.name == self.EMPTY_DATASET_NAME else dir_entry.name
+            )
+            self._scan_row_dir(
+                row, root_dir, derivs_relpath / dir_entry.name, dataset_name
+            )
 
-        Returns
-        -------
-        dataset_names : list[str]
-            list of dataset names stored in the given row
+    def _scan_row_dir(
+        self,
+        row: DataRow,
+        root_dir: Path,
+        relpath: Path,
+        dataset_name: ty.Optional[str],
+    ):
+        """Adds entries for the file-sets and fields found in a row directory
+
+        Parameters
+        ----------
+        row : DataRow
+            the row to add the entries to
+        root_dir : Path
+            the (resolved) root directory of the dataset
+        relpath : Path
+            the path of the row directory relative to the root directory
+        dataset_name : str or None
+            the name of the dataset the directory holds derivatives of, None for
+            source data
         """
-        dataset_names = [None]  # The source data
-        derivs_dir = (
-            Path(row.dataset.id) / self._row_relpath(row, dataset_name="").parent
-        )
-        if derivs_dir.exists():
-            dataset_names.extend(
-                ("" if d.name == self.EMPTY_DATASET_NAME else d.name)
-                for d in derivs_dir.iterdir()
-                if d.name != self.ARCANA_DIR
+        has_fields = False
+        # Filter contents of directory to omit fields JSON and provenance (along with
+        # their logs and locks) and add file-set entries
+        for dir_entry in self._scandir(root_dir / relpath):
+            entry_name = dir_entry.name
+            if entry_name in (
+                self.FIELDS_FNAME,
+                self.FIELDS_FNAME + self.JSON_LOG_SUFFIX,
+            ):
+                has_fields = True
+            if (
+                entry_name.startswith(".")
+                or entry_name == self.ARCANA_DIR
+                or entry_name.startswith(self.FIELDS_FNAME)
+                or entry_name.startswith(self.FIELDS_PROV_FNAME)
+                or entry_name.endswith(self.PROV_SUFFIX)
+            ):
+                continue
+            path = entry_name
+            if dataset_name is not None:
+                path += "@" + dataset_name
+            row.add_entry(
+                path=path,
+                datatype=FileSet,
+                uri=str(relpath / entry_name),
+            )
+        if not has_fields:
+            return
+        # Add field entries
+        fields_relpath = relpath / self.FIELDS_FNAME
+        for name in self.load_json(root_dir / fields_relpath):
+            path = f"{name}@{dataset_name}" if dataset_name is not None else name
+            row.add_entry(
+                path=path,
+                datatype=Field,
+                uri=str(fields_relpath) + "::" + name,
             )
-        return dataset_names
+
+    @staticmethod
+    def _scandir(dpath: Path) -> ty.List[os.DirEntry]:
+        """Lists the contents of a directory, returning an empty list if it doesn't
+        exist"""
+        try:
+            with os.scandir(dpath) as it:
+                return list(it)
+        except (FileNotFoundError, NotADirectoryError):
+            return []
 
     def _fileset_fspath(self, entry):
         return Path(entry.row.dataset.id) / entry.uri
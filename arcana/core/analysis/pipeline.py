@@ -1,7 +1,14 @@
 import os
+import time
+import json
+import errno
+import shutil
+import hashlib
+from pathlib import Path
 import attrs
 import typing as ty
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import logging
 from copy import copy, deepcopy
 import attrs.converters
@@ -14,18 +21,22 @@ from arcana.core.exceptions import (
     ArcanaPipelinesStackError,
     ArcanaOutputNotProducedException,
     ArcanaDataMatchError,
+    ArcanaError,
 )
-from fileformats.core import DataType
+from fileformats.core import DataType, FileSet
 from fileformats.core.exceptions import FormatConversionError
 import arcana.core.data.set.base
 import arcana.core.data.row
 from ..data.space import DataSpace
+from ..data.entry import DataEntry
+from ..data.column import DataColumn
 from ..utils.misc import (
     func_task,
     pydra_eq,
     path2varname,
     add_exc_note,
 )
+from ..utils.hashing import FileHasher
 from ..utils.serialize import (
     asdict,
     fromdict,
@@ -38,6 +49,11 @@ from ..utils.serialize import (
 
 logger = logging.getLogger("arcana")
 
+# How input file-sets can be passed to pipelines (see ``Pipeline.sourcing``)
+SOURCING_MODES = ("path", "symlink", "hardlink")
+# Name of the derivative dataset converted inputs are persisted in
+CONVERTED_INPUTS_DATASET = "__converted__"
+
 
 @attrs.define
 class PipelineField:
@@ -99,6 +115,32 @@ class Pipeline:
     converter_args : dict[str, dict]
         keyword arguments passed on to the converter to control how the
         conversion is performed.
+    sourcing : str
+        how input file-sets are passed to the pipeline, either "path" to pass them by
+        their paths in the store (the default) or "symlink" or "hardlink" to stage
+        them into the work directory of the row as links, so tasks that copy their
+        inputs don't duplicate the data. Hard-links fall back to symlinks where they
+        aren't supported (e.g. across devices). Note that the links share the original
+        files, so tasks that modify their inputs in-place will modify the originals
+    verify_sourced : bool
+        whether to check that staged input file-sets haven't been modified by the
+        pipeline, by comparing the checksums of the originals before the pipeline is
+        run with their checksums before the outputs are sunk, by default False
+    cache_conversions : bool
+        whether to convert input file-sets to the datatypes required by the pipeline
+        via the conversion cache of the store (see ``DataStore.conversion_cache``),
+        so conversions are shared with other pipelines and later runs, instead of in
+        converter nodes of the workflow. Only applies to inputs of the same row
+        frequency as the pipeline, by default False
+    persist_conversions : bool
+        whether to also save the converted inputs back into the store, as
+        derivatives of the hidden "__converted__" dataset, by default False
+    track_inputs : bool
+        whether to record the checksums of the inputs in the provenance of the
+        outputs, so rows whose inputs have changed since their outputs were derived
+        are derived again. Only applies to inputs of the same row frequency as the
+        pipeline. Note that stores that don't keep checksums of their file-sets (e.g.
+        DirTree) need to read the inputs to calculate them, by default False
     dataset : Dataset
         the dataset the pipeline has been applied to
     """
@@ -115,6 +157,13 @@ class Pipeline:
     converter_args: ty.Dict[str, dict] = attrs.field(
         factory=dict, converter=attrs.converters.default_if_none(factory=dict)
     )
+    sourcing: str = attrs.field(
+        default="path", validator=attrs.validators.in_(SOURCING_MODES)
+    )
+    verify_sourced: bool = False
+    cache_conversions: bool = False
+    persist_conversions: bool = False
+    track_inputs: bool = False
     dataset: arcana.core.data.set.base.Dataset = attrs.field(
         metadata={"asdict": False}, default=None, eq=False, hash=False
     )
@@ -201,13 +250,15 @@ class Pipeline:
     # self.wf.to_process.inputs.parameterisation = parameterisation
     # self.wf.per_node.source.inputs.parameterisation = parameterisation
 
-    def __call__(self, **kwargs):
+    def __call__(self, requested_ids: ty.Optional[ty.List[str]] = None, **kwargs):
         """
         Create an "outer" workflow that interacts with the dataset to pull input
         data, process it and then push the derivatives back to the store.
 
         Parameters
         ----------
+        requested_ids : list[str], optional
+            the IDs of the rows to process, all rows by default
         **kwargs
             passed directly to the Pydra.Workflow init. The `ids` arg can be
             used to filter the data rows over which the pipeline is run.
@@ -225,18 +276,76 @@ class Pipeline:
             If the new pipeline will overwrite an existing pipeline connection
             with overwrite == False.
         """
+        return self.fuse([self], name=self.name, requested_ids=requested_ids, **kwargs)
+
+    @classmethod
+    def fuse(
+        cls,
+        pipelines: ty.Sequence["Pipeline"],
+        name: ty.Optional[str] = None,
+        requested_ids: ty.Optional[ty.List[str]] = None,
+        **kwargs,
+    ) -> Workflow:
+        """Create a single "outer" workflow that runs a sequence of pipelines of the
+        same row frequency one after another over each row. The outputs of upstream
+        pipelines are passed directly to the downstream pipelines that take them as
+        inputs (as well as being sunk to the store), instead of the downstream
+        pipelines sourcing them back from the store after all rows have been
+        processed by the upstream pipelines. Independent rows therefore flow through
+        all the pipelines concurrently.
+
+        Parameters
+        ----------
+        pipelines : Sequence[Pipeline]
+            the pipelines to fuse, in order of execution (e.g. from ``Pipeline.stack``)
+        name : str, optional
+            name of the fused workflow, by default the names of the pipelines joined
+            by "__"
+        requested_ids : list[str], optional
+            the IDs of the rows to process, all rows by default
+        **kwargs
+            passed directly to the Pydra.Workflow init
+
+        Returns
+        -------
+        pydra.Workflow
+            a Pydra workflow that iterates through the rows of the dataset that
+            don't have any of the outputs of the pipelines, runs all the pipelines
+            on each row, and sinks their outputs back to the store. Rows that have
+            some, but not all, of the outputs are returned in `couldnt_process`
+        """
+        if not pipelines:
+            raise ArcanaUsageError("At least one pipeline is required")
+        dataset = pipelines[0].dataset
+        row_frequency = pipelines[0].row_frequency
+        for pipeline in pipelines[1:]:
+            if pipeline.row_frequency != row_frequency:
+                raise ArcanaUsageError(
+                    f"Cannot fuse '{pipeline.name}' pipeline with row frequency of "
+                    f"'{pipeline.row_frequency}' with pipelines of row frequency "
+                    f"'{row_frequency}'"
+                )
+        if name is None:
+            name = "__".join(p.name for p in pipelines)
 
         # Create the outer workflow to link the analysis workflow with the
         # data row iteration and store connection rows
-        wf = Workflow(name=self.name, input_spec=["ids"], **kwargs)
-
-        # Generate list of rows to process checking existing outputs
+        wf = Workflow(name=name, input_spec=["ids"], **kwargs)
+
+        # Generate list of rows to process checking existing outputs, and whether
+        # their provenance matches the current pipelines
+        provenance = {}
+        for pipeline in pipelines:
+            pipeline_prov = pipeline.provenance
+            provenance.update((o.name, pipeline_prov) for o in pipeline.outputs)
         wf.add(
             to_process(
-                dataset=self.dataset,
-                row_frequency=self.row_frequency,
-                outputs=self.outputs,
-                requested_ids=None,  # FIXME: Needs to be set dynamically
+                dataset=dataset,
+                row_frequency=row_frequency,
+                outputs=[o for p in pipelines for o in p.outputs],
+                requested_ids=requested_ids,
+                provenance=provenance,
+                check_inputs=any(p.track_inputs for p in pipelines),
                 name="to_process",
             )
         )
@@ -249,14 +358,61 @@ class Pipeline:
             )
         )
 
+        # Outputs of the upstream pipelines, which are passed directly to the
+        # downstream pipelines
+        derived = {}
+        for pipeline in pipelines:
+            # Prefix the names of the nodes of fused pipelines so they don't clash
+            prefix = f"{pipeline.name}_" if len(pipelines) > 1 else ""
+            derived.update(pipeline._add_row_nodes(wf.per_row, prefix, derived))
+
+        wf.per_row.set_output([("id", getattr(wf.per_row, prefix + "sink").lzout.id)])
+
+        wf.set_output(
+            [
+                ("processed", wf.per_row.lzout.id),
+                ("couldnt_process", wf.to_process.lzout.cant_process),
+            ]
+        )
+
+        return wf
+
+    def _add_row_nodes(
+        self, per_row: Workflow, prefix: str, derived: ty.Dict[str, ty.Any]
+    ) -> ty.Dict[str, ty.Any]:
+        """Adds the nodes that source the inputs of the pipeline for a row, process
+        them and sink the outputs to the "per-row" workflow
+
+        Parameters
+        ----------
+        per_row : Workflow
+            the workflow that is split over the rows of the dataset
+        prefix : str
+            prefix prepended to the names of the added nodes
+        derived : dict[str, LazyField]
+            the outputs of upstream pipelines in the same workflow, which are
+            connected directly instead of being sourced from the store
+
+        Returns
+        -------
+        dict[str, LazyField]
+            the outputs of the pipeline, converted to the datatypes of the sink
+            columns
+        """
         # Automatically output interface for source node to include sourced
         # columns
+        to_source = [i for i in self.inputs if i.name not in derived]
+        # Inputs converted by the source node via the conversion cache of the store
+        # instead of by converter nodes
+        cached_conversions = self._cached_conversions(to_source)
         source_out_dct = {}
-        for inpt in self.inputs:
+        for inpt in to_source:
             # If the row frequency of the column is not a parent of the pipeline
             # then the input will be a sequence of all the child rows
             if inpt.datatype is arcana.core.data.row.DataRow:
                 dtype = arcana.core.data.row.DataRow
+            elif inpt.name in cached_conversions:
+                dtype = inpt.datatype
             else:
                 dtype = self.dataset[inpt.name].datatype
                 # If the row frequency of the source column is higher than the frequency
@@ -268,8 +424,9 @@ class Pipeline:
                     dtype = ty.List[dtype]
             source_out_dct[inpt.name] = dtype
         source_out_dct["provenance_"] = ty.Dict[str, ty.Any]
+        source_out_dct["staged_checksums_"] = ty.Dict[str, str]
 
-        wf.per_row.add(
+        per_row.add(
             func_task(
                 source_items,
                 in_fields=[
@@ -278,29 +435,47 @@ class Pipeline:
                     ("id", str),
                     ("inputs", ty.List[PipelineField]),
                     ("parameterisation", ty.Dict[str, ty.Any]),
+                    ("sourcing", str),
+                    ("verify_sourced", bool),
+                    ("cached_conversions", ty.List[str]),
+                    ("converter_args", ty.Dict[str, dict]),
+                    ("persist_conversions", bool),
+                    ("track_inputs", bool),
                 ],
                 out_fields=list(source_out_dct.items()),
-                name="source",
+                name=prefix + "source",
                 dataset=self.dataset,
                 row_frequency=self.row_frequency,
-                inputs=self.inputs,
-                id=wf.per_row.lzin.id,
+                inputs=to_source,
+                id=per_row.lzin.id,
+                parameterisation=self.provenance,
+                sourcing=self.sourcing,
+                verify_sourced=self.verify_sourced,
+                cached_conversions=cached_conversions,
+                converter_args=self.converter_args,
+                persist_conversions=self.persist_conversions,
+                track_inputs=self.track_inputs,
             )
         )
+        source = getattr(per_row, prefix + "source")
 
         # Set the inputs
-        sourced = {
-            i.name: getattr(wf.per_row.source.lzout, i.name) for i in self.inputs
-        }
+        sourced = {i.name: getattr(source.lzout, i.name) for i in to_source}
+        sourced.update(
+            (i.name, derived[i.name]) for i in self.inputs if i.name in derived
+        )
 
         # Do input datatype conversions if required
         for inpt in self.inputs:
-            if inpt.datatype == arcana.core.data.row.DataRow:
+            if (
+                inpt.datatype == arcana.core.data.row.DataRow
+                or inpt.name in cached_conversions
+            ):
                 continue
             stored_format = self.dataset[inpt.name].datatype
             converter = inpt.datatype.get_converter(
                 stored_format,
-                name=f"{inpt.name}_input_converter",
+                name=f"{prefix}{inpt.name}_input_converter",
                 **self.converter_args.get(inpt.name, {}),
             )
             if converter is not None:  # None if no conversion required
@@ -311,29 +486,27 @@ class Pipeline:
                     inpt.datatype.mime_like,
                 )
                 converter.inputs.in_file = sourced.pop(inpt.name)
-                if issubclass(source_out_dct[inpt.name], ty.Sequence):
+                if issubclass(source_out_dct.get(inpt.name, object), ty.Sequence):
                     # Iterate over all items in the sequence and convert them
                     # separately
                     converter.split("to_convert")
                 # Insert converter
-                wf.per_row.add(converter)
+                per_row.add(converter)
                 # Map converter output to input_interface
                 sourced[inpt.name] = converter.lzout.out_file
 
         # Add the "inner" workflow of the pipeline that actually performs the
         # analysis/processing
-        wf.per_row.add(deepcopy(self.workflow))
+        workflow = deepcopy(self.workflow)
+        workflow.name = prefix + workflow.name
+        per_row.add(workflow)
         # Make connections to "inner" workflow
         for inpt in self.inputs:
-            setattr(
-                getattr(wf.per_row, self.workflow.name).inputs,
-                inpt.field,
-                sourced[inpt.name],
-            )
+            setattr(workflow.inputs, inpt.field, sourced[inpt.name])
 
         # Set datatype converters where required
         to_sink = {
-            o.name: getattr(getattr(wf.per_row, self.workflow.name).lzout, o.field)
+            o.name: getattr(getattr(per_row, workflow.name).lzout, o.field)
             for o in self.outputs
         }
 
@@ -343,7 +516,7 @@ class Pipeline:
             sink_name = path2varname(outpt.name)
             converter = stored_format.get_converter(
                 outpt.datatype,
-                name=f"{sink_name}_output_converter",
+                name=f"{prefix}{sink_name}_output_converter",
                 **self.converter_args.get(outpt.name, {}),
             )
             if converter:
@@ -355,13 +528,13 @@ class Pipeline:
                 )
                 # Insert converter
                 converter.inputs.in_file = to_sink.pop(sink_name)
-                wf.per_row.add(converter)
+                per_row.add(converter)
                 # Map converter output to workflow output
                 to_sink[sink_name] = converter.lzout.out_file
 
         # Can't use a decorated function as we need to allow for dynamic
         # arguments
-        wf.per_row.add(
+        per_row.add(
             func_task(
                 sink_items,
                 in_fields=(
@@ -370,6 +543,7 @@ class Pipeline:
                         ("row_frequency", DataSpace),
                         ("id", str),
                         ("provenance", ty.Dict[str, ty.Any]),
+                        ("staged_checksums", ty.Dict[str, str]),
                     ]
                     + [
                         (s, ty.Union[DataType, str, bytes, os.PathLike])
@@ -377,28 +551,67 @@ class Pipeline:
                     ]
                 ),
                 out_fields=[("id", str)],
-                name="sink",
+                name=prefix + "sink",
                 dataset=self.dataset,
                 row_frequency=self.row_frequency,
-                id=wf.per_row.lzin.id,
-                provenance=wf.per_row.source.lzout.provenance_,
+                id=per_row.lzin.id,
+                provenance=source.lzout.provenance_,
+                staged_checksums=source.lzout.staged_checksums_,
                 **to_sink,
             )
         )
-
-        wf.per_row.set_output([("id", wf.per_row.sink.lzout.id)])
-
-        wf.set_output(
-            [
-                ("processed", wf.per_row.lzout.id),
-                ("couldnt_process", wf.to_process.lzout.cant_process),
-            ]
-        )
-
-        return wf
+        return to_sink
+
+    def _cached_conversions(self, inputs: ty.List[PipelineField]) -> ty.List[str]:
+        """Returns the names of the inputs that are to be converted via the conversion
+        cache of the store"""
+        if not self.cache_conversions:
+            return []
+        if self.dataset.store.conversion_cache(self.dataset) is None:
+            logger.warning(
+                "Conversions of the inputs of '%s' pipeline can't be cached as %s "
+                "doesn't provide a conversion cache",
+                self.name,
+                self.dataset.store,
+            )
+            return []
+        names = []
+        for inpt in inputs:
+            if inpt.datatype is arcana.core.data.row.DataRow:
+                continue
+            column = self.dataset[inpt.name]
+            if (
+                column.row_frequency == self.row_frequency
+                and column.datatype.is_fileset
+                and inpt.datatype.get_converter(column.datatype, name="dummy")
+                is not None
+            ):
+                names.append(inpt.name)
+        return names
 
     PROVENANCE_VERSION = "1.0"
     WORKFLOW_NAME = "processing"
+    SOURCING_OPTIONS = ("sourcing", "verify_sourced", "track_inputs")
+    CONVERSION_OPTIONS = ("cache_conversions", "persist_conversions")
+
+    @property
+    def provenance(self) -> ty.Dict[str, ty.Any]:
+        """The provenance recorded alongside the outputs of the pipeline, which is
+        compared against the provenance of existing outputs to determine whether they
+        need to be derived again. Includes a checksum of the serialised pipeline, so
+        changes to the workflow or its parameters are detected"""
+        dct = self.asdict(required_modules=set())
+        # How the inputs are sourced doesn't affect the outputs
+        for key in self.SOURCING_OPTIONS + self.CONVERSION_OPTIONS:
+            del dct[key]
+        checksum = hashlib.md5(
+            json.dumps(dct, sort_keys=True, default=str).encode()
+        ).hexdigest()
+        return {
+            "version": self.PROVENANCE_VERSION,
+            "pipeline": self.name,
+            "checksum": checksum,
+        }
 
     def asdict(self, required_modules=None):
         dct = asdict(self, omit=["workflow"], required_modules=required_modules)
@@ -518,6 +731,314 @@ def split_side_car_suffix(name):
     return name.split("__o__")
 
 
+@attrs.define
+class OutputIndex:
+    """Index of the entries of rows by the leading sections of their paths, which is
+    used to look up the entries of the sink columns of pipeline outputs in a single
+    pass over the entries of each row, instead of matching each sink column against
+    all the entries of the row separately. The entries found for each output are then
+    matched against the criteria of its sink column, as they would be when its cells
+    are accessed
+
+    Parameters
+    ----------
+    keys : dict[str, tuple[tuple[str, ...], str]]
+        the path sections and dataset name of each output, keyed by output name
+    columns : dict[str, DataColumn]
+        the sink columns of the outputs, keyed by output name
+    """
+
+    keys: ty.Dict[str, ty.Tuple[ty.Tuple[str, ...], ty.Optional[str]]]
+    columns: ty.Dict[str, DataColumn]
+    _lengths: ty.Set[int] = attrs.field(init=False, repr=False)
+    _any_dataset: bool = attrs.field(init=False, repr=False)
+
+    def __attrs_post_init__(self):
+        self._lengths = set(len(p) for p, _ in self.keys.values())
+        self._any_dataset = any(n == "*" for _, n in self.keys.values())
+
+    @classmethod
+    def compile(
+        cls, dataset: arcana.core.data.set.base.Dataset, outputs: ty.List[PipelineField]
+    ) -> "OutputIndex":
+        """Compiles the index from the paths of the sink columns of the outputs
+
+        Parameters
+        ----------
+        dataset : Dataset
+            the dataset the sink columns belong to
+        outputs : list[PipelineField]
+            the outputs of the pipeline(s)
+
+        Returns
+        -------
+        OutputIndex
+            the compiled index
+        """
+        keys = {}
+        columns = {}
+        for output in outputs:
+            column = columns[output.name] = dataset[output.name]
+            path, dataset_name = DataEntry.split_dataset_name_from_path(column.path)
+            path_parts = tuple(DataColumn.path_split_re.split(path))
+            keys[output.name] = (path_parts, dataset_name)
+        return cls(keys=keys, columns=columns)
+
+    def existing(self, row: arcana.core.data.row.DataRow) -> ty.Dict[str, DataEntry]:
+        """Looks up the entries of the outputs that already exist in the row
+
+        Parameters
+        ----------
+        row : DataRow
+            the row to look up the outputs in, which should be populated
+
+        Returns
+        -------
+        dict[str, DataEntry]
+            the existing entries keyed by output name
+
+        Raises
+        ------
+        ArcanaDataMatchError
+            if multiple entries of the row match the sink column of an output
+        """
+        by_key = defaultdict(list)
+        for entry in row.entries:
+            path, dataset_name = DataEntry.split_dataset_name_from_path(entry.path)
+            parts = tuple(DataColumn.path_split_re.split(path))
+            for length in self._lengths:
+                by_key[(parts[:length], dataset_name)].append(entry)
+                if self._any_dataset:
+                    by_key[(parts[:length], "*")].append(entry)
+        existing = {}
+        for name, key in self.keys.items():
+            candidates = by_key.get(key)
+            if not candidates:
+                continue
+            column = self.columns[name]
+            # Check the datatypes of the candidates, and that they aren't ambiguous
+            matches = column.matcher.filter(candidates)
+            if matches:
+                existing[name] = column.select_entry_from_matches(row, matches)
+        return existing
+
+
+@attrs.define
+class ProcessingPlan:
+    """The rows of a dataset that need to be processed to produce the outputs of one
+    or more pipelines, determined from an index of the outputs that already exist in
+    each row and the provenance stored alongside them
+
+    Parameters
+    ----------
+    ids : list[str]
+        the IDs of the rows to process, i.e. rows where none of the outputs exist or
+        all the existing outputs are stale
+    cant_process : list[str]
+        the IDs of the rows where only some of the outputs exist
+    stale : list[str]
+        the IDs of the rows to process because the provenance of their existing
+        outputs doesn't match that of the pipelines, or their inputs have changed
+        since the outputs were derived (a subset of `ids`)
+    timings : dict[str, float]
+        the time (in secs) spent in each phase of the planning
+    """
+
+    ids: ty.List[str] = attrs.field(factory=list)
+    cant_process: ty.List[str] = attrs.field(factory=list)
+    stale: ty.List[str] = attrs.field(factory=list)
+    timings: ty.Dict[str, float] = attrs.field(factory=dict)
+
+    PHASES = ("list", "populate", "index", "provenance", "checksums")
+
+    @classmethod
+    def build(
+        cls,
+        dataset: arcana.core.data.set.base.Dataset,
+        row_frequency: DataSpace,
+        outputs: ty.List[PipelineField],
+        requested_ids: ty.Optional[ty.List[str]] = None,
+        provenance: ty.Optional[ty.Dict[str, ty.Dict[str, ty.Any]]] = None,
+        check_inputs: bool = True,
+        max_workers: ty.Optional[int] = None,
+    ) -> "ProcessingPlan":
+        """Determines the rows that need to be processed. The rows are checked page by
+        page as they are listed by the store, with the entries of each page retrieved
+        in a single batch and the provenance of the existing outputs retrieved in bulk
+        (concurrently for remote stores)
+
+        Parameters
+        ----------
+        dataset : Dataset
+            the dataset to plan the processing of
+        row_frequency : DataSpace
+            the frequency of the rows to process
+        outputs : list[PipelineField]
+            the outputs of the pipeline(s)
+        requested_ids : list[str], optional
+            the IDs of the rows to consider, all rows by default
+        provenance : dict[str, dict[str, Any]], optional
+            the expected provenance of the outputs keyed by output name. Existing
+            outputs with stored provenance that doesn't match are treated as stale.
+            Provenance isn't checked if not provided
+        check_inputs : bool
+            whether to also treat outputs as stale if the checksums of the inputs
+            recorded in their provenance don't match the current inputs
+        max_workers : int, optional
+            the maximum number of provenance records to retrieve concurrently
+
+        Returns
+        -------
+        ProcessingPlan
+            the plan
+        """
+        plan = cls(timings={p: 0.0 for p in cls.PHASES})
+        index = OutputIndex.compile(dataset, outputs)
+        store = dataset.store
+        if requested_ids is None:
+            # Rows are checked in pages as they are listed by the store
+            pages = iter(dataset.iter_row_pages(row_frequency))
+        else:
+            pages = iter(
+                [dataset.rows_by_ids(row_frequency, requested_ids, ignore_missing=True)]
+            )
+        start = time.monotonic()
+        while True:
+            try:
+                rows = next(pages)
+            except StopIteration:
+                break
+            listed = time.monotonic()
+            plan.timings["list"] += listed - start
+            # Retrieve the entries of all rows in the page in a single batch
+            arcana.core.data.row.DataRow.populate(rows)
+            populated = time.monotonic()
+            plan.timings["populate"] += populated - listed
+            existing = [index.existing(row) for row in rows]
+            indexed = time.monotonic()
+            plan.timings["index"] += indexed - populated
+            stale = set()
+            recorded = {}
+            if provenance:
+                to_check = [
+                    (i, name, entry)
+                    for i, row_existing in enumerate(existing)
+                    for name, entry in row_existing.items()
+                    if name in provenance
+                ]
+                stored = store.get_provenances(
+                    [e for _, _, e in to_check], max_workers=max_workers
+                )
+                for (i, name, _), stored_prov in zip(to_check, stored):
+                    if not cls.provenance_matches(stored_prov, provenance[name]):
+                        stale.add(i)
+                    elif check_inputs and stored_prov and stored_prov.get("inputs"):
+                        recorded.setdefault(i, {}).update(stored_prov["inputs"])
+            checked = time.monotonic()
+            plan.timings["provenance"] += checked - indexed
+            if recorded:
+                # Rows whose inputs have changed since their outputs were derived are
+                # also stale
+                stale.update(
+                    cls.changed_inputs(
+                        store,
+                        rows,
+                        {i: c for i, c in recorded.items() if i not in stale},
+                        max_workers=max_workers,
+                    )
+                )
+            start = time.monotonic()
+            plan.timings["checksums"] += start - checked
+            for i, (row, row_existing) in enumerate(zip(rows, existing)):
+                if i in stale:
+                    # All outputs of stale rows are derived again
+                    plan.ids.append(row.id)
+                    plan.stale.append(row.id)
+                elif not row_existing:
+                    plan.ids.append(row.id)
+                elif len(row_existing) < len(outputs):
+                    plan.cant_process.append(row.id)
+        logger.info(
+            "Planned processing of %s rows of %s (%s stale), can't process %s rows "
+            "with partially present outputs. Timings: %s",
+            len(plan.ids),
+            dataset,
+            len(plan.stale),
+            len(plan.cant_process),
+            ", ".join(f"{p}={t:.3f}s" for p, t in plan.timings.items()),
+        )
+        return plan
+
+    @classmethod
+    def changed_inputs(
+        cls,
+        store: "arcana.core.data.store.DataStore",
+        rows: ty.List[arcana.core.data.row.DataRow],
+        recorded: ty.Dict[int, ty.Dict[str, str]],
+        max_workers: ty.Optional[int] = None,
+    ) -> ty.Set[int]:
+        """Determines which rows have inputs that have changed since their outputs
+        were derived, by comparing the checksums of the inputs recorded in the
+        provenance of the outputs against the checksums of the current inputs
+
+        Parameters
+        ----------
+        store : DataStore
+            the store the rows are in
+        rows : list[DataRow]
+            the rows to check
+        recorded : dict[int, dict[str, str]]
+            the recorded checksums of the inputs keyed by input name, keyed by the
+            index of the row in `rows`
+        max_workers : int, optional
+            the maximum number of checksums to retrieve concurrently
+
+        Returns
+        -------
+        set[int]
+            the indices of the rows that have changed inputs
+        """
+        to_checksum = []
+        for i, checksums in recorded.items():
+            for inpt_name, checksum in checksums.items():
+                try:
+                    entry = rows[i].cell(inpt_name).entry
+                except (ArcanaNameError, ArcanaDataMatchError):
+                    continue  # input can't be checked, so is assumed to be unchanged
+                if entry is not None:
+                    to_checksum.append((i, entry, checksum))
+        current = store.get_entry_checksums(
+            [e for _, e, _ in to_checksum], max_workers=max_workers
+        )
+        return {i for (i, _, c), cur in zip(to_checksum, current) if c != cur}
+
+    @classmethod
+    def provenance_matches(
+        cls,
+        stored: ty.Optional[ty.Dict[str, ty.Any]],
+        expected: ty.Dict[str, ty.Any],
+    ) -> bool:
+        """Whether the provenance stored with an existing output matches the expected
+        provenance. Outputs without stored provenance (e.g. derived before provenance
+        was recorded) are assumed to match
+
+        Parameters
+        ----------
+        stored : dict[str, Any] or None
+            the provenance stored with the output
+        expected : dict[str, Any]
+            the provenance of the pipeline that produces the output
+
+        Returns
+        -------
+        bool
+            whether the provenance matches
+        """
+        if stored is None:
+            return True
+        return all(stored.get(k) == v for k, v in expected.items())
+
+
 @pydra.mark.task
 @pydra.mark.annotate({"return": {"ids": ty.List[str], "cant_process": ty.List[str]}})
 def to_process(
@@ -525,25 +1046,26 @@ def to_process(
     row_frequency: DataSpace,
     outputs: ty.List[PipelineField],
     requested_ids: ty.Union[ty.List[str], None],
-    parameterisation: ty.Dict[str, ty.Any],
+    parameterisation: ty.Optional[ty.Dict[str, ty.Any]] = None,
+    provenance: ty.Optional[ty.Dict[str, ty.Dict[str, ty.Any]]] = None,
+    check_inputs: bool = True,
 ):
-    if requested_ids is None:
-        requested_ids = dataset.row_ids(row_frequency)
-    ids = []
-    cant_process = []
-    for row in dataset.rows(row_frequency, ids=requested_ids):
-        # TODO: Should check provenance of existing rows to see if it matches
-        empty = [row.cell(o.name).is_empty for o in outputs]
-        if all(empty):
-            ids.append(row.id)
-        elif any(empty):
-            cant_process.append(row.id)
+    plan = ProcessingPlan.build(
+        dataset,
+        row_frequency,
+        outputs,
+        requested_ids=requested_ids,
+        provenance=provenance,
+        check_inputs=check_inputs,
+    )
     logger.debug(
-        "Found %s ids to process, and can't process %s due to partially present outputs",
-        ids,
-        cant_process,
+        "Found %s ids to process (of which %s are stale), and can't process %s due to "
+        "partially present outputs",
+        plan.ids,
+        plan.stale,
+        plan.cant_process,
     )
-    return ids, cant_process
+    return plan.ids, plan.cant_process
 
 
 def source_items(
@@ -552,6 +1074,12 @@ def source_items(
     id: str,
     inputs: ty.List[PipelineField],
     parameterisation: dict,
+    sourcing: str = "path",
+    verify_sourced: bool = False,
+    cached_conversions: ty.Optional[ty.List[str]] = None,
+    converter_args: ty.Optional[ty.Dict[str, dict]] = None,
+    persist_conversions: bool = False,
+    track_inputs: bool = False,
 ):
     """Selects the items from the dataset corresponding to the input
     sources and retrieves them from the store to a cache on
@@ -566,13 +1094,35 @@ def source_items(
     id : str
         the ID of the row to source from
     parameterisation : dict
-        provenance information... can't remember why this was used here...
+        provenance of the pipeline, which is passed through to the sink node to be
+        stored alongside the outputs
+    sourcing : str
+        how input file-sets are passed to the pipeline, "path", "symlink" or
+        "hardlink" (see ``Pipeline.sourcing``)
+    verify_sourced : bool
+        whether to record the checksums of staged input file-sets, so the sink can
+        check they haven't been modified by the pipeline
+    cached_conversions : list[str], optional
+        the names of the inputs to convert to the datatypes required by the pipeline
+        via the conversion cache of the store
+    converter_args : dict[str, dict], optional
+        keyword arguments passed to the converters of the inputs
+    persist_conversions : bool
+        whether to save the converted inputs back into the store
+    track_inputs : bool
+        whether to record the checksums of the inputs in the provenance
     """
     logger.debug("Sourcing %s", inputs)
     provenance = copy(parameterisation)
     sourced = []
-    row = dataset.row(row_frequency, id)
-    with dataset.store.connection:
+    staged_checksums = {}
+    with dataset.tree, dataset.store.connection:
+        row = dataset.row(row_frequency, id)
+        # Retrieve the items of all inputs concurrently where supported by the store
+        dataset.prefetch(
+            [i.name for i in inputs if i.datatype != arcana.core.data.row.DataRow],
+            ids=[id],
+        )
         missing_inputs = {}
         for inpt in inputs:
             # If the required datatype is of type DataRow then provide the whole
@@ -581,15 +1131,194 @@ def source_items(
                 sourced.append(row)
                 continue
             try:
-                sourced.append(row[inpt.name])
+                item = row[inpt.name]
             except ArcanaDataMatchError as e:
                 missing_inputs[inpt.name] = str(e)
+                continue
+            if cached_conversions and inpt.name in cached_conversions:
+                item = convert_cached(
+                    row,
+                    inpt,
+                    item,
+                    (converter_args or {}).get(inpt.name, {}),
+                    persist=persist_conversions,
+                )
+            if sourcing != "path":
+                if verify_sourced:
+                    staged_checksums.update(fileset_checksums(item))
+                # Stage the input into the work directory of the task (Pydra runs
+                # tasks within their output directories)
+                item = stage_fileset(
+                    item, Path.cwd() / "staged" / path2varname(inpt.name), sourcing
+                )
+            sourced.append(item)
         if missing_inputs:
             raise ArcanaDataMatchError("\n\n" + "\n\n".join(missing_inputs.values()))
-    return tuple(sourced) + (provenance,)
+        if track_inputs and provenance is not None:
+            # Record the checksums of the inputs in the same row, so the outputs can be
+            # derived again if the inputs change
+            checksummed = [
+                i.name
+                for i in inputs
+                if i.datatype != arcana.core.data.row.DataRow
+                and dataset[i.name].row_frequency == row_frequency
+            ]
+            provenance["inputs"] = dict(
+                zip(
+                    checksummed,
+                    dataset.store.get_entry_checksums(
+                        [row.cell(n).entry for n in checksummed]
+                    ),
+                )
+            )
+    return tuple(sourced) + (provenance, staged_checksums)
+
 
+def convert_cached(
+    row: arcana.core.data.row.DataRow,
+    inpt: PipelineField,
+    item: FileSet,
+    converter_args: ty.Dict[str, ty.Any],
+    persist: bool = False,
+) -> FileSet:
+    """Converts an input file-set to the datatype required by a pipeline via the
+    conversion cache of the store, reusing previous conversions of the same file-set
+    with the same converter arguments
 
-def sink_items(dataset, row_frequency, id, provenance, **to_sink):
+    Parameters
+    ----------
+    row : DataRow
+        the row the input is sourced from
+    inpt : PipelineField
+        the input to convert
+    item : FileSet
+        the file-set to convert
+    converter_args : dict[str, Any]
+        keyword arguments passed to the converter
+    persist : bool
+        whether to save the converted file-set back into the store, as a derivative of
+        the hidden "__converted__" dataset, and reuse it from there
+
+    Returns
+    -------
+    FileSet
+        the converted file-set
+    """
+    store = row.dataset.store
+    cache = store.conversion_cache(row.dataset)
+    checksum = store.get_entry_checksums([row.cell(inpt.name).entry])[0]
+    key = cache.key(checksum, inpt.datatype, converter_args)
+    persisted = None
+    if persist:
+        name = path2varname(inpt.name)
+        # Stores can append extensions to the paths of file-set entries
+        persisted = next(
+            (
+                e
+                for e in row.entries
+                if e.dataset_name == CONVERTED_INPUTS_DATASET
+                and DataColumn.path_split_re.split(e.base_path)[0] == name
+            ),
+            None,
+        )
+        if persisted is not None:
+            stored = store.get_provenance(persisted)
+            if stored is not None and stored.get("conversion") == key:
+                return persisted.get_item(inpt.datatype)
+    converted = cache.get(key, inpt.datatype)
+    if converted is None:
+        logger.debug("Converting %s to %s for %s", item, inpt.datatype, row)
+        # Converters are run as Pydra tasks, which can't be submitted from within the
+        # event loop that the sourcing task is running in, so they are run in a
+        # separate thread
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            converted = executor.submit(
+                inpt.datatype.convert, item, **converter_args
+            ).result()
+        converted = cache.put(key, converted)
+    if persist:
+        if persisted is None:
+            persisted = store.create_entry(
+                f"{name}@{CONVERTED_INPUTS_DATASET}", inpt.datatype, row
+            )
+        store.put_many([(converted, persisted)], provenance={"conversion": key})
+    return converted
+
+
+def stage_fileset(
+    item: ty.Union[DataType, ty.List[DataType]],
+    stage_dir: Path,
+    sourcing: str,
+) -> ty.Union[DataType, ty.List[DataType]]:
+    """Stages a file-set (or list of file-sets) into a directory as links to the
+    original files. Items that aren't file-sets are returned unchanged. Note that the
+    links share the original files, so modifying the staged files in-place modifies
+    the originals (see ``fileset_checksums`` to detect this)
+
+    Parameters
+    ----------
+    item : DataType or list[DataType]
+        the item(s) to stage
+    stage_dir : Path
+        the directory to stage the file-set(s) in
+    sourcing : str
+        the type of links to stage the files with, "symlink" or "hardlink". Hard-links
+        fall back to symlinks where they aren't supported (e.g. across devices)
+
+    Returns
+    -------
+    DataType or list[DataType]
+        the staged item(s)
+    """
+    if isinstance(item, list):
+        return [
+            stage_fileset(i, stage_dir / str(n), sourcing) for n, i in enumerate(item)
+        ]
+    if not isinstance(item, FileSet):
+        return item
+    if sourcing == "hardlink":
+        mode = FileSet.CopyMode.hardlink
+    else:
+        mode = FileSet.CopyMode.symlink
+    copy_kwargs = {"trim": False, "make_dirs": True, "overwrite": True}
+    try:
+        return item.copy(stage_dir, mode=mode, **copy_kwargs)
+    except OSError as e:
+        if mode != FileSet.CopyMode.hardlink or e.errno not in (
+            errno.EXDEV,
+            errno.EPERM,
+            errno.EMLINK,
+        ):
+            raise
+        logger.debug("Could not hard-link %s (%s), symlinking instead", item, e)
+        shutil.rmtree(stage_dir)
+        return item.copy(stage_dir, mode=FileSet.CopyMode.symlink, **copy_kwargs)
+
+
+def fileset_checksums(item: ty.Union[DataType, ty.List[DataType]]) -> ty.Dict[str, str]:
+    """Calculates the checksums of the files of a file-set (or list of file-sets)
+
+    Parameters
+    ----------
+    item : DataType or list[DataType]
+        the item(s) to calculate the checksums of. Items that aren't file-sets don't
+        have any files
+
+    Returns
+    -------
+    dict[str, str]
+        the checksums of the files keyed by their absolute paths
+    """
+    if isinstance(item, list):
+        return {p: c for i in item for p, c in fileset_checksums(i).items()}
+    if not isinstance(item, FileSet):
+        return {}
+    parent = Path(item.parent).absolute()
+    checksums = FileHasher().hash_files(item.fspaths, relative_to=parent)
+    return {str(parent / p): c for p, c in checksums.items()}
+
+
+def sink_items(dataset, row_frequency, id, provenance, staged_checksums, **to_sink):
     """Stores items generated by the pipeline back into the store
 
     Parameters
@@ -602,14 +1331,39 @@ def sink_items(dataset, row_frequency, id, provenance, **to_sink):
         the ID of the row to source from
     provenance : dict
         provenance information to be stored alongside the generated data
+    staged_checksums : dict[str, str]
+        the checksums of the original files of the input file-sets staged for the
+        pipeline, keyed by their paths, which are checked to ensure the pipeline
+        hasn't modified them through the links
     **to_sink : dict[str, DataType]
         data items to be stored in the data store
     """
     logger.debug("Sinking %s", to_sink)
+    if staged_checksums:
+        hasher = FileHasher()
+        modified = [
+            p
+            for p, c in staged_checksums.items()
+            if not Path(p).exists() or hasher.hash_file(Path(p)) != c
+        ]
+        if modified:
+            raise ArcanaError(
+                f"The pipeline modified the following input files of the {id} row "
+                "in-place through the links they were staged with, so its outputs "
+                "won't be stored: " + ", ".join(modified)
+            )
     row = dataset.row(row_frequency, id)
-    with dataset.store.connection:
+    store = dataset.store
+    with store.connection, store.transaction:
+        items = []
         for outpt_name, output in to_sink.items():
-            row.cell(outpt_name).item = output
+            cell = row.cell(outpt_name)
+            if cell.is_empty:
+                cell.entry = store.create_entry(cell.column.path, cell.datatype, row)
+            items.append((cell.datatype(output), cell.entry))
+        # Put all the outputs and their provenance in a single transaction, uploading
+        # them concurrently where supported by the store
+        store.put_many(items, provenance=provenance)
     return id
 
 
@@ -1,11 +1,22 @@
+import os
 import zipfile
 import tempfile
 from pathlib import Path
+import pytest
 from fileformats.text import TextFile
 from fileformats.application import Zip
 from arcana.testing import TestDataSpace
 from arcana.common import DirTree
 from conftest import TEST_DATASET_BLUEPRINTS
+from arcana.core.exceptions import ArcanaDataMatchError
+from arcana.core.analysis.pipeline import (
+    Pipeline,
+    PipelineField,
+    OutputIndex,
+    ProcessingPlan,
+    stage_fileset,
+    fileset_checksums,
+)
 from arcana.testing.tasks import concatenate
 
 
@@ -69,3 +80,323 @@ def test_pipeline_with_implicit_conversion(work_dir):
         with open(tmp_dir / "out_file.txt") as f:
             contents = f.read()
         assert contents == "\n".join(["file1.zip", "file2.zip"] * 2)
+
+
+def test_cached_conversions(work_dir, monkeypatch):
+    """Converted inputs are cached and reused by other pipelines"""
+    dataset = TEST_DATASET_BLUEPRINTS["concatenate_zip_test"].make_dataset(
+        DirTree(), work_dir / "dataset"
+    )
+
+    dataset.add_source("file1", Zip[TextFile])
+    dataset.add_source("file2", Zip[TextFile])
+    dataset.add_sink("deriv1", TextFile)
+    dataset.add_sink("deriv2", TextFile)
+
+    conversions = []
+    convert = TextFile.convert.__func__
+
+    def counting_convert(cls, fileset, **kwargs):
+        conversions.append(fileset)
+        return convert(cls, fileset, **kwargs)
+
+    monkeypatch.setattr(TextFile, "convert", classmethod(counting_convert))
+
+    for i, persist in ((1, False), (2, True)):
+        dataset.apply_pipeline(
+            name=f"pipeline{i}",
+            workflow=concatenate(name="concatenate"),
+            inputs=[("file1", "in_file1", TextFile), ("file2", "in_file2", TextFile)],
+            outputs=[(f"deriv{i}", "out_file", TextFile)],
+            row_frequency=TestDataSpace.abcd,
+            cache_conversions=True,
+            persist_conversions=persist,
+        )
+    dataset.derive("deriv1", cache_dir=work_dir / "cache1", plugin="serial")
+    assert conversions
+    n_conversions = len(conversions)
+    dataset.derive("deriv2", cache_dir=work_dir / "cache2", plugin="serial")
+    # The conversions are reused from the cache by the second pipeline
+    assert len(conversions) == n_conversions
+    for deriv in ("deriv1", "deriv2"):
+        for item in dataset[deriv]:
+            with open(item.fspath) as f:
+                assert f.read() == "\n".join(["file1.zip", "file2.zip"])
+    with dataset.tree:
+        row = dataset.row("abcd", "a0b0c0d0")
+        assert any(
+            e.dataset_name == "__converted__" and e.base_path.startswith("file1")
+            for e in row.entries
+        )
+    # The size of the conversion cache is bounded by the store
+    assert dataset.store.conversion_cache(dataset).manager.max_size is None
+    bounded = DirTree(conversion_cache_max_size=2**20).conversion_cache(dataset)
+    assert bounded.manager.max_size == 2**20
+
+
+def test_fused_derive(work_dir):
+    """Two pipelines are fused into a single workflow, with the output of the first
+    passed directly to the second without being sourced back from the store"""
+    dataset = TEST_DATASET_BLUEPRINTS["concatenate_test"].make_dataset(
+        DirTree(), work_dir / "dataset"
+    )
+
+    dataset.add_source("file1", TextFile)
+    dataset.add_source("file2", TextFile)
+    dataset.add_sink("deriv1", TextFile)
+    dataset.add_sink("deriv2", TextFile)
+
+    dataset.apply_pipeline(
+        name="first_pipeline",
+        workflow=concatenate(name="concatenate"),
+        inputs=[("file1", "in_file1"), ("file2", "in_file2")],
+        outputs=[("deriv1", "out_file")],
+        row_frequency=TestDataSpace.abcd,
+    )
+    dataset.apply_pipeline(
+        name="second_pipeline",
+        workflow=concatenate(name="concatenate"),
+        inputs=[("deriv1", "in_file1"), ("file2", "in_file2")],
+        outputs=[("deriv2", "out_file")],
+        row_frequency=TestDataSpace.abcd,
+    )
+
+    workflow = Pipeline.fuse(
+        [dataset.pipelines["first_pipeline"], dataset.pipelines["second_pipeline"]]
+    )
+    assert workflow.name == "first_pipeline__second_pipeline"
+
+    dataset.derive(
+        "deriv2",
+        ids=["a0b0c0d0"],
+        fused=True,
+        cache_dir=work_dir / "pipeline-cache",
+        plugin="serial",
+    )
+    with dataset.tree:
+        assert dataset.row("abcd", "a0b0c0d1").cell("deriv1").is_empty
+        assert dataset.row("abcd", "a0b0c0d1").cell("deriv2").is_empty
+    dataset.derive(
+        "deriv2", fused=True, cache_dir=work_dir / "pipeline-cache", plugin="serial"
+    )
+
+    for item in dataset["deriv1"]:
+        with open(item.fspath) as f:
+            assert f.read() == "\n".join(["file1.txt", "file2.txt"])
+    for item in dataset["deriv2"]:
+        with open(item.fspath) as f:
+            assert f.read() == "\n".join(["file1.txt", "file2.txt", "file2.txt"])
+
+
+def test_dilate_mixed_type_ids(work_dir):
+    """Requested IDs that can't be compared with each other (e.g. None or integers
+    mixed with strings) are still dilated to the IDs of the rows each pipeline
+    needs to process"""
+    dataset = TEST_DATASET_BLUEPRINTS["concatenate_test"].make_dataset(
+        DirTree(), work_dir / "dataset"
+    )
+    dataset.add_source("file1", TextFile)
+    dataset.add_source("file2", TextFile)
+    dataset.add_sink("deriv1", TextFile)
+    dataset.add_sink("deriv2", TextFile)
+    for name, in_name, out_name in [
+        ("first_pipeline", "file1", "deriv1"),
+        ("second_pipeline", "deriv1", "deriv2"),
+    ]:
+        dataset.apply_pipeline(
+            name=name,
+            workflow=concatenate(name="concatenate"),
+            inputs=[(in_name, "in_file1"), ("file2", "in_file2")],
+            outputs=[(out_name, "out_file")],
+            row_frequency=TestDataSpace.abcd,
+        )
+    pipelines = [
+        dataset.pipelines["first_pipeline"],
+        dataset.pipelines["second_pipeline"],
+    ]
+    with dataset.tree:
+        stage_ids = dataset._dilate_ids(
+            pipelines, [dataset["deriv2"]], ["a0b0c0d0", None, 1]
+        )
+    assert stage_ids["second_pipeline"] == [1, None, "a0b0c0d0"]
+    assert stage_ids["first_pipeline"] == ["a0b0c0d0"]
+
+
+def test_stale_outputs_rederived(work_dir):
+    """Outputs derived by a pipeline that has since been changed are detected from
+    their stored provenance and derived again"""
+    dataset = TEST_DATASET_BLUEPRINTS["concatenate_test"].make_dataset(
+        DirTree(), work_dir / "dataset"
+    )
+
+    dataset.add_source("file1", TextFile)
+    dataset.add_source("file2", TextFile)
+    dataset.add_sink("deriv", TextFile)
+
+    def apply(duplicates):
+        dataset.apply_pipeline(
+            name="test_pipeline",
+            workflow=concatenate(duplicates=duplicates, name="concatenate"),
+            inputs=[("file1", "in_file1"), ("file2", "in_file2")],
+            outputs=[("deriv", "out_file")],
+            row_frequency=TestDataSpace.abcd,
+            overwrite=True,
+        )
+
+    apply(duplicates=1)
+    dataset.derive("deriv", cache_dir=work_dir / "cache1", plugin="serial")
+    for item in dataset["deriv"]:
+        with open(item.fspath) as f:
+            assert f.read() == "\n".join(["file1.txt", "file2.txt"])
+
+    # Unchanged pipeline doesn't need to process any rows
+    pipeline = dataset.pipelines["test_pipeline"]
+    plan = ProcessingPlan.build(
+        dataset,
+        pipeline.row_frequency,
+        pipeline.outputs,
+        provenance={"deriv": pipeline.provenance},
+    )
+    assert plan.ids == [] and plan.stale == []
+
+    apply(duplicates=2)
+    dataset.derive("deriv", cache_dir=work_dir / "cache2", plugin="serial")
+    for item in dataset["deriv"]:
+        with open(item.fspath) as f:
+            assert f.read() == "\n".join(["file1.txt", "file2.txt"] * 2)
+
+
+def test_output_index(work_dir):
+    """Existing outputs are matched against the criteria of their sink columns"""
+    dataset = TEST_DATASET_BLUEPRINTS["concatenate_test"].make_dataset(
+        DirTree(), work_dir / "dataset"
+    )
+
+    dataset.add_source("file1", TextFile)
+    dataset.add_source("file2", TextFile)
+    dataset.add_sink("deriv", TextFile)
+    # A sink with the same path but a datatype that doesn't match the output
+    dataset.add_sink("deriv_zip", Zip, path="deriv@")
+
+    dataset.apply_pipeline(
+        name="test_pipeline",
+        workflow=concatenate(name="concatenate"),
+        inputs=[("file1", "in_file1"), ("file2", "in_file2")],
+        outputs=[("deriv", "out_file")],
+        row_frequency=TestDataSpace.abcd,
+    )
+    dataset.derive(
+        "deriv",
+        ids=["a0b0c0d0"],
+        cache_dir=work_dir / "pipeline-cache",
+        plugin="serial",
+    )
+    outputs = [
+        PipelineField("deriv", "out_file", TextFile),
+        PipelineField("deriv_zip", "out_file", Zip),
+    ]
+    with dataset.tree:
+        index = OutputIndex.compile(dataset, outputs)
+        row = dataset.row("abcd", "a0b0c0d0")
+        assert list(index.existing(row)) == ["deriv"]
+        deriv_path = Path(row["deriv"].fspath)
+    # Add another entry that matches the path of the sink
+    with open(deriv_path.parent / "deriv.copy.txt", "w") as f:
+        f.write("copy")
+    with dataset.tree:
+        with pytest.raises(ArcanaDataMatchError, match="Found multiple matches"):
+            index.existing(dataset.row("abcd", "a0b0c0d0"))
+
+
+def test_changed_inputs_rederived(work_dir):
+    """Only rows with inputs that have changed since their outputs were derived are
+    derived again"""
+    dataset = TEST_DATASET_BLUEPRINTS["concatenate_test"].make_dataset(
+        DirTree(), work_dir / "dataset"
+    )
+
+    dataset.add_source("file1", TextFile)
+    dataset.add_source("file2", TextFile)
+    dataset.add_sink("deriv", TextFile)
+
+    pipeline = dataset.apply_pipeline(
+        name="test_pipeline",
+        workflow=concatenate(name="concatenate"),
+        inputs=[("file1", "in_file1"), ("file2", "in_file2")],
+        outputs=[("deriv", "out_file")],
+        row_frequency=TestDataSpace.abcd,
+        track_inputs=True,
+    )
+    dataset.derive("deriv", cache_dir=work_dir / "cache1", plugin="serial")
+
+    changed_id = "a0b0c0d1"
+    with open(dataset.row("abcd", changed_id)["file1"].fspath, "w") as f:
+        f.write("changed.txt")
+
+    plan = ProcessingPlan.build(
+        dataset,
+        pipeline.row_frequency,
+        pipeline.outputs,
+        provenance={"deriv": pipeline.provenance},
+    )
+    assert plan.ids == [changed_id] and plan.stale == [changed_id]
+
+    dataset.derive("deriv", cache_dir=work_dir / "cache2", plugin="serial")
+    for row in dataset.rows("abcd"):
+        with open(row["deriv"].fspath) as f:
+            file1 = "changed.txt" if row.id == changed_id else "file1.txt"
+            assert f.read() == "\n".join([file1, "file2.txt"])
+
+
+@pytest.mark.parametrize("sourcing", ["symlink", "hardlink"])
+def test_staged_sourcing(work_dir, sourcing):
+    dataset = TEST_DATASET_BLUEPRINTS["concatenate_test"].make_dataset(
+        DirTree(), work_dir / "dataset"
+    )
+
+    dataset.add_source("file1", TextFile)
+    dataset.add_source("file2", TextFile)
+    dataset.add_sink("deriv", TextFile)
+
+    dataset.apply_pipeline(
+        name="test_pipeline",
+        workflow=concatenate(name="concatenate"),
+        inputs=[("file1", "in_file1"), ("file2", "in_file2")],
+        outputs=[("deriv", "out_file")],
+        row_frequency=TestDataSpace.abcd,
+        sourcing=sourcing,
+        verify_sourced=True,
+    )
+    dataset.derive("deriv", cache_dir=work_dir / "pipeline-cache", plugin="serial")
+    for item in dataset["deriv"]:
+        with open(item.fspath) as f:
+            assert f.read() == "\n".join(["file1.txt", "file2.txt"])
+
+    # The inputs passed to the pipeline are links to the files in the store rather
+    # than copies of them
+    with dataset.tree:
+        stored = {
+            os.stat(row[n].fspath).st_ino: row[n].fspath
+            for row in dataset.rows("abcd")
+            for n in ("file1", "file2")
+        }
+    staged_paths = [
+        p for p in (work_dir / "pipeline-cache").rglob("staged/*/*") if p.is_file()
+    ]
+    assert len(staged_paths) == len(stored)
+    for staged_path in staged_paths:
+        original_path = stored[os.stat(staged_path).st_ino]
+        assert os.path.samefile(staged_path, original_path)
+        assert staged_path.is_symlink() == (sourcing == "symlink")
+
+    original = dataset.row("abcd", "a0b0c0d0")["file1"]
+    # Sourcing doesn't change the permissions of the original files
+    assert os.access(original.fspath, os.W_OK)
+    staged = stage_fileset(original, work_dir / "staged", sourcing)
+    assert staged.fspath != original.fspath
+    assert os.path.samefile(staged.fspath, original.fspath)
+    # Modifications made through the links are detected from the checksums
+    checksums = fileset_checksums(original)
+    with open(staged.fspath, "a") as f:
+        f.write("modified")
+    assert fileset_checksums(original) != checksums
@@ -295,11 +295,16 @@ def missing_items(dataset_locator, column_names):
     dataset = Dataset.load(dataset_locator)
     if not column_names:
         column_names = [n for n, c in dataset.columns.items() if not c.is_sink]
-    for column_name in column_names:
-        column = dataset.columns[column_name]
-        empty_cells = [c for c in column.cells() if c.is_empty]
-        if empty_cells:
-            click.echo(f"'{column.name}': " + ", ".join(c.row.id for c in empty_cells))
+    # Keep the data tree open so rows populated for one column can be reused by the
+    # next, the entries of each row are retrieved in batches by `DataColumn.cells()`
+    with dataset.tree:
+        for column_name in column_names:
+            column = dataset.columns[column_name]
+            empty_cells = [c for c in column.cells() if c.is_empty]
+            if empty_cells:
+                click.echo(
+                    f"'{column.name}': " + ", ".join(c.row.id for c in empty_cells)
+                )
 
 
 @dataset.command(
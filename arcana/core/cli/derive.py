@@ -47,7 +47,16 @@ COLUMNS are the names of the sink columns to derive""",
     default="info",
     help=("The level of detail logging information is presented"),
 )
-def derive_column(dataset_locator, columns, work, plugin, loglevel):
+@click.option(
+    "--fused/--staged",
+    default=False,
+    help=(
+        "Whether to fuse consecutive pipelines of the same row frequency into a single "
+        "workflow, so that each row flows through all of them without waiting for the "
+        "other rows, instead of running each pipeline over all rows in turn"
+    ),
+)
+def derive_column(dataset_locator, columns, work, plugin, loglevel, fused):
 
     logging.basicConfig(level=getattr(logging, loglevel.upper()))
 
@@ -63,7 +72,7 @@ def derive_column(dataset_locator, columns, work, plugin, loglevel):
 
     set_loggers(loglevel)
 
-    dataset.derive(*columns, cache_dir=pipeline_cache, plugin=plugin)
+    dataset.derive(*columns, cache_dir=pipeline_cache, fused=fused, plugin=plugin)
 
     columns_str = "', '".join(columns)
     logger.info(f"Derived data for '{columns_str}' column(s) successfully")
@@ -2,7 +2,7 @@ from operator import itemgetter
 import click
 from arcana.core.data.store import DataStore
 from arcana.core.utils.serialize import ClassResolver
-from arcana.core.utils.misc import get_home_dir
+from arcana.core.utils.misc import get_home_dir, parse_size
 from arcana.core.exceptions import ArcanaUsageError
 from .base import cli
 
@@ -53,6 +53,22 @@ location
     default=None,
     help="The location of a cache dir to download local copies of remote data",
 )
+@click.option(
+    "--cache-max-size",
+    default=None,
+    help=(
+        "The maximum size of the cache dir, above which the least recently used data "
+        "is evicted, e.g. 500G. Unlimited by default"
+    ),
+)
+@click.option(
+    "--cache-dedup/--no-cache-dedup",
+    default=False,
+    help=(
+        "Whether to deduplicate identical files in the cache by hard-linking them to "
+        "a single copy"
+    ),
+)
 @click.option(
     "--race-condition-delay",
     "-d",
@@ -71,7 +87,7 @@ location
     default=None,
     help="Additional key-word arguments that are passed to the store class",
 )
-def add(name, type, option, cache, **kwargs):
+def add(name, type, option, cache, cache_max_size, cache_dedup, **kwargs):
     if option is not None:
         options = dict(option)
         conflicting = set(options) & set(kwargs)
@@ -87,6 +103,10 @@ def add(name, type, option, cache, **kwargs):
             cache = get_home_dir() / "cache" / name
         cache.mkdir(parents=True, exist_ok=True)
         kwargs["cache_dir"] = cache
+        if cache_max_size is not None:
+            kwargs["cache_max_size"] = parse_size(cache_max_size)
+        if cache_dedup:
+            kwargs["cache_dedup"] = cache_dedup
     store = store_cls(name=name, **kwargs)
     store.save(name)
 
@@ -147,6 +167,38 @@ def refresh(nickname, user, password):
     store.save(nickname)
 
 
+@store.command(
+    name="trim-cache",
+    help="""Evicts the least recently used data from the cache of a remote store
+until it is smaller than its maximum size
+
+nickname
+    Nickname given to the store to trim the cache of""",
+)
+@click.argument("nickname")
+@click.option(
+    "--max-size",
+    default=None,
+    help=(
+        "The size to trim the cache to, e.g. 500G, by default the maximum size saved "
+        "with the store"
+    ),
+)
+def trim_cache(nickname, max_size):
+    store = DataStore.load(nickname)
+    if not hasattr(store, "trim_cache"):
+        raise ArcanaUsageError(f"'{nickname}' store does not have a cache to trim")
+    if max_size is not None:
+        max_size = parse_size(max_size)
+    elif store.cache_max_size is None:
+        raise ArcanaUsageError(
+            f"A maximum size for the cache of '{nickname}' needs to be provided as it "
+            "wasn't saved with the store"
+        )
+    freed = store.trim_cache(max_size)
+    click.echo(f"Freed {freed} bytes from the cache of '{nickname}'")
+
+
 @store.command(help="""List available stores that have been saved""")
 def ls():
     click.echo("Default stores\n---------------")
@@ -15,9 +15,9 @@ from .quality import DataQuality
 from .space import DataSpace
 from .cell import DataCell
 from .entry import DataEntry
+from .row import DataRow
 
 if ty.TYPE_CHECKING:  # pragma: no cover
-    from .row import DataRow
     from .set.base import Dataset
 
 
@@ -39,6 +39,9 @@ class DataColumn(metaclass=ABCMeta):
     _mismatch_log: list = attrs.field(
         default=None, eq=False, hash=False, repr=False, init=False
     )
+    _matcher: ColumnMatcher = attrs.field(
+        default=None, eq=False, hash=False, repr=False, init=False
+    )
 
     is_sink = False
 
@@ -56,7 +59,7 @@ class DataColumn(metaclass=ABCMeta):
         return self.cell(id, allow_empty=False).item
 
     def __len__(self) -> int:
-        return len(list(self.dataset.rows(self.row_frequency)))
+        return self.dataset.count_rows(self.row_frequency)
 
     def cell(self, id, allow_empty: bool = True) -> DataCell:
         return DataCell.intersection(
@@ -80,10 +83,19 @@ class DataColumn(metaclass=ABCMeta):
         cells : Iterable[DataCell]
             an iterator over all cells in the column
         """
-        return (
-            DataCell.intersection(self, row, allow_empty=allow_empty)
-            for row in self.dataset.rows(self.row_frequency)
-        )
+        if allow_empty is None:
+            allow_empty = self.is_sink
+        return self._iter_cells(allow_empty)
+
+    def _iter_cells(self, allow_empty: bool) -> ty.Iterator[DataCell]:
+        # Rows are iterated in pages as they are listed by the store, and the entries
+        # of each page are retrieved from the store in a single batch
+        for rows in self.dataset.iter_row_pages(self.row_frequency):
+            DataRow.populate(rows)
+            for row, entry in zip(
+                rows, self.match_entries(rows, allow_none=allow_empty)
+            ):
+                yield DataCell(row=row, column=self, entry=entry)
 
     @property
     def ids(self) -> ty.List[str]:
@@ -111,15 +123,68 @@ class DataColumn(metaclass=ABCMeta):
             if none or multiple items match the criteria/path of the column
             within the row
         """
+        return self._select_from_matches(
+            row, self.matcher.filter(row.entries), allow_none
+        )
+
+    def match_entries(
+        self, rows: ty.Iterable[DataRow], allow_none: bool = False
+    ) -> ty.Iterable[DataEntry]:
+        """Matches an entry from each of the data rows against the selection criteria
+        defined in the column, compiling the criteria only once for the whole batch
+
+        Parameters
+        ----------
+        rows: Iterable[DataRow]
+            the rows to match the items from
+        allow_none: bool
+            whether to return None for rows with no matches
+
+        Yields
+        ------
+        DataEntry or None
+            the data entry that matches the criteria/path for each row
+
+        Raises
+        ------
+        ArcanaDataMatchError
+            if none or multiple items match the criteria/path of the column
+            within a row
+        """
+        matcher = self.matcher
+        for row in rows:
+            yield self._select_from_matches(
+                row, matcher.filter(row.entries), allow_none
+            )
+
+    @property
+    def matcher(self) -> ColumnMatcher:
+        """The selection criteria of the column compiled into a matcher, which is
+        recompiled if any of the attributes it was compiled from are changed"""
+        key = self._matcher_key()
+        if self._matcher is None or self._matcher.key != key:
+            self._matcher = ColumnMatcher(key=key, **self._matcher_kwargs())
+        return self._matcher
+
+    def _select_from_matches(
+        self, row: DataRow, matches: ty.List[DataEntry], allow_none: bool
+    ) -> ty.Optional[DataEntry]:
+        if matches:
+            return self.select_entry_from_matches(row, matches)
+        if allow_none:
+            return None
+        raise ArcanaDataMatchError(self._match_failure_msg(row))
+
+    def _match_failure_msg(self, row: DataRow) -> str:
+        """Reruns the (uncompiled) criteria over the entries of the row, logging why
+        each of them doesn't match, to build an informative error message"""
         matches = row.entries
         self._mismatch_log = []
-        for method in self.criteria():
-            filtered = [m for m in matches if method(m)]
-            if not filtered:
-                if allow_none:
-                    return None
-                else:
-                    msg = (
+        try:
+            for method in self.criteria():
+                filtered = [m for m in matches if method(m)]
+                if not filtered:
+                    return (
                         "Did not find any entries "
                         + method.__doc__.format(self=self)
                         + self._error_msg(row, matches)
@@ -129,10 +194,23 @@ class DataColumn(metaclass=ABCMeta):
                             frmt.format(*ags) for frmt, ags in self._mismatch_log
                         )
                     )
-                    raise ArcanaDataMatchError(msg)
-            matches = filtered
-        self._mismatch_log = None
-        return self.select_entry_from_matches(row, matches)
+                matches = filtered
+        finally:
+            self._mismatch_log = None
+        return "Did not find any entries " + self._error_msg(row, matches)
+
+    def _matcher_key(self) -> tuple:
+        """The values of the attributes that the matcher is compiled from"""
+        return (self.path, self.datatype)
+
+    def _matcher_kwargs(self) -> ty.Dict[str, ty.Any]:
+        """Keyword arguments used to compile the selection criteria into a matcher"""
+        kwargs = {"datatype": self.datatype}
+        if self.path is not None:
+            path, dataset_name = DataEntry.split_dataset_name_from_path(self.path)
+            kwargs["path_parts"] = self.path_split_re.split(path)
+            kwargs["dataset_name"] = dataset_name
+        return kwargs
 
     @abstractmethod
     def criteria(self) -> ty.List[ty.Callable]:
@@ -177,7 +255,7 @@ class DataColumn(metaclass=ABCMeta):
                 entry.datatype,
             )
         try:
-            entry.get_item(self.datatype)
+            entry.row.dataset.store.check_datatype(entry, self.datatype)
         except FormatMismatchError as e:
             return self._log_mismatch(entry, "datatype does not match, {}", str(e))
         else:
@@ -309,11 +387,7 @@ class DataSource(DataColumn):
 
     def matches_path_regex(self, entry: DataEntry) -> bool:
         "that matched the path pattern '{self.path}'"
-        pattern = self.path
-        if not pattern.endswith("$"):
-            # Allow paths to match with additional text after a '/' or a '.' but not
-            # additional characters otherwise
-            pattern += r"(?:(?:/|\.).*)?$"
+        pattern = self.path_pattern
         if re.match(pattern, entry.path):
             return True
         else:
@@ -321,6 +395,15 @@ class DataSource(DataColumn):
                 entry, "entry path {} doesn't match regular expression", pattern
             )
 
+    @property
+    def path_pattern(self) -> str:
+        pattern = self.path
+        if not pattern.endswith("$"):
+            # Allow paths to match with additional text after a '/' or a '.' but not
+            # additional characters otherwise
+            pattern += r"(?:(?:/|\.).*)?$"
+        return pattern
+
     def matches_quality(self, entry: DataEntry) -> bool:
         "with an acceptable quality '{self.quality_threshold}'"
         if entry.quality >= self.quality_threshold:
@@ -343,6 +426,24 @@ class DataSource(DataColumn):
                 self.required_metadata,
             )
 
+    def _matcher_key(self) -> tuple:
+        return super()._matcher_key() + (
+            self.is_regex,
+            self.quality_threshold,
+            # copy so in-place modifications are detected
+            dict(self.required_metadata) if self.required_metadata else None,
+        )
+
+    def _matcher_kwargs(self) -> ty.Dict[str, ty.Any]:
+        kwargs = super()._matcher_kwargs()
+        if self.path is not None and self.is_regex:
+            del kwargs["path_parts"]
+            del kwargs["dataset_name"]
+            kwargs["path_regex"] = re.compile(self.path_pattern)
+        kwargs["quality_threshold"] = self.quality_threshold
+        kwargs["required_metadata"] = self.required_metadata
+        return kwargs
+
     def select_entry_from_matches(
         self, row: DataRow, matches: ty.List[DataEntry]
     ) -> DataEntry:
@@ -435,3 +536,121 @@ class DataSink(DataColumn):
         yield from super().__bytes_repr__(cache)
         yield bytes(hash_single(self.salience, cache))
         yield bytes(hash_single(self.pipeline_name, cache))
+
+
+@attrs.define
+class ColumnMatcher:
+    """The selection criteria of a column compiled into a sequence of predicates, with
+    path patterns pre-split/compiled and the datatype checks cached, so they can be
+    efficiently applied to the entries of many rows
+
+    Parameters
+    ----------
+    key : tuple
+        the values of the column attributes the matcher was compiled from, used to
+        detect when it needs to be recompiled
+    datatype : type
+        the datatype of the column
+    path_parts : list[str], optional
+        the sections of the (non-regex) path of the column
+    dataset_name : str, optional
+        the name of the dataset the path refers to (None for source data and "*" for
+        any dataset)
+    path_regex : re.Pattern, optional
+        the compiled regular expression the path of the entries must match
+    quality_threshold : DataQuality, optional
+        the minimum quality of the entries
+    required_metadata : dict[str, ty.Any], optional
+        metadata the entries are required to have
+    """
+
+    key: tuple
+    datatype: type
+    path_parts: ty.Optional[ty.List[str]] = None
+    dataset_name: ty.Optional[str] = None
+    path_regex: ty.Optional[ty.Pattern] = None
+    quality_threshold: ty.Optional[DataQuality] = None
+    required_metadata: ty.Optional[ty.Dict[str, ty.Any]] = None
+    _predicates: ty.List[ty.Callable] = attrs.field(init=False, repr=False)
+    # Whether the column datatype is a sub-type of an entry datatype
+    _subtype_cache: ty.Dict[type, bool] = attrs.field(
+        factory=dict, init=False, repr=False
+    )
+
+    def __attrs_post_init__(self):
+        # Applied in order of increasing cost, as each is only applied to the entries
+        # that have passed the previous ones
+        self._predicates = []
+        if self.path_regex is not None:
+            self._predicates.append(self.matches_path_regex)
+        elif self.path_parts is not None:
+            self._predicates.append(self.matches_path)
+        if self.quality_threshold is not None:
+            self._predicates.append(self.matches_quality)
+        if self.required_metadata is not None:
+            self._predicates.append(self.matches_metadata)
+
+    def filter(
+        self, entries: ty.Iterable[DataEntry], check_contents: bool = True
+    ) -> ty.List[DataEntry]:
+        """Filters the entries down to those that match all the criteria
+
+        Parameters
+        ----------
+        entries : Iterable[DataEntry]
+            the entries to filter
+        check_contents : bool
+            whether to check that entries of a super-type of the column datatype
+            match the column datatype, which may require their contents to be
+            downloaded. If False they are assumed to match
+
+        Returns
+        -------
+        list[DataEntry]
+            the entries that match all criteria
+        """
+        matches = list(entries)
+        for predicate in self._predicates:
+            if not matches:
+                break
+            matches = [e for e in matches if predicate(e)]
+        return [e for e in matches if self.matches_datatype(e, check_contents)]
+
+    def matches_path(self, entry: DataEntry) -> bool:
+        path, dataset_name = DataEntry.split_dataset_name_from_path(entry.path)
+        if (
+            DataColumn.path_split_re.split(path)[: len(self.path_parts)]
+            != self.path_parts
+        ):
+            return False
+        return self.dataset_name == "*" or dataset_name == self.dataset_name
+
+    def matches_path_regex(self, entry: DataEntry) -> bool:
+        return self.path_regex.match(entry.path) is not None
+
+    def matches_quality(self, entry: DataEntry) -> bool:
+        return entry.quality >= self.quality_threshold
+
+    def matches_metadata(self, entry: DataEntry) -> bool:
+        return {
+            k: entry.item_metadata[k] for k in self.required_metadata
+        } == self.required_metadata
+
+    def matches_datatype(self, entry: DataEntry, check_contents: bool = True) -> bool:
+        if entry.datatype is self.datatype:
+            return True
+        try:
+            is_subtype = self._subtype_cache[entry.datatype]
+        except KeyError:
+            is_subtype = self._subtype_cache[entry.datatype] = issubclass(
+                self.datatype, entry.datatype
+            )
+        if not is_subtype:
+            return False
+        if not check_contents:
+            return True
+        try:
+            entry.row.dataset.store.check_datatype(entry, self.datatype)
+        except FormatMismatchError:
+            return False
+        return True
@@ -1,5 +1,6 @@
 from __future__ import annotations
 import typing as ty
+from collections.abc import Mapping
 import attrs
 from arcana.core.exceptions import (
     ArcanaNameError,
@@ -16,6 +17,72 @@ if ty.TYPE_CHECKING:  # pragma: no cover
     from .set.base import Dataset
 
 
+class _NoChildren(Mapping):
+    """Read-only empty mapping, which unlike an empty mappingproxy can be pickled and
+    copied (e.g. by Pydra), and is restored as the shared instance when it is"""
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(())
+
+    def __len__(self):
+        return 0
+
+    def __repr__(self):
+        return "NO_CHILDREN"
+
+    def __reduce__(self):
+        return "NO_CHILDREN"
+
+
+# Shared by rows that don't have any child rows (e.g. leaves), so they don't each need
+# their own empty dictionary
+NO_CHILDREN = _NoChildren()
+
+
+class RowIds(Mapping):
+    """A compact, read-only mapping of the frequencies intersected by a row to its IDs
+    in each of them, which stores the IDs in a tuple and shares the positions of the
+    frequencies in the tuple between all rows of the same frequency instead of each
+    row holding its own dictionary
+
+    Parameters
+    ----------
+    positions : dict[DataSpace, int]
+        the positions of the IDs of each frequency in `values`
+    values : tuple
+        the IDs of the row in each frequency
+    """
+
+    __slots__ = ("_positions", "_values")
+
+    def __init__(self, positions: ty.Dict[DataSpace, int], values: tuple):
+        self._positions = positions
+        self._values = values
+
+    def __getitem__(self, frequency: DataSpace):
+        return self._values[self._positions[frequency]]
+
+    def __iter__(self):
+        return iter(self._positions)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, frequency):
+        return frequency in self._positions
+
+    def values(self):
+        return self._values
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
 @attrs.define(kw_only=True)
 class DataRow:
     """A "row" in a dataset "frame" where file-sets and fields can be placed, e.g.
@@ -23,9 +90,9 @@ class DataRow:
 
     Parameters
     ----------
-    ids : Dict[DataSpace, str]
+    ids : Mapping[DataSpace, str]
         The ids for the frequency of the row and all "parent" frequencies
-        within the tree
+        within the tree (rows added by the data tree store them in a ``RowIds``)
     dataset : Dataset
         A reference to the root of the data tree
     frequency : str
@@ -45,14 +112,16 @@ class DataRow:
     uri: ty.Optional[str] = None
     metadata: ty.Optional[dict] = None
 
-    # Automatically populated fields
+    # Automatically populated fields (created when they are first needed)
     children: ty.Dict[
         DataSpace, ty.Dict[ty.Union[str, ty.Tuple[str]], str]
-    ] = attrs.field(factory=dict, repr=False, init=False)
+    ] = attrs.field(default=NO_CHILDREN, repr=False, init=False)
     _entries_dict: ty.Dict[str, DataEntry] = attrs.field(
         default=None, init=False, repr=False
     )
-    _cells: ty.Dict[str, DataCell] = attrs.field(factory=dict, init=False, repr=False)
+    _cells: ty.Optional[ty.Dict[str, DataCell]] = attrs.field(
+        default=None, init=False, repr=False
+    )
 
     @dataset.validator
     def dataset_validator(self, _, dataset):
@@ -95,7 +164,7 @@ class DataRow:
     def cell(self, column_name: str, allow_empty: ty.Optional[bool] = None) -> DataCell:
         try:
             cell = self._cells[column_name]
-        except KeyError:
+        except (KeyError, TypeError):
             pass
         else:
             if not cell.is_empty:
@@ -118,6 +187,8 @@ class DataRow:
                 " frequency",
             )
         cell = DataCell.intersection(column=column, row=self, allow_empty=allow_empty)
+        if self._cells is None:
+            self._cells = {}
         self._cells[column_name] = cell
         return cell
 
@@ -136,9 +207,47 @@ class DataRow:
     def entries_dict(self):
         if self._entries_dict is None:
             self._entries_dict = {}
-            self.dataset.store.populate_row(self)
+            # Rows accessed outside of a tree context are only added to the pending
+            # updates of the manifest, which are saved together when the tree context
+            # is next exited instead of rewriting the manifest for every row
+            try:
+                self.dataset.tree.populate_entries([self])
+            except Exception:
+                self._entries_dict = None
+                raise
         return self._entries_dict
 
+    @property
+    def is_populated(self) -> bool:
+        "Whether the entries of the row have been retrieved from the store"
+        return self._entries_dict is not None
+
+    @classmethod
+    def populate(cls, rows: ty.Iterable[DataRow]):
+        """Retrieves the entries of all rows that haven't been populated already in a
+        single batch using the ``populate_rows`` method of the store, instead of one at
+        a time as they are accessed. Rows that haven't changed since they were last
+        populated are populated from the entries manifest of the data tree instead
+
+        Parameters
+        ----------
+        rows : Iterable[DataRow]
+            the rows to populate, which should all belong to the same dataset
+        """
+        to_populate = [r for r in rows if r._entries_dict is None]
+        if not to_populate:
+            return
+        for row in to_populate:
+            row._entries_dict = {}
+        tree = to_populate[0].dataset.tree
+        try:
+            tree.populate_entries(to_populate)
+        except Exception:
+            for row in to_populate:
+                row._entries_dict = None
+            raise
+        tree.save_entries_manifest()
+
     def __repr__(self):
         return f"{type(self).__name__}(id={self.id}, frequency={self.frequency})"
 
@@ -1,6 +1,7 @@
 from __future__ import annotations
 import logging
 import re
+import itertools
 import typing as ty
 from pathlib import Path
 import shutil
@@ -17,8 +18,9 @@ from arcana.core.exceptions import (
     ArcanaWrongDataSpaceError,
 )
 from ..column import DataColumn, DataSink, DataSource
+from ..row import DataRow
 from .. import store as datastore
-from ..tree import DataTree
+from ..tree import DataTree, IdInferencePlan
 from ..space import DataSpace
 from .metadata import DatasetMetadata, metadata_converter
 
@@ -136,6 +138,9 @@ class Dataset:
         factory=dict, converter=default_if_none(factory=dict), repr=False
     )
     tree: DataTree = attrs.field(factory=DataTree, init=False, repr=False, eq=False)
+    _id_inference_plan: ty.Optional[IdInferencePlan] = attrs.field(
+        default=None, init=False, repr=False, eq=False
+    )
 
     def __attrs_post_init__(self):
         self.tree.dataset = self
@@ -338,6 +343,7 @@ class Dataset:
         # "with <this-dataset>.tree" statement further up the call stack then the
         # cache won't be broken down until the highest cache statement exits
         with self.tree:
+            self.tree.populate()
             return self.tree.root
 
     @property
@@ -488,28 +494,37 @@ class Dataset:
                         f"ID ({id}) and id_kwargs ({id_kwargs}) cannot be both "
                         f"provided to `row` method of {self}"
                     )
-                try:
-                    return self.root.children[frequency][id]
-                except KeyError as e:
-                    if isinstance(id, tuple) and len(id) == self.space.ndim:
-                        # Expand ID tuple to see if it is an expansion of the ID axes
-                        # instead of a direct label for the row
-                        id_kwargs = {a: i for a, i in zip(self.space.axes(), id)}
-                    else:
-                        raise ArcanaNameError(
-                            id,
-                            f"{id} not present in data tree "
-                            f"({list(self.row_ids(frequency))})",
-                        ) from e
+                row = self._lookup_row(frequency, id)
+                if row is None:
+                    raise ArcanaNameError(
+                        id,
+                        f"{id} not present in data tree "
+                        f"({self._rows_summary(frequency)})",
+                    )
+                return row
             elif not id_kwargs:
                 raise ArcanaUsageError(
                     f"Neither ID nor id_kwargs cannot were provided `row` method of {self}"
                 )
+            axis_ids = {self.parse_frequency(f): i for f, i in id_kwargs.items()}
+            span = self.tree.layer_plan.spans[frequency]
+            if set(axis_ids) == set(span):
+                # Look up the row in the index of the axis IDs
+                try:
+                    return self.tree.axes_index(frequency)[
+                        tuple(axis_ids[a] for a in span)
+                    ]
+                except KeyError as e:
+                    raise ArcanaNameError(
+                        id_kwargs,
+                        f"{id_kwargs} not present in data tree "
+                        f"({self._rows_summary(frequency)})",
+                    ) from e
             # Iterate through the tree to find the row (i.e. tree node) matching the
             # provided IDs
             row = self.root
             cum_freq = self.space(0)
-            for freq, id in id_kwargs.items():
+            for freq, id in axis_ids.items():
                 cum_freq |= freq
                 try:
                     row = row.children[cum_freq][id]
@@ -533,7 +548,8 @@ class Dataset:
             The "frequency" of the rows, e.g. per-session, per-subject, defaults to
             leaf rows
         ids : Sequence[str or Tuple[str]]
-            The i
+            The IDs of the rows to return (IDs not present in the dataset are
+            ignored), by default all rows
 
         Returns
         -------
@@ -547,11 +563,207 @@ class Dataset:
         with self.tree:
             if frequency == self.root_freq:
                 return [self.root]
-            rows = self.root.children[frequency].values()
             if ids is not None:
-                rows = (n for n in rows if n.id in set(ids))
+                return self.rows_by_ids(frequency, ids, ignore_missing=True)
+            return self.root.children[frequency].values()
+
+    def iter_row_pages(
+        self, frequency: ty.Union[DataSpace, str, None] = None
+    ) -> ty.Iterator[ty.List[DataRow]]:
+        """Iterates over the rows of the given frequency in pages as they are added to
+        the data tree, so that, for stores that list the leaves of the tree in pages
+        (see ``DataStore.list_leaves``), the rows can be processed before the listing
+        is complete
+
+        Parameters
+        ----------
+        frequency : DataSpace or str, optional
+            The "frequency" of the rows, defaults to leaf rows
+
+        Yields
+        ------
+        list[DataRow]
+            the rows added to the tree since the previous page
+        """
+        if frequency is None:
+            frequency = max(self.space)  # "leaf" nodes of the data tree
+        else:
+            frequency = self.parse_frequency(frequency)
+        with self.tree:
+            if frequency == self.root_freq:
+                yield [self.tree.root]
+                return
+            num_yielded = 0
+            while True:
+                # Rows are only ever appended to the tree, so the rows added since the
+                # previous page are at the end
+                rows = self.tree.root.children.get(frequency, {})
+                if len(rows) > num_yielded:
+                    page = list(itertools.islice(rows.values(), num_yielded, None))
+                    num_yielded += len(page)
+                    yield page
+                if self.tree.add_next_page() is None:
+                    break
+
+    def iter_rows(
+        self, frequency: ty.Union[DataSpace, str, None] = None
+    ) -> ty.Iterator[DataRow]:
+        """Iterates over the rows of the given frequency as they are added to the
+        data tree (see ``iter_row_pages``)
+
+        Parameters
+        ----------
+        frequency : DataSpace or str, optional
+            The "frequency" of the rows, defaults to leaf rows
+
+        Yields
+        ------
+        DataRow
+            the rows of the dataset
+        """
+        for page in self.iter_row_pages(frequency):
+            yield from page
+
+    def count_rows(self, frequency: ty.Union[DataSpace, str, None] = None) -> int:
+        """Counts the rows of the given frequency, using the count provided by the
+        store if the data tree is still being populated
+
+        Parameters
+        ----------
+        frequency : DataSpace or str, optional
+            The "frequency" of the rows, defaults to leaf rows
+
+        Returns
+        -------
+        int
+            the number of rows
+        """
+        if frequency is None:
+            frequency = max(self.space)  # "leaf" nodes of the data tree
+        else:
+            frequency = self.parse_frequency(frequency)
+        if frequency == self.root_freq:
+            return 1
+        with self.tree:
+            if not self.tree.is_populated and not self.include and not self.exclude:
+                try:
+                    return self.store.count_rows(self, frequency)
+                except NotImplementedError:
+                    pass
+            return len(self.root.children.get(frequency, {}))
+
+    def rows_by_ids(
+        self,
+        frequency: ty.Union[DataSpace, str],
+        ids: ty.Iterable[ty.Union[str, ty.Tuple[str, ...]]],
+        ignore_missing: bool = False,
+    ) -> ty.List[DataRow]:
+        """Looks up multiple rows of the same frequency by their IDs
+
+        Parameters
+        ----------
+        frequency : DataSpace or str
+            The frequency of the rows
+        ids : Iterable[str or tuple[str, ...]]
+            The IDs of the rows, either the IDs of the rows themselves or tuples of
+            the IDs of the axes spanned by the frequency
+        ignore_missing : bool
+            Whether to skip IDs that aren't present in the dataset instead of
+            raising an error
+
+        Returns
+        -------
+        list[DataRow]
+            The rows in the order of the provided IDs (with duplicates removed)
+
+        Raises
+        ------
+        ArcanaNameError
+            If there is no row corresponding to one of the IDs and `ignore_missing`
+            is False
+        """
+        frequency = self.parse_frequency(frequency)
+        with self.tree:
+            rows = []
+            found = set()
+            for row_id in ids:
+                row = self._lookup_row(frequency, row_id)
+                if row is None:
+                    if not ignore_missing:
+                        raise ArcanaNameError(
+                            row_id,
+                            f"{row_id} not present in data tree "
+                            f"({self._rows_summary(frequency)})",
+                        )
+                elif row.id not in found:
+                    found.add(row.id)
+                    rows.append(row)
             return rows
 
+    def _lookup_row(
+        self, frequency: DataSpace, id: ty.Union[str, ty.Tuple[str, ...]]
+    ) -> ty.Optional[DataRow]:
+        try:
+            return self.root.children[frequency][id]
+        except KeyError:
+            pass
+        except TypeError:
+            return None  # unhashable ID
+        if isinstance(id, tuple) and len(id) == len(
+            self.tree.layer_plan.spans[frequency]
+        ):
+            # The ID tuple could be an expansion of the IDs of the axes spanned by the
+            # frequency instead of a direct label for the row
+            return self.tree.axes_index(frequency).get(id)
+        return None
+
+    def _rows_summary(self, frequency: DataSpace, max_ids: int = 10) -> str:
+        row_ids = self.root.children.get(frequency, {})
+        examples = ", ".join(str(i) for i in itertools.islice(row_ids, max_ids))
+        if len(row_ids) > max_ids:
+            examples += ", ..."
+        return f"{len(row_ids)} {frequency} rows: {examples}"
+
+    def prefetch(
+        self,
+        columns: ty.Optional[ty.Sequence[ty.Union[str, DataColumn]]] = None,
+        ids: ty.Optional[ty.Sequence[str]] = None,
+        max_workers: ty.Optional[int] = None,
+    ):
+        """Retrieves the items in the given columns from the store in bulk ahead of
+        them being accessed, e.g. concurrently downloading them into the cache of a
+        remote store
+
+        Parameters
+        ----------
+        columns : Sequence[str or DataColumn], optional
+            the columns to prefetch the items of, by default all source columns
+        ids : Sequence[str], optional
+            the IDs of the rows to prefetch the items of, by default all rows
+        max_workers : int, optional
+            the maximum number of items to retrieve concurrently
+        """
+        if columns is None:
+            columns = [c for c in self.columns.values() if not c.is_sink]
+        else:
+            columns = [self[c] if isinstance(c, str) else c for c in columns]
+
+        def matched_entries():
+            for column in columns:
+                rows = list(self.rows(column.row_frequency, ids=ids))
+                DataRow.populate(rows)
+                matcher = column.matcher
+                for row in rows:
+                    # Prefetch all candidates that could match the column, as checking
+                    # the datatype of their contents would require them to be
+                    # downloaded one at a time
+                    yield from matcher.filter(row.entries, check_contents=False)
+
+        # Entries are matched lazily so stores that don't need to prefetch items don't
+        # pay for the matching
+        with self.tree:
+            self.store.prefetch(matched_entries(), max_workers=max_workers)
+
     def row_ids(self, frequency: ty.Optional[str] = None):
         """Return all the IDs in the dataset for a given row_frequency
 
@@ -601,6 +813,11 @@ class Dataset:
         row_frequency=None,
         overwrite=False,
         converter_args=None,
+        sourcing="path",
+        verify_sourced=False,
+        cache_conversions=False,
+        persist_conversions=False,
+        track_inputs=False,
     ):
         """Connect a Pydra workflow as a pipeline of the dataset
 
@@ -623,6 +840,21 @@ class Dataset:
         converter_args : dict[str, dict]
             keyword arguments passed on to the converter to control how the
             conversion is performed.
+        sourcing : str, optional
+            how input file-sets are passed to the pipeline, "path", "symlink" or
+            "hardlink" (see ``Pipeline.sourcing``), by default "path"
+        verify_sourced : bool, optional
+            whether to check that staged input file-sets haven't been modified by the
+            pipeline (see ``Pipeline.verify_sourced``), by default False
+        cache_conversions : bool, optional
+            whether to convert inputs via the conversion cache of the store (see
+            ``Pipeline.cache_conversions``), by default False
+        persist_conversions : bool, optional
+            whether to also save converted inputs back into the store, by default
+            False
+        track_inputs : bool, optional
+            whether to derive the outputs again for rows whose inputs have changed
+            since they were derived (see ``Pipeline.track_inputs``), by default False
 
         Returns
         -------
@@ -658,6 +890,11 @@ class Dataset:
             inputs=inputs,
             outputs=outputs,
             converter_args=converter_args,
+            sourcing=sourcing,
+            verify_sourced=verify_sourced,
+            cache_conversions=cache_conversions,
+            persist_conversions=persist_conversions,
+            track_inputs=track_inputs,
         )
         for outpt in pipeline.outputs:
             sink = self[outpt.name]
@@ -681,7 +918,7 @@ class Dataset:
     def apply(self, analysis):
         self.analyses[analysis.name] = analysis
 
-    def derive(self, *sink_names, ids=None, cache_dir=None, **kwargs):
+    def derive(self, *sink_names, ids=None, cache_dir=None, fused=False, **kwargs):
         """Generate derivatives from the workflows
 
         Parameters
@@ -689,8 +926,19 @@ class Dataset:
         *sink_names : Iterable[str]
             Names of the columns corresponding to the items to derive
         ids : Iterable[str]
-            The IDs of the data rows in each column to derive
+            The IDs of the data rows in each column to derive. The IDs of the rows
+            processed by upstream pipelines are dilated to include all the rows
+            required to derive them (e.g. all the sessions of a subject for a
+            per-subject summary)
         cache_dir
+            the cache directory passed to the Pydra workflows
+        fused : bool
+            whether to fuse consecutive pipelines of the same row frequency into a
+            single workflow, which passes the outputs of upstream pipelines directly
+            to the downstream pipelines, so each row can flow through all the
+            pipelines without waiting for the rest of the rows
+        **kwargs
+            passed on to the Pydra workflows when they are executed
 
         Returns
         -------
@@ -700,13 +948,112 @@ class Dataset:
         from arcana.core.analysis.pipeline import Pipeline
 
         sinks = [self[s] for s in set(sink_names)]
-        for pipeline, _ in Pipeline.stack(*sinks):
-            # Execute pipelines in stack
-            # FIXME: Should combine the pipelines into a single workflow and
-            # dilate the IDs that need to be run when summarising over different
-            # data axes
+        pipelines = [p for p, _ in Pipeline.stack(*sinks)]
+        with self.tree:
+            stage_ids = self._dilate_ids(pipelines, sinks, ids)
+        # Group consecutive pipelines that can be fused into a single workflow
+        stages = []
+        for pipeline in pipelines:
+            requested_ids = stage_ids[pipeline.name]
+            if requested_ids is not None and not requested_ids:
+                continue  # none of the outputs of the pipeline are required
+            if (
+                fused
+                and stages
+                and stages[-1][0][-1].row_frequency == pipeline.row_frequency
+                and stages[-1][1] == requested_ids
+            ):
+                stages[-1][0].append(pipeline)
+            else:
+                stages.append(([pipeline], requested_ids))
+        for stage, requested_ids in stages:
             with self.tree:
-                pipeline(ids=ids, cache_dir=cache_dir)(**kwargs)
+                if len(stage) == 1:
+                    stage[0](requested_ids=requested_ids, ids=ids, cache_dir=cache_dir)(
+                        **kwargs
+                    )
+                    continue
+                result = Pipeline.fuse(
+                    stage, requested_ids=requested_ids, ids=ids, cache_dir=cache_dir
+                )(**kwargs)
+            # Rows that have already been processed by some of the fused pipelines
+            # are processed by each of the remaining pipelines in turn
+            partial = list(result.output.couldnt_process)
+            if partial:
+                logger.info(
+                    "Deriving %s rows that are partially derived by %s one pipeline "
+                    "at a time",
+                    len(partial),
+                    ", ".join(p.name for p in stage),
+                )
+                for pipeline in stage:
+                    with self.tree:
+                        pipeline(requested_ids=partial, ids=ids, cache_dir=cache_dir)(
+                            **kwargs
+                        )
+
+    def _dilate_ids(
+        self,
+        pipelines: ty.List[Pipeline],
+        sinks: ty.List[DataSink],
+        ids: ty.Optional[ty.Iterable[str]],
+    ) -> ty.Dict[str, ty.Optional[ty.List[str]]]:
+        """Determines the IDs of the rows each pipeline in the stack needs to process
+        in order to derive the requested rows of the sinks, dilating the IDs of
+        the requested rows to the related rows of the frequencies of the upstream
+        pipelines (e.g. all the sessions of a subject for a per-subject summary)
+
+        Parameters
+        ----------
+        pipelines : list[Pipeline]
+            the stack of pipelines, in order of execution
+        sinks : list[DataSink]
+            the sinks to derive
+        ids : Iterable[str] or None
+            the IDs of the rows of the sinks to derive, None for all rows
+
+        Returns
+        -------
+        dict[str, list[str] or None]
+            the IDs of the rows to process by each pipeline, keyed by the name of the
+            pipeline, None for all rows
+        """
+        if ids is None:
+            return {p.name: None for p in pipelines}
+        ids = set(ids)
+        sink_names = set(s.name for s in sinks)
+        stage_ids = {}
+        for i, pipeline in reversed(list(enumerate(pipelines))):
+            outputs = set(pipeline.output_varnames)
+            required = set(ids) if outputs & sink_names else set()
+            for downstream in pipelines[i + 1 :]:
+                if not outputs & set(downstream.input_varnames):
+                    continue
+                downstream_ids = stage_ids[downstream.name]
+                if downstream_ids is None:
+                    downstream_rows = self.rows(downstream.row_frequency)
+                else:
+                    downstream_rows = self.rows_by_ids(
+                        downstream.row_frequency, downstream_ids, ignore_missing=True
+                    )
+                for row in downstream_rows:
+                    if pipeline.row_frequency.is_parent(row.frequency, if_match=True):
+                        required.add(row.frequency_id(pipeline.row_frequency))
+                    elif pipeline.row_frequency in row.children:
+                        required.update(
+                            r.id for r in row.children[pipeline.row_frequency].values()
+                        )
+                    else:
+                        # Unrelated frequencies, so all rows could be required
+                        required.update(self.row_ids(pipeline.row_frequency))
+            if not pipeline.row_frequency:
+                # The root frequency only has a single row
+                stage_ids[pipeline.name] = None if required else []
+            else:
+                # Sorted by their string representation as the requested IDs aren't
+                # necessarily comparable with each other (e.g. None or integers)
+                stage_ids[pipeline.name] = sorted(required, key=str)
+        return stage_ids
 
     def parse_frequency(self, freq):
         """Parses the data row_frequency, converting from string if necessary and
@@ -830,9 +1177,18 @@ class Dataset:
     def infer_ids(
         self, ids: ty.Dict[str, str], metadata: ty.Dict[str, ty.Dict[str, str]]
     ):
-        return self.store.infer_ids(
-            ids=ids, id_patterns=self.id_patterns, metadata=metadata
-        )
+        return self.id_inference_plan.infer(ids, metadata=metadata)
+
+    @property
+    def id_inference_plan(self) -> IdInferencePlan:
+        """The ID-inference patterns of the dataset compiled into a plan, which is
+        recompiled if the patterns are changed"""
+        if (
+            self._id_inference_plan is None
+            or self._id_inference_plan.id_patterns != self.id_patterns
+        ):
+            self._id_inference_plan = IdInferencePlan.compile(self.id_patterns)
+        return self._id_inference_plan
 
     def __bytes_repr__(self, cache):
         """For Pydra input hashing"""
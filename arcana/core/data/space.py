@@ -1,3 +1,4 @@
+from __future__ import annotations
 import typing as ty
 import re
 from enum import Enum
@@ -5,6 +6,85 @@ from arcana.core.utils.serialize import ClassResolver
 from arcana.core.utils.misc import classproperty
 
 
+class SpaceTables:
+    """Lookup tables of the frequency algebra of a data space, which are calculated
+    once per data space (the first time they are needed) so that the operators and
+    methods of its members don't need to create new enum members via the enum
+    constructor or recalculate the bit decompositions each time they are called
+
+    Parameters
+    ----------
+    space : type[DataSpace]
+        the data space to calculate the tables for
+    """
+
+    __slots__ = (
+        "by_value",
+        "spans",
+        "nonzero_bits",
+        "leaf",
+        "axes",
+        "parents",
+    )
+
+    def __init__(self, space: ty.Type[DataSpace]):
+        members = list(space)
+        max_value = max(m.value for m in members)
+        if max_value < 2**16:
+            # Index members by their value in a list (values without a member are None)
+            self.by_value = [None] * (max_value + 1)
+            for member in members:
+                self.by_value[member.value] = member
+        else:
+            self.by_value = {m.value: m for m in members}
+        self.nonzero_bits = {}
+        self.spans = {}
+        for member in members:
+            v = member.value
+            nonzero = []
+            while v:
+                w = v & (v - 1)
+                nonzero.append(w ^ v)
+                v = w
+            self.nonzero_bits[member] = tuple(nonzero)
+            self.spans[member] = tuple(
+                self.by_value[b] for b in sorted(nonzero, reverse=True)
+            )
+        self.leaf = max(members, key=lambda m: m.value)
+        self.axes = self.spans[self.leaf]
+        # The members that are parents of each member (excluding the member itself)
+        self.parents = {
+            m: frozenset(
+                p for p in members if p.value & m.value == p.value and p is not m
+            )
+            for m in members
+        }
+
+    @classmethod
+    def of(cls, space: ty.Type[DataSpace]) -> SpaceTables:
+        """Returns the lookup tables of the data space, calculating them if this is
+        the first time they have been requested
+
+        Parameters
+        ----------
+        space : type[DataSpace]
+            the data space
+
+        Returns
+        -------
+        SpaceTables
+            the lookup tables of the data space
+        """
+        try:
+            return _space_tables[space]
+        except KeyError:
+            tables = _space_tables[space] = cls(space)
+            return tables
+
+
+_space_tables: ty.Dict[type, SpaceTables] = {}
+
+
 class DataSpace(Enum):
     """
     Base class for all "data space" enums. DataSpace enums specify
@@ -59,11 +139,11 @@ class DataSpace(Enum):
 
     @classmethod
     def leaf(cls):
-        return max(cls)
+        return SpaceTables.of(cls).leaf
 
     @classmethod
     def axes(cls):
-        return cls.leaf().span()
+        return list(SpaceTables.of(cls).axes)
 
     @classproperty
     def ndim(self):
@@ -85,18 +165,10 @@ class DataSpace(Enum):
             matchedpoint -> [timepoint, member]
             session -> [timepoint, group, member]
         """
-        # Check which bits are '1', and append them to the list of levels
-        cls = type(self)
-        return [cls(b) for b in sorted(self.nonzero_bits(), reverse=True)]
+        return list(SpaceTables.of(type(self)).spans[self])
 
     def nonzero_bits(self):
-        v = self.value
-        nonzero = []
-        while v:
-            w = v & (v - 1)
-            nonzero.append(w ^ v)
-            v = w
-        return nonzero
+        return list(SpaceTables.of(type(self)).nonzero_bits[self])
 
     def __iter__(self):
         "Iterate over bit string"
@@ -106,34 +178,44 @@ class DataSpace(Enum):
             bit >>= 1
 
     def is_basis(self):
-        return len(self._nonzero_bits()) == 1
+        return len(SpaceTables.of(type(self)).nonzero_bits[self]) == 1
 
     def __eq__(self, other):
-        return self.value == other.value
+        return self._value_ == other._value_
 
     def __lt__(self, other):
-        return self.value < other.value
+        return self._value_ < other._value_
 
     def __le__(self, other):
-        return self.value <= other.value
+        return self._value_ <= other._value_
 
     def __xor__(self, other):
-        return type(self)(self.value ^ other.value)
+        return self._from_value(self._value_ ^ other._value_)
 
     def __and__(self, other):
-        return type(self)(self.value & other.value)
+        return self._from_value(self._value_ & other._value_)
 
     def __or__(self, other):
-        return type(self)(self.value | other.value)
+        return self._from_value(self._value_ | other._value_)
 
     def __invert__(self):
         return type(self)(~self.value)
 
     def __hash__(self):
-        return self.value
+        return self._value_
 
     def __bool__(self):
-        return bool(self.value)
+        return bool(self._value_)
+
+    def _from_value(self, value: int):
+        "Looks up the member of the space with the given value"
+        try:
+            member = SpaceTables.of(type(self)).by_value[value]
+        except (IndexError, KeyError):
+            member = None
+        if member is None:
+            return type(self)(value)  # raises the standard enum ValueError
+        return member
 
     def bin(self):
         return bin(self.value)
@@ -167,7 +249,13 @@ class DataSpace(Enum):
         bool
             True if self is parent of child
         """
-        return ((self & child) == self) and (child != self or if_match)
+        if child is self:
+            return if_match
+        try:
+            return self in SpaceTables.of(type(self)).parents[child]
+        except KeyError:
+            # e.g. a member of a different data space
+            return ((self & child) == self) and (child != self or if_match)
 
     def tostr(self):
         return f"{ClassResolver.tostr(self, strip_prefix=False)}[{str(self)}]"
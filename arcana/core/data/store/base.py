@@ -1,6 +1,9 @@
 from __future__ import annotations
 import logging
 import re
+import json
+import hashlib
+import threading
 from abc import abstractmethod, ABCMeta
 from pathlib import Path
 import attrs
@@ -18,11 +21,12 @@ from arcana.core.utils.misc import (
     NestedContext,
 )
 from arcana.core.utils.packaging import list_subclasses
+from arcana.core.utils.hashing import FileHasher
+from .cache import ConversionCache
 from arcana.core.exceptions import (
     ArcanaUsageError,
     ArcanaNameError,
     ArcanaError,
-    ArcanaDataTreeConstructionError,
 )
 
 
@@ -36,6 +40,7 @@ if ty.TYPE_CHECKING:  # pragma: no cover
     from ..tree import DataTree
     from ..entry import DataEntry
     from ..row import DataRow
+    from ..space import DataSpace
 
 
 @attrs.define
@@ -54,6 +59,45 @@ class ConnectionManager(NestedContext):
         self.session = None
 
 
+@attrs.define
+class TransactionManager(NestedContext):
+    """Groups the updates made to a store within the outermost "with" block, which
+    stores can buffer in `pending` and then commit in a single write when the block
+    exits (see ``DataStore.commit``)"""
+
+    store: ty.Any = None
+    pending: ty.Dict[ty.Any, ty.Dict[str, ty.Any]] = attrs.field(
+        factory=dict, init=False
+    )
+    lock: threading.Lock = attrs.field(factory=threading.Lock, init=False)
+
+    @property
+    def active(self) -> bool:
+        return self.depth > 0
+
+    def enter(self):
+        with self.lock:
+            self.pending = {}
+
+    def exit(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if pending:
+            self.store.commit(pending)
+
+    def __getstate__(self):
+        # Locks can't be pickled, and the updates pending within a transaction are
+        # only committed by the process that made them, so the unpickled manager
+        # starts outside of a transaction
+        return {"store": self.store}
+
+    def __setstate__(self, state):
+        self.store = state["store"]
+        self.depth = 0
+        self.pending = {}
+        self.lock = threading.Lock()
+
+
 @attrs.define
 class DataStore(metaclass=ABCMeta):
     """
@@ -77,9 +121,13 @@ class DataStore(metaclass=ABCMeta):
     connection: ConnectionManager = attrs.field(
         factory=ConnectionManager, init=False, hash=False, repr=False, eq=False
     )
+    transaction: TransactionManager = attrs.field(
+        factory=TransactionManager, init=False, hash=False, repr=False, eq=False
+    )
 
     def __attrs_post_init__(self):
         self.connection.store = self
+        self.transaction.store = self
 
     CONFIG_NAME = "stores"
     SUBPACKAGE = "data"
@@ -88,6 +136,12 @@ class DataStore(metaclass=ABCMeta):
     # alternative name used to save datasets that are named "" in cases where "" is
     # not appropriate
     EMPTY_DATASET_NAME = "_"
+    # modifications to a store more recent than this (in secs) can't be reliably
+    # detected by timestamp-based fingerprints so the tree index isn't used
+    TREE_FINGERPRINT_MIN_AGE = 2.0
+    # sub-directory of the tree index directory the checksums of the files of input
+    # entries are saved in (see ``DataStore.get_entry_checksums``)
+    CHECKSUMS_DIR = "checksums"
 
     ##############
     # Public API #
@@ -422,6 +476,7 @@ class DataStore(metaclass=ABCMeta):
             # Loop through columns
             if column_names is None:
                 column_names = list(dataset.columns)
+            to_put = []
             for col_name in column_names:
                 try:
                     col_name, col_dtype = col_name
@@ -446,9 +501,17 @@ class DataStore(metaclass=ABCMeta):
                     item = cell.item
                     if not isinstance(item, imported_col.datatype):
                         item = imported_col.datatype.convert(item)
-                    imported_col[
-                        tuple(cell.row.frequency_id(a) for a in dataset.space.axes())
-                    ] = item
+                    imported_cell = imported_col.cell(
+                        tuple(cell.row.frequency_id(a) for a in dataset.space.axes()),
+                        allow_empty=True,
+                    )
+                    if imported_cell.is_empty:
+                        imported_cell.entry = self.create_entry(
+                            imported_col.path, imported_col.datatype, imported_cell.row
+                        )
+                    to_put.append((imported_col.datatype(item), imported_cell.entry))
+            # Put the items of all columns in a single transaction
+            self.put_many(to_put)
             imported.save(name="")
 
     @classmethod
@@ -575,68 +638,16 @@ class DataStore(metaclass=ABCMeta):
         ------
         inferred_ids : dict[str, str]
             IDs inferred from the decomposition
+
+        Notes
+        -----
+        The patterns are compiled into an ``IdInferencePlan`` on each call, so when
+        inferring the IDs of many leaves use the plan cached in
+        ``Dataset.id_inference_plan`` instead
         """
-        if metadata is None:
-            metadata = {}
-        inferred_ids = {}
-        if id_patterns is not None:
-            conflicting = set(ids) & set(id_patterns)
-            if conflicting:
-                raise ArcanaDataTreeConstructionError(
-                    "Inferred IDs from decomposition conflict with explicitly provided IDs: "
-                    + str(conflicting)
-                )
-            for freq, pattern in id_patterns.items():
-                comps = cls.pattern_comp_re.findall(pattern)
-                if not comps:
-                    comps = [pattern]
-                    whole_str = True
-                else:
-                    whole_str = False
-                substitutions = []
-                for comp in comps:
-                    parts = comp.strip("#").split(":")
-                    source_freq = parts[0] if parts[0] else freq
-                    attr_name = parts[1] if len(parts) >= 2 and parts[1] else "ID"
-                    regex = ":".join(parts[2:])
-                    if attr_name.lower() == "id":
-                        attr = ids[source_freq]
-                        attr_name = attr_name.upper()
-                    else:
-                        try:
-                            attr = str(metadata[source_freq][attr_name])
-                        except KeyError:
-                            raise ArcanaDataTreeConstructionError(
-                                f"'{ids[source_freq]}' {source_freq} row doesn't have "
-                                f"the metadata field '{attr_name}'"
-                            )
-                    if regex:
-                        match = re.fullmatch(regex, attr)
-                        if not match or len(match.groups()) != 1:
-                            match_msg = (
-                                f"matched {len(match.groups())} groups"
-                                if match
-                                else "didn't match the pattern"
-                            )
-                            raise ArcanaDataTreeConstructionError(
-                                f"Provided ID-pattern component,'{regex}', needs to match "
-                                f"exactly one group on '{attr_name}' attribute of "
-                                f"'{ids[source_freq]}' {source_freq} row, '{attr}', when it "
-                                + match_msg
-                            )
-                        attr = match.group(1)
-                    substitutions.append(attr)
-                if whole_str:
-                    assert len(substitutions) == 1
-                    inferred_id = substitutions[0]
-                else:
-                    inferred_id = pattern
-                    for sub in substitutions:
-                        inferred_id = cls.pattern_comp_re.subn(
-                            sub, inferred_id, count=1
-                        )[0]
-                inferred_ids[freq] = inferred_id
-        return inferred_ids
+        from ..tree import IdInferencePlan
+
+        return IdInferencePlan.compile(id_patterns).infer(ids, metadata)
 
     def get_site_license_file(self, name: str, **kwargs) -> PlainText:
         """Access the site-wide license file
@@ -670,7 +681,8 @@ class DataStore(metaclass=ABCMeta):
     def populate_tree(self, tree: DataTree):
         """
         Populates the nodes of the data tree with those found in the dataset using
-        the ``DataTree.add_leaf`` method for every "leaf" node of the dataset tree.
+        the ``DataTree.add_leaf`` method for every "leaf" node of the dataset tree
+        (or ``DataTree.add_leaves`` to add them in bulk).
 
         The order that the tree leaves are added is important and should be consistent
         between reads, because it is used to give default values to the ID's of data
@@ -913,11 +925,365 @@ class DataStore(metaclass=ABCMeta):
         with self.connection:
             entry = self.create_entry(path, datatype, row)
             self.put(item, entry)
+        return entry
+
+    # Can be overridden by stores that are able to put multiple items concurrently
+    # (e.g. remote stores uploading them in parallel)
+    def put_items(
+        self,
+        items: ty.Iterable[ty.Tuple[DataType, DataEntry]],
+        max_workers: ty.Optional[int] = None,
+    ) -> ty.List[DataType]:
+        """Updates the items in multiple entries, which can be in different rows.
+        Puts them one after the other by default
+
+        Parameters
+        ----------
+        items : Iterable[tuple[DataType, DataEntry]]
+            the items to put and the entries to put them in
+        max_workers : int, optional
+            the maximum number of items to put concurrently
+
+        Returns
+        -------
+        list[DataType]
+            the cached versions of the items, if applicable
+        """
+        with self.connection:
+            return [self.put(item, entry) for item, entry in items]
+
+    def put_many(
+        self,
+        items: ty.Iterable[ty.Tuple[DataType, DataEntry]],
+        provenance: ty.Optional[ty.Dict[str, ty.Any]] = None,
+        max_workers: ty.Optional[int] = None,
+    ) -> ty.List[DataType]:
+        """Puts multiple items, and the provenance they were generated with, into their
+        entries within a single transaction, so that stores that buffer updates (e.g.
+        to JSON files holding many fields) commit them all in one write
+
+        Parameters
+        ----------
+        items : Iterable[tuple[DataType, DataEntry]]
+            the items to put and the entries to put them in, which can be in
+            different rows
+        provenance : dict[str, Any], optional
+            provenance to store alongside each of the items
+        max_workers : int, optional
+            the maximum number of items to put concurrently
+
+        Returns
+        -------
+        list[DataType]
+            the cached versions of the items, if applicable
+        """
+        items = list(items)
+        with self.connection, self.transaction:
+            cached = self.put_items(items, max_workers=max_workers)
+            if provenance:
+                for _, entry in items:
+                    self.put_provenance(provenance, entry)
+        return cached
+
+    # Can be overridden by stores that buffer the updates made within a transaction
+    # (see ``DataStore.transaction``)
+    def commit(self, pending: ty.Dict[ty.Any, ty.Dict[str, ty.Any]]):
+        """Commits the updates buffered within a transaction to the store. Stores
+        that don't buffer updates write them straight away, so have nothing to commit
+
+        Parameters
+        ----------
+        pending : dict[Any, dict[str, Any]]
+            the updates buffered within the transaction, keyed by the store-specific
+            location (e.g. file) they are to be written to
+        """
+        pass
+
+    # Can be overridden by stores that are able to retrieve the provenance of multiple
+    # entries concurrently (e.g. remote stores querying them in parallel)
+    def get_provenances(
+        self, entries: ty.Iterable[DataEntry], max_workers: ty.Optional[int] = None
+    ) -> ty.List[ty.Optional[ty.Dict[str, ty.Any]]]:
+        """Retrieves the provenance stored for multiple entries, which can be in
+        different rows. Retrieves them one after the other by default
+
+        Parameters
+        ----------
+        entries : Iterable[DataEntry]
+            the entries to retrieve the provenance of
+        max_workers : int, optional
+            the maximum number of provenance records to retrieve concurrently
+
+        Returns
+        -------
+        list[dict[str, Any] or None]
+            the provenance of each entry, None where no provenance has been stored
+        """
+        with self.connection:
+            return [self.get_provenance(entry) for entry in entries]
+
+    # Can be overridden by stores that are able to retrieve the checksums of entries
+    # without accessing their contents (e.g. remote stores that calculate them on
+    # upload)
+    def get_entry_checksums(
+        self, entries: ty.Iterable[DataEntry], max_workers: ty.Optional[int] = None
+    ) -> ty.List[str]:
+        """Calculates a single checksum of the contents of each entry, which can be
+        used to detect whether the entry has changed since outputs were derived from
+        it. Fields are checksummed by their values and file-sets by the checksums of
+        their files, which are saved in the tree index directory of the dataset (if
+        the store supports one) so files are only hashed again if they are modified
+
+        Parameters
+        ----------
+        entries : Iterable[DataEntry]
+            the entries to calculate the checksums of
+        max_workers : int, optional
+            the maximum number of files to hash concurrently
+
+        Returns
+        -------
+        list[str]
+            the checksum of each entry
+        """
+        hasher = FileHasher(max_workers=max_workers)
+        checksums = []
+        with self.connection:
+            for entry in entries:
+                if entry.datatype.is_field:
+                    checksums.append(self.checksum_field(entry))
+                    continue
+                fileset = self.get(entry, entry.datatype)
+                sidecar = None
+                index_dir = self.tree_index_dir(entry.row.dataset)
+                if index_dir is not None:
+                    sidecar = (
+                        index_dir
+                        / self.CHECKSUMS_DIR
+                        / (hashlib.md5(str(entry.uri).encode()).hexdigest() + ".json")
+                    )
+                    sidecar.parent.mkdir(parents=True, exist_ok=True)
+                file_checksums = hasher.hash_files(
+                    fileset.fspaths, relative_to=Path(fileset.parent), sidecar=sidecar
+                )
+                checksums.append(self.digest_checksums(file_checksums))
+        return checksums
+
+    # Can be overridden by stores that need to download items before they can be
+    # accessed
+    def prefetch(
+        self, entries: ty.Iterable[DataEntry], max_workers: ty.Optional[int] = None
+    ):
+        """Retrieves the items of the entries in bulk ahead of them being accessed.
+        Does nothing by default, as the items of most stores can be accessed in place
+
+        Parameters
+        ----------
+        entries : Iterable[DataEntry]
+            the entries to retrieve the items of
+        max_workers : int, optional
+            the maximum number of items to retrieve concurrently
+        """
+
+    # Can be overridden by stores where retrieving the item is expensive (e.g. remote
+    # stores that need to download it first)
+    def check_datatype(self, entry: DataEntry, datatype: type):
+        """Checks whether the item in the entry can be interpreted as the given
+        datatype, which is a sub-type of the datatype of the entry (e.g. a generic
+        file-set entry and a specific file format)
+
+        Parameters
+        ----------
+        entry : DataEntry
+            the entry to check
+        datatype : type
+            the datatype to check the item against
+
+        Raises
+        ------
+        FormatMismatchError
+            if the item doesn't match the datatype
+        """
+        entry.get_item(datatype)
+
+    # Can be overridden by stores that are able to retrieve the entries of many rows in
+    # a single request (e.g. listing all resources in a project in one query)
+    def populate_rows(self, rows: ty.Iterable[DataRow]):
+        """Populates multiple rows with the data entries found in the corresponding
+        nodes of the data store. Falls back to calling ``populate_row`` for each row
+        by default
+
+        Parameters
+        ----------
+        rows : Iterable[DataRow]
+            the rows to populate with entries, which should all belong to the same
+            dataset
+        """
+        with self.connection:
+            for row in rows:
+                self.populate_row(row)
+
+    # Can be overridden by stores that list the leaves of a dataset in pages (e.g.
+    # paginated API queries), so rows can be iterated before the listing is complete
+    def list_leaves(self, dataset: Dataset) -> ty.Iterator[ty.List[ty.Sequence[str]]]:
+        """Lists the leaves of the data tree of the dataset page by page. If
+        implemented, it is used instead of ``populate_tree`` to add the leaves to the
+        tree as they are listed (see ``Dataset.iter_rows``). Raises NotImplementedError
+        by default
+
+        Parameters
+        ----------
+        dataset : Dataset
+            the dataset to list the leaves of
+
+        Yields
+        ------
+        list[Sequence[str]]
+            the tree paths (labels for each layer of the hierarchy) of the leaves in
+            each page
+        """
+        raise NotImplementedError
+
+    # Can be overridden by stores that are able to count the rows of a dataset without
+    # listing them (e.g. the total count returned with the first page of a query)
+    def count_rows(self, dataset: Dataset, frequency: DataSpace) -> int:
+        """Counts the rows of the given frequency in the dataset. Only used while the
+        data tree is being populated and the dataset doesn't have any inclusion or
+        exclusion criteria. Raises NotImplementedError by default, or if the store
+        can't count the rows of the frequency (e.g. if their IDs are inferred)
+
+        Parameters
+        ----------
+        dataset : Dataset
+            the dataset to count the rows of
+        frequency : DataSpace
+            the frequency of the rows to count
+
+        Returns
+        -------
+        int
+            the number of rows
+        """
+        raise NotImplementedError
+
+    # Can be overridden by stores that are able to detect changes to the structure of
+    # a dataset more cheaply than rescanning it (e.g. directory modification times or
+    # a "last modified" query)
+    def tree_fingerprint(self, dataset: Dataset) -> ty.Optional[str]:
+        """Returns a cheap-to-compute fingerprint of the structure of the data tree of
+        the dataset, which is used to determine whether a previously saved index of
+        the tree can be reused instead of calling ``populate_tree``
+
+        Parameters
+        ----------
+        dataset : Dataset
+            the dataset to fingerprint the data tree of
+
+        Returns
+        -------
+        fingerprint : str or None
+            a string that changes whenever leaves are added to or removed from the
+            dataset, or None if the tree index shouldn't be used (the default)
+        """
+        return None
+
+    # Can be overridden by stores that are able to detect changes to the entries of a
+    # row more cheaply than rescanning it (e.g. directory modification times or the
+    # ETag/last-modified values of remote resources)
+    def row_fingerprint(self, row: DataRow) -> ty.Optional[str]:
+        """Returns a cheap-to-compute fingerprint of the entries in the row, which is
+        used to determine whether the entries saved in the manifest of the data tree
+        the last time the row was populated can be reused instead of calling
+        ``populate_row``. Only the path, datatype, URI, item metadata, order, quality
+        and checksums of the entries are saved in the manifest
+
+        Parameters
+        ----------
+        row : DataRow
+            the row to fingerprint the entries of
+
+        Returns
+        -------
+        fingerprint : str or None
+            a string that changes whenever entries are added to, removed from or
+            modified within the row, or None if the manifest shouldn't be used (the
+            default)
+        """
+        return None
+
+    def tree_index_dir(self, dataset: Dataset) -> ty.Optional[Path]:
+        """Returns the directory that indices of the data tree of the dataset are
+        saved in
+
+        Parameters
+        ----------
+        dataset : Dataset
+            the dataset to return the index directory for
+
+        Returns
+        -------
+        Path or None
+            the directory to save tree indices in, or None if indices are not
+            supported by the store (the default)
+        """
+        return None
+
+    def conversion_cache(self, dataset: Dataset) -> ty.Optional[ConversionCache]:
+        """Returns the cache that inputs of the dataset converted to other datatypes
+        are cached in (see ``Pipeline.cache_conversions``)
+
+        Parameters
+        ----------
+        dataset : Dataset
+            the dataset to return the conversion cache for
+
+        Returns
+        -------
+        ConversionCache or None
+            the conversion cache, or None if conversions aren't cached by the store
+            (the default)
+        """
+        return None
 
     ##################
     # Helper methods #
     ##################
 
+    def checksum_field(self, entry: DataEntry) -> str:
+        """Calculates the checksum of the value of a field entry
+
+        Parameters
+        ----------
+        entry : DataEntry
+            the field entry to checksum
+
+        Returns
+        -------
+        str
+            the checksum of the value of the field
+        """
+        field = self.get(entry, entry.datatype)
+        return self.digest_checksums({"value": field.primitive(field)})
+
+    @classmethod
+    def digest_checksums(cls, checksums: ty.Dict[str, ty.Any]) -> str:
+        """Combines the checksums of the files of an entry (or the value of a field)
+        into a single checksum
+
+        Parameters
+        ----------
+        checksums : dict[str, Any]
+            the checksums to combine
+
+        Returns
+        -------
+        str
+            the combined checksum
+        """
+        return hashlib.md5(
+            json.dumps(checksums, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
     def check_store_version(self, store_version: str):
         """Check whether version store used to save the dataset is compatible with the
         current version of the software. Can be overridden by store subclasses where
@@ -938,5 +1304,3 @@ class DataStore(metaclass=ABCMeta):
                 f"Stored version of dataset ({store_version}) does not match current "
                 f"version of {type(self).__name__} ({self.VERSION})"
             )
-
-    pattern_comp_re = re.compile(r"#[^\#]+#")
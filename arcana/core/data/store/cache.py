@@ -0,0 +1,551 @@
+from __future__ import annotations
+import os
+import errno
+import time
+import json
+import threading
+import shutil
+import hashlib
+import logging
+import typing as ty
+from pathlib import Path
+import attrs
+from arcana.core.utils.misc import (
+    HASH_CHUNK_SIZE,
+    HOSTNAME,
+    JSON_ENCODING,
+    append_suffix,
+)
+
+
+logger = logging.getLogger("arcana")
+
+
+@attrs.define
+class CachedEntry:
+    """A file-set that has been downloaded into the cache
+
+    Parameters
+    ----------
+    path : Path
+        path to the directory the file-set is cached in
+    sidecars : list[Path]
+        the sidecar files (e.g. checksums) saved alongside the cached directory
+    last_access : float
+        time the entry was last accessed (the modification time of its checksums)
+    size : int
+        the number of bytes used by the entry, not counting files that are shared
+        with other entries
+    """
+
+    path: Path
+    sidecars: ty.List[Path]
+    last_access: float
+    size: int
+
+
+@attrs.define
+class DownloadLock:
+    """Lock file marking that a file-set is being downloaded into the cache, which
+    records the PID and host of the process that owns the download. While the lock is
+    held, its modification time is updated at regular intervals (a "heartbeat") by a
+    background thread, so processes waiting on the download can detect if it has
+    stalled without having to inspect the files being downloaded.
+
+    Parameters
+    ----------
+    path : Path
+        path to the lock file
+    heartbeat_interval : float
+        the interval (in secs) between updates to the modification time of the lock
+    """
+
+    path: Path = attrs.field(converter=Path)
+    heartbeat_interval: float = 1.0
+    _stop: threading.Event = attrs.field(factory=threading.Event, init=False)
+    _thread: ty.Optional[threading.Thread] = attrs.field(default=None, init=False)
+
+    def __enter__(self):
+        # Write to a temporary file and then move it into place so waiting processes
+        # never read a partially written lock
+        tmp_path = append_suffix(
+            self.path, f".{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        with open(tmp_path, "w", **JSON_ENCODING) as f:
+            json.dump({"pid": os.getpid(), "host": HOSTNAME}, f)
+        os.replace(tmp_path, self.path)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._beat, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        self._thread.join()
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _beat(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                return  # the download has been taken over by another process
+
+    @classmethod
+    def heartbeat(cls, path: Path) -> ty.Optional[float]:
+        """The time of the last heartbeat of the lock at the given path
+
+        Parameters
+        ----------
+        path : Path
+            path to the lock file
+
+        Returns
+        -------
+        float or None
+            the time of the last heartbeat, None if the lock isn't held
+        """
+        try:
+            return path.stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def owner_is_dead(cls, path: Path) -> bool:
+        """Whether the lock is held by a process on this host that no longer exists,
+        in which case the download can be taken over without waiting for it to stall
+
+        Parameters
+        ----------
+        path : Path
+            path to the lock file
+
+        Returns
+        -------
+        bool
+            whether the owner of the lock is known to have exited
+        """
+        try:
+            with open(path, **JSON_ENCODING) as f:
+                owner = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if owner.get("host") != HOSTNAME or HOSTNAME is None:
+            return False
+        try:
+            os.kill(owner["pid"], 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass  # exists but is owned by another user
+        return False
+
+
+@attrs.define
+class CacheManager:
+    """Manages the directory remote data stores download file-sets into, tracking when
+    each entry was last accessed so the least recently used can be evicted when the
+    cache grows beyond a maximum size, and optionally deduplicating identical files
+    across entries by hard-linking them to a content-addressed "blob" store.
+
+    Entries are evicted by first renaming them atomically, so other processes never
+    see a partially deleted entry (they will simply download it again), and entries
+    that are being downloaded or have been accessed within `min_age` secs are skipped.
+
+    Parameters
+    ----------
+    cache_dir : Path
+        the cache directory
+    max_size : int, optional
+        the maximum size of the cache in bytes, None for unlimited
+    dedup : bool
+        whether to hard-link identical files across entries to a single copy. Note that
+        modifying a deduplicated file in-place will modify it in all entries, so it
+        should only be enabled if cached files are treated as read-only
+    min_age : float
+        entries accessed more recently than this (in secs) are not evicted
+    trim_interval : float
+        the minimum time (in secs) between automatic trims of the cache
+    sidecar_suffixes : tuple[str, ...]
+        suffixes of the sidecar files saved alongside each cached entry. The first is
+        the checksums sidecar, which every entry has and whose modification time is
+        used to track when the entry was last accessed
+    """
+
+    cache_dir: Path = attrs.field(converter=Path)
+    max_size: ty.Optional[int] = None
+    dedup: bool = False
+    min_age: float = 60.0
+    trim_interval: float = 60.0
+    sidecar_suffixes: ty.Tuple[str, ...] = (".md5.json",)
+
+    BLOBS_DIR = ".blobs"
+    TRIM_STAMP = ".last-trim"
+    DOWNLOAD_SUFFIX = ".download"
+    EVICTING_SUFFIX = ".evicting"
+
+    def touch(self, cache_path: Path):
+        """Records that a cached entry has been accessed
+
+        Parameters
+        ----------
+        cache_path : Path
+            path to the cached entry
+        """
+        try:
+            os.utime(append_suffix(cache_path, self.sidecar_suffixes[0]))
+        except FileNotFoundError:
+            pass
+
+    def added(self, cache_path: Path):
+        """Processes an entry that has just been downloaded into the cache,
+        deduplicating its files and trimming the cache if required
+
+        Parameters
+        ----------
+        cache_path : Path
+            path to the newly cached entry
+        """
+        if self.dedup:
+            self.deduplicate(cache_path)
+        if self.max_size is not None:
+            self.trim(force=False)
+
+    def deduplicate(self, cache_path: Path):
+        """Replaces the files of a cached entry with hard-links to identical files in
+        the blob store, adding them to the blob store if they aren't there already
+
+        Parameters
+        ----------
+        cache_path : Path
+            path to the cached entry
+        """
+        blobs_dir = self.cache_dir / self.BLOBS_DIR
+        blobs_dir.mkdir(exist_ok=True)
+        for fspath in self._iter_files(cache_path):
+            blob_path = blobs_dir / self._hash_file(fspath)
+            try:
+                self._link_to_blob(fspath, blob_path)
+            except OSError as e:
+                if e.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    logger.debug("Could not deduplicate %s: %s", fspath, e)
+                    return
+                raise
+
+    def entries(self) -> ty.List[CachedEntry]:
+        """Lists the entries in the cache, from least to most recently used
+
+        Returns
+        -------
+        list[CachedEntry]
+            the entries in the cache
+        """
+        accessed = []
+        checksum_suffix = self.sidecar_suffixes[0]
+        for sidecar in self.cache_dir.rglob("*" + checksum_suffix):
+            rel_parts = sidecar.relative_to(self.cache_dir).parts
+            if any(p.startswith(".") for p in rel_parts):
+                continue
+            path = sidecar.parent / sidecar.name[: -len(checksum_suffix)]
+            if not path.is_dir():
+                continue
+            try:
+                accessed.append((sidecar.stat().st_mtime, path))
+            except FileNotFoundError:
+                continue  # evicted in the meantime
+        entries = []
+        seen_inodes = set()
+        # Files that are shared between entries are counted towards the size of the
+        # most recently used entry, as they won't be freed until it is evicted
+        for last_access, path in sorted(accessed, reverse=True):
+            size = 0
+            for fspath in self._iter_files(path):
+                # Symlinks aren't followed, as their targets aren't stored in the cache
+                try:
+                    stat = os.lstat(fspath)
+                except FileNotFoundError:
+                    continue  # removed by another process in the meantime
+                if stat.st_nlink > 1:
+                    inode = (stat.st_dev, stat.st_ino)
+                    if inode in seen_inodes:
+                        continue
+                    seen_inodes.add(inode)
+                size += stat.st_size
+            sidecars = [append_suffix(path, s) for s in self.sidecar_suffixes]
+            entries.append(
+                CachedEntry(
+                    path=path, sidecars=sidecars, last_access=last_access, size=size
+                )
+            )
+        return entries[::-1]
+
+    def trim(self, max_size: ty.Optional[int] = None, force: bool = True) -> int:
+        """Evicts the least recently used entries from the cache until it is smaller
+        than the maximum size
+
+        Parameters
+        ----------
+        max_size : int, optional
+            the size to trim the cache to, by default the `max_size` of the manager
+        force : bool
+            whether to trim even if the cache was trimmed within the last
+            `trim_interval` secs
+
+        Returns
+        -------
+        int
+            the number of bytes freed
+        """
+        if max_size is None:
+            max_size = self.max_size
+        if max_size is None:
+            return 0
+        stamp = self.cache_dir / self.TRIM_STAMP
+        if not force:
+            try:
+                if time.time() - stamp.stat().st_mtime < self.trim_interval:
+                    return 0
+            except FileNotFoundError:
+                pass
+        stamp.touch()
+        entries = self.entries()
+        total_size = sum(e.size for e in entries)
+        freed = 0
+        min_access = time.time() - self.min_age
+        for entry in entries:
+            if total_size - freed <= max_size:
+                break
+            if entry.last_access > min_access:
+                break  # the remaining entries have all been accessed more recently
+            if append_suffix(entry.path, self.DOWNLOAD_SUFFIX).exists():
+                continue  # being redownloaded
+            if self.evict(entry):
+                freed += entry.size
+        # Blobs are counted in the size of the entries that link to them, so aren't
+        # counted again here
+        self._remove_orphaned_blobs()
+        logger.info(
+            "Trimmed %s bytes from cache at %s (%s bytes remaining)",
+            freed,
+            self.cache_dir,
+            total_size - freed,
+        )
+        return freed
+
+    def evict(self, entry: CachedEntry) -> bool:
+        """Removes an entry from the cache
+
+        Parameters
+        ----------
+        entry : CachedEntry
+            the entry to remove
+
+        Returns
+        -------
+        bool
+            whether the entry was removed by this process
+        """
+        evicting_path = append_suffix(
+            entry.path, f"{self.EVICTING_SUFFIX}.{os.getpid()}"
+        )
+        try:
+            os.rename(entry.path, evicting_path)
+        except FileNotFoundError:
+            return False  # evicted by another process
+        for sidecar in entry.sidecars:
+            try:
+                sidecar.unlink()
+            except FileNotFoundError:
+                pass
+        shutil.rmtree(evicting_path, ignore_errors=True)
+        return True
+
+    def _link_to_blob(self, fspath: Path, blob_path: Path):
+        while True:
+            if not fspath.is_symlink():
+                try:
+                    os.link(fspath, blob_path)
+                    return
+                except FileExistsError:
+                    pass
+                if self._same_inode(fspath, blob_path):
+                    return
+            elif not blob_path.exists():
+                # The cached file is a symlink (e.g. to a file in a local store), so
+                # a copy of its target is added to the blob store instead of linking
+                # the blob to a file outside of the cache
+                tmp_blob_path = append_suffix(blob_path, f".{os.getpid()}.tmp")
+                shutil.copyfile(fspath, tmp_blob_path)
+                try:
+                    os.link(tmp_blob_path, blob_path)
+                except FileExistsError:
+                    pass  # added by another process in the meantime
+                finally:
+                    tmp_blob_path.unlink()
+            # Link to the existing blob via a temporary path, which is then moved
+            # over the original atomically
+            tmp_path = append_suffix(fspath, f".{os.getpid()}.tmp")
+            try:
+                os.link(blob_path, tmp_path)
+            except FileNotFoundError:
+                continue  # the blob was removed by a concurrent trim, so add it again
+            os.replace(tmp_path, fspath)
+            return
+
+    def _remove_orphaned_blobs(self):
+        blobs_dir = self.cache_dir / self.BLOBS_DIR
+        if not blobs_dir.exists():
+            return
+        for blob_path in blobs_dir.iterdir():
+            try:
+                if blob_path.stat().st_nlink == 1:
+                    blob_path.unlink()
+            except FileNotFoundError:
+                pass  # removed by another process in the meantime
+
+    @classmethod
+    def _iter_files(cls, path: Path) -> ty.Iterator[Path]:
+        for dpath, _, fnames in os.walk(path):
+            for fname in fnames:
+                yield Path(dpath) / fname
+
+    @classmethod
+    def _same_inode(cls, a: Path, b: Path) -> bool:
+        a_stat = os.lstat(a)
+        b_stat = os.lstat(b)
+        return (a_stat.st_dev, a_stat.st_ino) == (b_stat.st_dev, b_stat.st_ino)
+
+    @classmethod
+    def _hash_file(cls, fspath: Path) -> str:
+        crypto = hashlib.sha256()
+        with open(fspath, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                crypto.update(chunk)
+        return crypto.hexdigest()
+
+
+@attrs.define
+class ConversionCache:
+    """Caches copies of file-sets converted to other datatypes, keyed by the checksum
+    of the original file-set, the datatype it was converted to and the arguments
+    passed to the converter, so the same conversion isn't repeated by different
+    pipelines or by later runs of the same pipeline. The least recently used
+    conversions are evicted when the cache grows beyond a maximum size.
+
+    Parameters
+    ----------
+    cache_dir : Path
+        the directory to cache the converted file-sets in
+    max_size : int, optional
+        the maximum size of the cache in bytes, None for unlimited
+    """
+
+    cache_dir: Path = attrs.field(converter=Path)
+    max_size: ty.Optional[int] = None
+    manager: CacheManager = attrs.field(init=False, repr=False)
+
+    SIDECAR_SUFFIX = ".conversion.json"
+
+    def __attrs_post_init__(self):
+        self.manager = CacheManager(
+            self.cache_dir,
+            max_size=self.max_size,
+            sidecar_suffixes=(self.SIDECAR_SUFFIX,),
+        )
+
+    @classmethod
+    def key(
+        cls,
+        checksum: str,
+        datatype: type,
+        converter_args: ty.Optional[ty.Dict[str, ty.Any]] = None,
+    ) -> str:
+        """Generates the key a conversion is cached under
+
+        Parameters
+        ----------
+        checksum : str
+            the checksum of the original file-set
+        datatype : type
+            the datatype the file-set is converted to
+        converter_args : dict[str, Any], optional
+            the arguments passed to the converter
+
+        Returns
+        -------
+        str
+            the key of the conversion
+        """
+        return hashlib.md5(
+            json.dumps(
+                [
+                    checksum,
+                    f"{datatype.__module__}.{datatype.__name__}",
+                    converter_args or {},
+                ],
+                sort_keys=True,
+                default=str,
+            ).encode()
+        ).hexdigest()
+
+    def get(self, key: str, datatype: type) -> ty.Optional[ty.Any]:
+        """Retrieves a converted file-set from the cache
+
+        Parameters
+        ----------
+        key : str
+            the key of the conversion
+        datatype : type
+            the datatype the file-set was converted to
+
+        Returns
+        -------
+        FileSet or None
+            the converted file-set, None if it isn't in the cache
+        """
+        cache_path = self.cache_dir / key
+        if not append_suffix(cache_path, self.SIDECAR_SUFFIX).exists():
+            return None
+        try:
+            converted = datatype(sorted(cache_path.iterdir()))
+        except FileNotFoundError:
+            return None  # evicted in the meantime
+        self.manager.touch(cache_path)
+        return converted
+
+    def put(self, key: str, fileset: ty.Any) -> ty.Any:
+        """Adds a converted file-set to the cache
+
+        Parameters
+        ----------
+        key : str
+            the key of the conversion
+        fileset : FileSet
+            the converted file-set
+
+        Returns
+        -------
+        FileSet
+            the copy of the file-set in the cache
+        """
+        cache_path = self.cache_dir / key
+        # Copy into a temporary directory and then move it into place, so other
+        # processes never see a partially copied conversion
+        tmp_path = append_suffix(cache_path, f".{os.getpid()}.{threading.get_ident()}")
+        fileset.copy(tmp_path, make_dirs=True, trim=False)
+        try:
+            os.rename(tmp_path, cache_path)
+        except OSError:
+            # Added by another process in the meantime
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        else:
+            with open(
+                append_suffix(cache_path, self.SIDECAR_SUFFIX), "w", **JSON_ENCODING
+            ) as f:
+                json.dump({"datatype": type(fileset).mime_like}, f)
+            self.manager.added(cache_path)
+        converted = self.get(key, type(fileset))
+        return converted if converted is not None else fileset
@@ -1,14 +1,15 @@
 from __future__ import annotations
+import os
 from pathlib import Path
 import re
 from abc import abstractmethod
 import typing as ty
-import errno
+import threading
 import logging
 import json
 import attrs
 import yaml
-from fasteners import InterProcessLock
+from fasteners import InterProcessReaderWriterLock, ReaderWriterLock
 from fileformats.core import DataType, FileSet, Field
 from arcana.core.exceptions import (
     ArcanaMissingDataException,
@@ -16,9 +17,11 @@ from arcana.core.exceptions import (
     DatatypeUnsupportedByStoreError,
 )
 from arcana.core.utils.misc import get_home_dir, append_suffix
+from arcana.core.utils.transfer import TRANSFER_MODES
 from ..row import DataRow
 from ..entry import DataEntry
 from .base import DataStore
+from .cache import ConversionCache
 
 
 logger = logging.getLogger("arcana")
@@ -29,6 +32,37 @@ logger = logging.getLogger("arcana")
 # '~')
 special_dir_re = re.compile(r"(__.*__$|\..*|~.*)")
 
+# Prevent threads in the same process compacting JSON logs while they are appended to,
+# keyed by the path of the JSON file
+_json_log_locks: ty.Dict[Path, ReaderWriterLock] = {}
+_json_log_locks_lock = threading.Lock()
+
+
+def _json_log_lock(fpath: Path) -> ReaderWriterLock:
+    fpath = Path(fpath).absolute()
+    with _json_log_locks_lock:
+        try:
+            return _json_log_locks[fpath]
+        except KeyError:
+            lock = _json_log_locks[fpath] = ReaderWriterLock()
+            return lock
+
+
+@attrs.define
+class _CachedJson:
+    """The parsed contents of a JSON file and its log, cached in memory"""
+
+    json_key: ty.Optional[ty.Tuple[int, int, int]]
+    log_ino: ty.Optional[int]
+    log_offset: int
+    contents: ty.Dict[str, ty.Any]
+
+
+# Parsed JSON files, keyed by path, which are validated against the stats of the file
+# before they are used
+_json_cache: ty.Dict[Path, _CachedJson] = {}
+_json_cache_lock = threading.Lock()
+
 
 @attrs.define
 class LocalStore(DataStore):
@@ -42,14 +76,36 @@ class LocalStore(DataStore):
     base_dir : str
         Path to the base directory of the "store", i.e. datasets are
         arranged by name as sub-directories of the base dir.
+    transfer_mode : str
+        how file-sets are transferred into the store, one of "copy", "reflink"
+        (copy-on-write clone), "hardlink" or "move", falling back to copying where
+        the mode isn't supported between the source and the store (e.g. different
+        devices). Note that hard-linked files are shared with their source, and moved
+        files are removed from it, by default "reflink"
+    conversion_cache_max_size : int, optional
+        the maximum size (in bytes) of the cache of converted inputs saved within
+        each dataset (see ``Pipeline.cache_conversions``), above which the least
+        recently used conversions are evicted. Unlimited by default
 
     """
 
     LOCK_SUFFIX = ".lock"
+    JSON_LOG_SUFFIX = ".log"
+    # size (in bytes) the log of updates to a JSON file can grow to before it is
+    # compacted into the JSON file
+    JSON_LOG_MAX_SIZE = 2**16
     ARCANA_DIR = "__arcana__"
     SITE_LICENSES_DIR = "site-licenses"
+    TREE_INDEX_DIR = ".tree-index"
+    CONVERSIONS_DIR = ".conversions"
 
     name: str
+    transfer_mode: str = attrs.field(
+        default="reflink", kw_only=True, validator=attrs.validators.in_(TRANSFER_MODES)
+    )
+    conversion_cache_max_size: ty.Optional[int] = attrs.field(
+        default=None, kw_only=True
+    )
 
     ##############################
     # Inherited abstract methods #
@@ -336,51 +392,212 @@ class LocalStore(DataStore):
             raise ArcanaUsageError(f"Path to dataset root '{id}'' does not exist")
         return super().define_dataset(id, *args, **kwargs)
 
+    def commit(self, pending: ty.Dict[Path, ty.Dict[str, ty.Any]]):
+        """Appends the updates to each JSON file buffered within a transaction to the
+        log alongside it in a single write
+
+        Parameters
+        ----------
+        pending : dict[Path, dict[str, Any]]
+            the updates to commit, keyed by the path of the JSON file to update
+        """
+        for fpath, updates in pending.items():
+            self.append_to_json(fpath, updates)
+
     ##################
     # Helper methods #
     ##################
 
     def update_json(self, fpath: Path, key, value):
-        """Updates a JSON file in a multi-process safe way"""
-        # Open fields JSON, locking to prevent other processes
-        # reading or writing
-        with InterProcessLock(append_suffix(fpath, self.LOCK_SUFFIX), logger=logger):
+        """Updates a key of a JSON file in a multi-process safe way
+
+        Parameters
+        ----------
+        fpath : Path
+            path to the JSON file
+        key : str
+            the key to update
+        value : Any
+            the value to set the key to
+        """
+        self.append_to_json(fpath, {key: value})
+
+    def append_to_json(self, fpath: Path, updates: ty.Dict[str, ty.Any]):
+        """Updates keys of a JSON file by appending them to a JSON-lines log alongside
+        it, which multiple processes can append to concurrently. The log is compacted
+        into the JSON file once it grows larger than `JSON_LOG_MAX_SIZE`
+
+        Parameters
+        ----------
+        fpath : Path
+            path to the JSON file
+        updates : dict[str, Any]
+            the keys to update and the values to set them to
+        """
+        if self.transaction.active:
+            # Buffer the updates so all updates to the file within the transaction
+            # are appended in a single line when it is committed
+            with self.transaction.lock:
+                self.transaction.pending.setdefault(Path(fpath), {}).update(updates)
+            return
+        line = (json.dumps(updates) + "\n").encode()
+        # Appenders share the lock, so they only need to wait on compactions. Inter-
+        # process locks don't exclude threads of the same process from each other, so
+        # a thread lock is also required
+        with _json_log_lock(fpath).read_lock(), self._json_lock(fpath).read_lock():
+            # Write the line in a single call on a file opened in append mode so
+            # concurrent appends aren't interleaved
+            fd = os.open(
+                append_suffix(fpath, self.JSON_LOG_SUFFIX),
+                os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                0o644,
+            )
             try:
-                with open(fpath) as f:
-                    dct = json.load(f)
-            except IOError as e:
-                if e.errno == errno.ENOENT:
-                    dct = {}
-                else:
-                    raise
-            dct[key] = value
-            with open(fpath, "w") as f:
+                os.write(fd, line)
+                log_size = os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+        if log_size > self.JSON_LOG_MAX_SIZE:
+            self.compact_json(fpath)
+
+    def compact_json(self, fpath: Path):
+        """Compacts the updates in the log alongside a JSON file into the JSON file
+
+        Parameters
+        ----------
+        fpath : Path
+            path to the JSON file
+        """
+        log_path = append_suffix(fpath, self.JSON_LOG_SUFFIX)
+        with _json_log_lock(fpath).write_lock(), self._json_lock(fpath).write_lock():
+            if not log_path.exists():
+                return  # already compacted by another process
+            dct = self._load_json_and_log(fpath)
+            # Write to a temporary file and then move it into place so that the JSON
+            # file is never left partially written
+            tmp_path = append_suffix(fpath, f".{os.getpid()}.tmp")
+            with open(tmp_path, "w") as f:
                 json.dump(dct, f, indent=4)
+            os.replace(tmp_path, fpath)
+            log_path.unlink()
 
-    def read_from_json(self, fpath, key):
+    def load_json(self, fpath: Path) -> ty.Dict[str, ty.Any]:
+        """Loads a JSON file along with any updates in the log alongside it
+
+        Parameters
+        ----------
+        fpath : Path
+            path to the JSON file
+
+        Returns
+        -------
+        dict[str, Any]
+            the contents of the JSON file, or an empty dict if it doesn't exist
         """
-        Load fields JSON, locking to prevent read/write conflicts
-        Would be better if only checked if locked to allow
-        concurrent reads but not possible with multi-process
-        locks (in my understanding at least).
+        dct = self._load_json_and_log(fpath)
+        if self.transaction.active:
+            # Include updates that have been made within the current transaction but
+            # not committed yet
+            with self.transaction.lock:
+                dct.update(self.transaction.pending.get(Path(fpath), {}))
+        return dct
+
+    def read_from_json(self, fpath, key):
+        """Reads a key from a JSON file, including updates in the log alongside it.
+        Readers don't take any locks, so they don't block each other or create lock
+        files, and the parsed contents are cached in memory until the file changes
+
+        Parameters
+        ----------
+        fpath : Path
+            path to the JSON file
+        key : str
+            the key to read
         """
         try:
-            with InterProcessLock(
-                append_suffix(fpath, self.LOCK_SUFFIX), logger=logger
-            ), open(fpath, "r") as f:
-                dct = json.load(f)
-            return dct[key]
-        except (KeyError, IOError) as e:
-            try:
-                # Check to see if the IOError wasn't just because of a
-                # missing file
-                if e.errno != errno.ENOENT:
-                    raise
-            except AttributeError:
-                pass
+            return self.load_json(fpath)[key]
+        except KeyError:
             raise ArcanaMissingDataException(
                 "{} does not exist in the local store {}".format(key, self)
             )
 
+    def _json_lock(self, fpath: Path) -> InterProcessReaderWriterLock:
+        return InterProcessReaderWriterLock(
+            append_suffix(fpath, self.LOCK_SUFFIX), logger=logger
+        )
+
+    def _load_json_and_log(self, fpath: Path) -> ty.Dict[str, ty.Any]:
+        fpath = Path(fpath).absolute()
+        log_path = append_suffix(fpath, self.JSON_LOG_SUFFIX)
+        # As the JSON file is only ever replaced (never modified in place), its inode,
+        # modification time and size identify its contents, and the log is only ever
+        # appended to, so only the lines added since it was last read need to be parsed.
+        # Compactions replace the JSON file before removing the log, so if the JSON file
+        # is unchanged after the log has been read no updates have been missed and the
+        # file doesn't need to be locked while it is read
+        json_key = self._json_key(fpath)
+        while True:
+            with _json_cache_lock:
+                cached = _json_cache.get(fpath)
+            if cached is not None and cached.json_key == json_key:
+                dct = dict(cached.contents)
+                log_ino, log_offset = cached.log_ino, cached.log_offset
+            else:
+                try:
+                    with open(fpath) as f:
+                        dct = json.load(f)
+                except FileNotFoundError:
+                    dct = {}
+                log_ino, log_offset = None, 0
+            try:
+                with open(log_path, "rb") as f:
+                    ino = os.fstat(f.fileno()).st_ino
+                    if ino != log_ino:
+                        log_ino, log_offset = ino, 0
+                    f.seek(log_offset)
+                    appended = f.read()
+            except FileNotFoundError:
+                log_ino, log_offset = None, 0
+            else:
+                # Only parse up to the last complete line, in case a line is being
+                # written
+                end = appended.rfind(b"\n") + 1
+                for line in appended[:end].splitlines():
+                    try:
+                        dct.update(json.loads(line))
+                    except ValueError:
+                        # Skip lines left incomplete by a writer that was killed
+                        logger.warning("Skipping corrupt line in log of %s", fpath)
+                log_offset += end
+            reread_key = self._json_key(fpath)
+            if reread_key == json_key:
+                break
+            json_key = reread_key  # compacted while it was being read, so reread it
+        with _json_cache_lock:
+            _json_cache[fpath] = _CachedJson(
+                json_key=json_key,
+                log_ino=log_ino,
+                log_offset=log_offset,
+                contents=dct,
+            )
+        return dict(dct)
+
+    @classmethod
+    def _json_key(cls, fpath: Path) -> ty.Optional[ty.Tuple[int, int, int]]:
+        try:
+            stat = fpath.stat()
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
     def definition_save_path(self, dataset_id, name):
         return Path(dataset_id) / self.ARCANA_DIR / name / "definition.yaml"
+
+    def tree_index_dir(self, dataset) -> Path:
+        return Path(dataset.id) / self.ARCANA_DIR / self.TREE_INDEX_DIR
+
+    def conversion_cache(self, dataset) -> ConversionCache:
+        return ConversionCache(
+            Path(dataset.id) / self.ARCANA_DIR / self.CONVERSIONS_DIR,
+            max_size=self.conversion_cache_max_size,
+        )
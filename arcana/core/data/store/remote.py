@@ -1,33 +1,42 @@
 from __future__ import annotations
 import os
-import os.path as op
 import typing as ty
 from pathlib import Path
 from abc import abstractmethod
 import time
 import logging
-import errno
 import json
 import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import attrs
 from fileformats.core import DataType, FileSet, Field
+from fileformats.core.exceptions import FormatMismatchError
 from arcana.core.utils.misc import (
-    dir_modtime,
     JSON_ENCODING,
     append_suffix,
+    path2varname,
 )
 from arcana.core.exceptions import (
     ArcanaError,
     DatatypeUnsupportedByStoreError,
 )
 from arcana.core.utils.misc import dict_diff, full_path
+from arcana.core.utils.hashing import FileHasher
+from arcana.core.utils.transfer import TRANSFER_MODES, transfer_fileset
 from ..entry import DataEntry
 from ..row import DataRow
 from .base import DataStore
+from .cache import CacheManager, ConversionCache, DownloadLock
 
 
 logger = logging.getLogger("arcana")
 
+# Semaphores limiting the number of concurrent transfers to/from each server across all
+# store objects in the process
+_server_semaphores: ty.Dict[str, threading.BoundedSemaphore] = {}
+_server_semaphores_lock = threading.Lock()
+
 
 @attrs.define
 class RemoteStore(DataStore):
@@ -47,9 +56,21 @@ class RemoteStore(DataStore):
     password : str, optional
         Password to connect to the XNAT repository with, by default None
     race_condition_delay : int
-        The amount of time to wait before checking that the required
-        fileset has been downloaded to cache by another process has
-        completed if they are attempting to download the same fileset
+        The amount of time to wait for a download of the required fileset into the
+        cache by another process to make progress, before assuming it has been
+        interrupted and restarting it
+    cache_max_size : int, optional
+        The maximum size (in bytes) of the cache, above which the least recently
+        used file-sets are evicted. Unlimited by default
+    cache_dedup : bool
+        Whether to deduplicate identical files across cached file-sets by
+        hard-linking them to a single copy, by default False
+    transfer_mode : str
+        how file-sets are transferred into the cache before they are uploaded, one of
+        "copy", "reflink" (copy-on-write clone), "hardlink" or "move", falling back to
+        copying where the mode isn't supported between the source and the cache (e.g.
+        different devices). Note that hard-linked files are shared with their source,
+        and moved files are removed from it, by default "reflink"
     """
 
     server: str = attrs.field()
@@ -58,8 +79,26 @@ class RemoteStore(DataStore):
     user: str = attrs.field(default=None, metadata={"asdict": False})
     password: str = attrs.field(default=None, metadata={"asdict": False})
     race_condition_delay: int = attrs.field(default=5)
+    cache_max_size: ty.Optional[int] = attrs.field(default=None)
+    cache_dedup: bool = attrs.field(default=False)
+    transfer_mode: str = attrs.field(
+        default="reflink", validator=attrs.validators.in_(TRANSFER_MODES)
+    )
 
     CHECKSUM_SUFFIX = ".md5.json"
+    DATATYPES_SUFFIX = ".datatypes.json"
+    HASHES_SUFFIX = ".hashes.json"
+    UPLOAD_PROGRESS_SUFFIX = ".upload.json"
+    DOWNLOAD_SUFFIX = ".download"
+    DOWNLOAD_LOCK_SUFFIX = ".download.lock"
+    # interval (in secs) between heartbeats of, and checks on, downloads in progress
+    DOWNLOAD_POLL_INTERVAL = 0.5
+    # maximum number of times to restart downloads that were interrupted
+    MAX_DOWNLOAD_ATTEMPTS = 3
+    # maximum number of concurrent transfers to/from a single server
+    MAX_CONNECTIONS_PER_SERVER = 4
+    TREE_INDEX_DIR = ".tree-index"
+    CONVERSIONS_DIR = ".conversions"
     PROV_SUFFIX = ".__prov__.json"
     FIELD_PROV_RESOURCE = "__provenance__"
     METADATA_RESOURCE = "__arcana__"
@@ -256,6 +295,37 @@ class RemoteStore(DataStore):
         """
         raise NotImplementedError
 
+    def upload_file(self, fspath: Path, rel_path: str, entry: DataEntry):
+        """Uploads a single file of a file-set to the specified entry in the data store.
+        Can be left as NotImplementedError if the repository only supports uploading
+        whole file-sets via `upload_files`. If implemented (along with `delete_files`),
+        the files of a file-set are uploaded concurrently and uploads that are
+        interrupted are resumed from the files that were already uploaded
+
+        Parameters
+        ----------
+        fspath : Path
+            path to the file to upload
+        rel_path : str
+            the path of the file relative to the file-set within the entry
+        entry : DataEntry
+            the entry in the data store to upload the file to
+        """
+        raise NotImplementedError
+
+    def delete_files(self, entry: DataEntry):
+        """Deletes all files in the specified entry in the data store, so that a new
+        file-set can be uploaded to it file-by-file with `upload_file`. Can be left as
+        NotImplementedError if the repository only supports uploading whole file-sets
+        via `upload_files`, in which case `upload_file` isn't used either
+
+        Parameters
+        ----------
+        entry : DataEntry
+            the entry in the data store to delete the files of
+        """
+        raise NotImplementedError
+
     @abstractmethod
     def calculate_checksums(self, fileset: FileSet) -> ty.Dict[str, str]:
         """
@@ -299,6 +369,138 @@ class RemoteStore(DataStore):
                 raise DatatypeUnsupportedByStoreError(entry.datatype, self)
         return item
 
+    def put_items(
+        self,
+        items: ty.Iterable[ty.Tuple[DataType, DataEntry]],
+        max_workers: ty.Optional[int] = None,
+    ) -> ty.List[DataType]:
+        """Uploads the items into their entries concurrently using a pool of threads.
+        The number of concurrent uploads to the server is limited to
+        `MAX_CONNECTIONS_PER_SERVER` across all threads in the process
+
+        Parameters
+        ----------
+        items : Iterable[tuple[DataType, DataEntry]]
+            the items to put and the entries to put them in
+        max_workers : int, optional
+            the number of threads to upload the items with, by default
+            `MAX_CONNECTIONS_PER_SERVER`
+
+        Returns
+        -------
+        list[DataType]
+            the cached versions of the items
+        """
+        items = list(items)
+        if max_workers is None:
+            max_workers = self.MAX_CONNECTIONS_PER_SERVER
+        # The connection is opened in this thread and shared by the workers
+        with self.connection, ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(self.put, i, e) for i, e in items]
+            return [f.result() for f in futures]
+
+    def put_many(
+        self,
+        items: ty.Iterable[ty.Tuple[DataType, DataEntry]],
+        provenance: ty.Optional[ty.Dict[str, ty.Any]] = None,
+        max_workers: ty.Optional[int] = None,
+    ) -> ty.List[DataType]:
+        """Uploads the items, and the provenance they were generated with, into their
+        entries concurrently using a single pool of threads, so the provenance of each
+        item is uploaded as soon as the item is instead of after all the items are
+
+        Parameters
+        ----------
+        items : Iterable[tuple[DataType, DataEntry]]
+            the items to put and the entries to put them in
+        provenance : dict[str, Any], optional
+            provenance to store alongside each of the items
+        max_workers : int, optional
+            the number of threads to upload the items with, by default
+            `MAX_CONNECTIONS_PER_SERVER`
+
+        Returns
+        -------
+        list[DataType]
+            the cached versions of the items
+        """
+
+        def put_with_provenance(item, entry):
+            cached = self.put(item, entry)
+            if provenance:
+                self.put_provenance(provenance, entry)
+            return cached
+
+        items = list(items)
+        if max_workers is None:
+            max_workers = self.MAX_CONNECTIONS_PER_SERVER
+        with self.connection, self.transaction, ThreadPoolExecutor(
+            max_workers=max_workers
+        ) as executor:
+            futures = [executor.submit(put_with_provenance, i, e) for i, e in items]
+            return [f.result() for f in futures]
+
+    def get_provenances(
+        self, entries: ty.Iterable[DataEntry], max_workers: ty.Optional[int] = None
+    ) -> ty.List[ty.Optional[ty.Dict[str, ty.Any]]]:
+        """Retrieves the provenance of the entries concurrently using a pool of threads
+
+        Parameters
+        ----------
+        entries : Iterable[DataEntry]
+            the entries to retrieve the provenance of
+        max_workers : int, optional
+            the number of threads to retrieve the provenance with, by default
+            `MAX_CONNECTIONS_PER_SERVER`
+
+        Returns
+        -------
+        list[dict[str, Any] or None]
+            the provenance of each entry, None where no provenance has been stored
+        """
+        entries = list(entries)
+        if max_workers is None:
+            max_workers = self.MAX_CONNECTIONS_PER_SERVER
+        # The connection is opened in this thread and shared by the workers
+        with self.connection, ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(self.get_provenance, entries))
+
+    def get_entry_checksums(
+        self, entries: ty.Iterable[DataEntry], max_workers: ty.Optional[int] = None
+    ) -> ty.List[str]:
+        """Retrieves the checksums of the entries concurrently using a pool of threads.
+        File-sets are checksummed from the checksums calculated by the server, so they
+        don't need to be downloaded
+
+        Parameters
+        ----------
+        entries : Iterable[DataEntry]
+            the entries to retrieve the checksums of
+        max_workers : int, optional
+            the number of threads to retrieve the checksums with, by default
+            `MAX_CONNECTIONS_PER_SERVER`
+
+        Returns
+        -------
+        list[str]
+            the checksum of each entry
+        """
+
+        def checksum(entry):
+            if entry.datatype.is_field:
+                return self.checksum_field(entry)
+            file_checksums = entry.checksums
+            if not file_checksums:
+                file_checksums = self.get_checksums(entry.uri)
+            return self.digest_checksums(file_checksums)
+
+        entries = list(entries)
+        if max_workers is None:
+            max_workers = self.MAX_CONNECTIONS_PER_SERVER
+        # The connection is opened in this thread and shared by the workers
+        with self.connection, ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(checksum, entries))
+
     def create_entry(self, path: str, datatype: type, row: DataRow) -> DataEntry:
         with self.connection:
             if datatype.is_fileset:
@@ -309,6 +511,99 @@ class RemoteStore(DataStore):
                 raise DatatypeUnsupportedByStoreError(entry.datatype, self)
         return entry
 
+    def check_datatype(self, entry: DataEntry, datatype: type):
+        """Checks whether the item in the entry matches the given datatype, first by
+        the names of its files and otherwise by downloading it. Verdicts are saved
+        alongside the cache keyed by the checksums of the remote files so that entries
+        only need to be downloaded again to be checked if they are modified
+
+        Parameters
+        ----------
+        entry : DataEntry
+            the entry to check
+        datatype : type
+            the datatype to check the item against
+
+        Raises
+        ------
+        FormatMismatchError
+            if the item doesn't match the datatype
+        """
+        if not entry.datatype.is_fileset:
+            return super().check_datatype(entry, datatype)
+        checksums = entry.checksums
+        if checksums is None:
+            with self.connection:
+                checksums = self.get_checksums(entry.uri)
+        if not checksums:
+            return super().check_datatype(entry, datatype)
+        mismatch = self._filenames_mismatch(checksums, datatype)
+        if mismatch is None:
+            verdicts_path = append_suffix(
+                self.cache_path(entry.uri), self.DATATYPES_SUFFIX
+            )
+            verdicts = self._load_datatype_verdicts(verdicts_path, checksums)
+            try:
+                mismatch = verdicts[datatype.mime_like]
+            except KeyError:
+                try:
+                    super().check_datatype(entry, datatype)
+                except FormatMismatchError as e:
+                    mismatch = str(e)
+                verdicts[datatype.mime_like] = mismatch
+                self._save_datatype_verdicts(verdicts_path, checksums, verdicts)
+        if mismatch is not None:
+            raise FormatMismatchError(mismatch)
+
+    def prefetch(
+        self, entries: ty.Iterable[DataEntry], max_workers: ty.Optional[int] = None
+    ):
+        """Downloads the file-sets of the entries into the cache concurrently using a
+        pool of threads, so they don't need to be downloaded one at a time when they
+        are accessed. The number of concurrent downloads from the server is limited
+        to `MAX_CONNECTIONS_PER_SERVER` across all threads in the process
+
+        Parameters
+        ----------
+        entries : Iterable[DataEntry]
+            the entries to download into the cache
+        max_workers : int, optional
+            the number of threads to download the entries with, by default
+            `MAX_CONNECTIONS_PER_SERVER`
+        """
+        to_download = {}
+        with self.connection:
+            for entry in entries:
+                if not entry.datatype.is_fileset:
+                    continue
+                cache_path = self.cache_path(entry.uri)
+                if cache_path not in to_download and self._cache_is_stale(
+                    entry, cache_path
+                ):
+                    to_download[cache_path] = entry
+        if not to_download:
+            return
+        if max_workers is None:
+            max_workers = self.MAX_CONNECTIONS_PER_SERVER
+        semaphore = self._server_semaphore()
+
+        def download(entry, cache_path):
+            with semaphore:
+                self._download_to_cache(entry, cache_path)
+
+        logger.info(
+            "Prefetching %s file-sets from %s with %s threads",
+            len(to_download),
+            self.server,
+            max_workers,
+        )
+        # The connection is opened in this thread and shared by the workers, as
+        # entering the connection context isn't thread-safe
+        with self.connection, ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(download, e, p) for p, e in to_download.items()]
+            for future in as_completed(futures):
+                future.result()
+
     def site_licenses_dataset(self, user: str = None, password: str = None):
         """Return a dataset that holds site-wide licenses
 
@@ -336,10 +631,11 @@ class RemoteStore(DataStore):
                 self.SITE_LICENSES_PASS_ENV,
             )
             return None
-        kwargs = attrs.asdict(self, recurse=False)
+        # Only copy the attributes that are passed to the constructor, not the state
+        # of the store (e.g. its connection and transaction managers)
+        kwargs = attrs.asdict(self, recurse=False, filter=lambda a, _: a.init)
         kwargs["user"] = user
         kwargs["password"] = password
-        del kwargs["connection"]
         store = type(self)(**kwargs)
         try:
             return store.load_dataset(self.SITE_LICENSES_DATASET)
@@ -392,48 +688,12 @@ class RemoteStore(DataStore):
             entry.row.id,
         )
         cache_path = self.cache_path(entry.uri)
-        need_to_download = True
-        if cache_path.exists():
-            md5_path = append_suffix(cache_path, self.CHECKSUM_SUFFIX)
-            if md5_path.exists():
-                with open(md5_path, "r") as f:
-                    cached_checksums = json.load(f)
-            if cached_checksums == entry.checksums:
-                need_to_download = False
-        if need_to_download:
+        # Mark the cached copy as recently used before checking it, so it isn't evicted
+        # by a concurrent trim of the cache in the meantime
+        self.cache_manager.touch(cache_path)
+        if self._cache_is_stale(entry, cache_path):
             with self.connection:
-                download_dir = append_suffix(cache_path, ".download")
-                try:
-                    os.makedirs(download_dir)
-                except OSError as e:
-                    if e.errno == errno.EEXIST:
-                        # Attempt to make tmp download directory. This will
-                        # fail if another process (or previous attempt) has
-                        # already created it. In that case this process will
-                        # wait 'race_cond_delay' seconds to see if it has been
-                        # updated (i.e. is being downloaded by the other process)
-                        # and otherwise assume that it was interrupted and redownload.
-                        self._delayed_download(
-                            entry,
-                            download_dir,
-                            cache_path,
-                            delay=self.race_condition_delay,
-                        )
-                    else:
-                        raise
-                else:
-                    data_path = self.download_files(entry, download_dir)
-                    if cache_path.exists():
-                        shutil.rmtree(cache_path)
-                    shutil.move(data_path, cache_path)
-                    shutil.rmtree(download_dir)
-                # Save checksums for future reference, so we can check to see if cache
-                # is stale
-                checksums = self.get_checksums(entry.uri)
-                with open(
-                    str(cache_path) + self.CHECKSUM_SUFFIX, "w", **JSON_ENCODING
-                ) as f:
-                    json.dump(checksums, f, indent=2)
+                self._download_to_cache(entry, cache_path)
         return datatype(cache_path.iterdir())
 
     def put_fileset(self, fileset: FileSet, entry: DataEntry) -> FileSet:
@@ -458,33 +718,47 @@ class RemoteStore(DataStore):
         if cache_path.exists():
             shutil.rmtree(cache_path)
         # Copy to cache
-        cached = fileset.copy(cache_path, make_dirs=True, trim=False)
-        self.upload_files(cache_path, entry)
-        try:
-            checksums = self.put_checksums(entry.uri, cached)
-        except NotImplementedError:
-            # Assuming that the checksums are generated internally by the repository so
-            # we download the ones it calculated and check they match with the ones we
-            # calculate.
-            checksums = self.get_checksums(entry.uri)
-            calculated_checksums = self.calculate_checksums(cached)
-            if checksums != calculated_checksums:
-                raise ArcanaError(
-                    f"Checksums for uploaded file-set at {entry} don't match that of the "
-                    "original files:\n\n"
-                    + dict_diff(
-                        calculated_checksums,
-                        checksums,
-                        label1="original",
-                        label2="remote",
-                    )
+        cached = transfer_fileset(
+            fileset, cache_path, mode=self.transfer_mode, make_dirs=True, trim=False
+        )
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            if type(self).put_checksums is RemoteStore.put_checksums:
+                # The checksums are generated internally by the repository, so calculate
+                # the ones to check them against while the files are being uploaded
+                calculating = executor.submit(self.calculate_checksums, cached)
+            else:
+                calculating = None
+            self._upload_to_store(cache_path, entry)
+            try:
+                checksums = self.put_checksums(entry.uri, cached)
+            except NotImplementedError:
+                # Download the checksums calculated by the repository and check they
+                # match with the ones we calculated.
+                checksums = self.get_checksums(entry.uri)
+                if calculating is not None:
+                    calculated_checksums = calculating.result()
+                else:
+                    calculated_checksums = self.calculate_checksums(cached)
+            else:
+                calculated_checksums = checksums
+        if checksums != calculated_checksums:
+            raise ArcanaError(
+                f"Checksums for uploaded file-set at {entry} don't match that of the "
+                "original files:\n\n"
+                + dict_diff(
+                    calculated_checksums,
+                    checksums,
+                    label1="original",
+                    label2="remote",
                 )
+            )
         # Save checksums, to avoid having to redownload if they haven't been altered
         # on XNAT
         with open(
             append_suffix(cache_path, self.CHECKSUM_SUFFIX), "w", **JSON_ENCODING
         ) as f:
             json.dump(checksums, f, indent=2)
+        self.cache_manager.added(cache_path)
         logger.info(
             "Put %s into %s:%s row via API access",
             entry.path,
@@ -525,53 +799,371 @@ class RemoteStore(DataStore):
     # Public API #
     ##############
 
+    @property
+    def cache_manager(self) -> CacheManager:
+        return CacheManager(
+            self.cache_dir,
+            max_size=self.cache_max_size,
+            dedup=self.cache_dedup,
+            sidecar_suffixes=(
+                self.CHECKSUM_SUFFIX,
+                self.DATATYPES_SUFFIX,
+                self.HASHES_SUFFIX,
+                self.UPLOAD_PROGRESS_SUFFIX,
+            ),
+        )
+
     def clear_cache(self):
         "Clears the cache directory"
         shutil.rmtree(self.cache_dir)
         self.cache_dir.mkdir()
 
+    def hash_files(self, fileset: FileSet, algorithm: str = "md5") -> ty.Dict[str, str]:
+        """Calculates the checksums of the files in a file-set concurrently, keyed by
+        their paths relative to the parent directory of the file-set. Intended to be
+        used in implementations of `calculate_checksums`. The checksums of file-sets in
+        the cache are saved alongside them, so they are only recalculated if the files
+        are modified
+
+        Parameters
+        ----------
+        fileset : FileSet
+            the file-set to calculate the checksums of
+        algorithm : str
+            the name of the hashlib algorithm to use
+
+        Returns
+        -------
+        dict[str, str]
+            the checksums of the files in the file-set
+        """
+        parent = Path(fileset.parent)
+        try:
+            parent.relative_to(self.cache_dir)
+        except ValueError:
+            sidecar = None  # only save the checksums of files in the cache
+        else:
+            sidecar = append_suffix(parent, self.HASHES_SUFFIX)
+        return FileHasher(algorithm=algorithm).hash_files(
+            fileset.fspaths, relative_to=parent, sidecar=sidecar
+        )
+
+    def trim_cache(self, max_size: ty.Optional[int] = None) -> int:
+        """Evicts the least recently used file-sets from the cache until it is smaller
+        than the maximum size
+
+        Parameters
+        ----------
+        max_size : int, optional
+            the size (in bytes) to trim the cache to, by default `cache_max_size`
+
+        Returns
+        -------
+        int
+            the number of bytes freed
+        """
+        return self.cache_manager.trim(max_size)
+
+    def tree_index_dir(self, dataset) -> Path:
+        return self.cache_dir / self.TREE_INDEX_DIR / path2varname(dataset.id)
+
+    def conversion_cache(self, dataset) -> ConversionCache:
+        # Converted inputs are cached alongside the downloaded file-sets, limited to
+        # the same size. Hidden directories aren't included in the trimming of the
+        # main cache
+        return ConversionCache(
+            self.cache_dir / self.CONVERSIONS_DIR, max_size=self.cache_max_size
+        )
+
     ##################
     # Helper methods #
     ##################
 
-    def _delayed_download(
-        self, entry: DataEntry, download_dir: Path, target_path: Path, delay: int
+    @classmethod
+    def _filenames_mismatch(
+        cls, checksums: ty.Dict[str, str], datatype: type
+    ) -> ty.Optional[str]:
+        """Checks whether the datatype can be ruled out from the names of the files in
+        a file-set (the keys of its checksums) without downloading them
+
+        Parameters
+        ----------
+        checksums : dict[str, str]
+            the checksums of the files in the file-set keyed by their relative paths
+        datatype : type
+            the datatype to check
+
+        Returns
+        -------
+        str or None
+            a description of the mismatch or None if it can't be ruled out
+        """
+        exts = getattr(datatype, "possible_exts", None)
+        if not exts or None in exts or not all(checksums):
+            return None
+        if any(n.endswith(e) for n in checksums for e in exts):
+            return None
+        return (
+            f"None of the files in the file-set ({list(checksums)}) have an extension "
+            f"that matches {datatype.mime_like} ({exts})"
+        )
+
+    @classmethod
+    def _load_datatype_verdicts(
+        cls, verdicts_path: Path, checksums: ty.Dict[str, str]
+    ) -> ty.Dict[str, ty.Optional[str]]:
+        try:
+            with open(verdicts_path, **JSON_ENCODING) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if saved.get("checksums") != checksums:
+            return {}  # the remote files have changed since the verdicts were saved
+        return saved.get("verdicts", {})
+
+    @classmethod
+    def _save_datatype_verdicts(
+        cls,
+        verdicts_path: Path,
+        checksums: ty.Dict[str, str],
+        verdicts: ty.Dict[str, ty.Optional[str]],
     ):
-        logger.info(
-            "Waiting %s seconds for incomplete download of %s "
-            "initiated another process to finish",
-            delay,
+        verdicts_path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file and then move it into place so concurrent
+        # processes never read a partially written file
+        tmp_path = append_suffix(verdicts_path, f".{os.getpid()}.tmp")
+        with open(tmp_path, "w", **JSON_ENCODING) as f:
+            json.dump({"checksums": checksums, "verdicts": verdicts}, f)
+        os.replace(tmp_path, verdicts_path)
+
+    def _upload_to_store(self, cache_path: Path, entry: DataEntry):
+        """Uploads the files of a cached file-set to the entry in the store. If the
+        store supports uploading files individually they are uploaded concurrently,
+        recording the files that have been uploaded in a sidecar so that an upload that
+        is interrupted can be resumed"""
+        semaphore = self._server_semaphore()
+        # Both hooks are needed to upload files individually, as the files of an
+        # existing file-set are deleted before the first file is uploaded
+        if (
+            type(self).upload_file is RemoteStore.upload_file
+            or type(self).delete_files is RemoteStore.delete_files
+        ):
+            with semaphore:
+                self.upload_files(cache_path, entry)
+            return
+        progress_path = append_suffix(cache_path, self.UPLOAD_PROGRESS_SUFFIX)
+        hasher = FileHasher()
+        try:
+            with open(progress_path, **JSON_ENCODING) as f:
+                progress = json.load(f)
+        except (OSError, ValueError):
+            progress = {}
+        # URIs aren't necessarily strings (e.g. paths), so are compared as strings
+        if progress.get("uri") != str(entry.uri):
+            progress = {"uri": str(entry.uri), "uploaded": {}}
+            with semaphore:
+                self.delete_files(entry)
+        uploaded = progress["uploaded"]
+        to_upload = {}
+        for dpath, _, fnames in os.walk(cache_path):
+            for fname in fnames:
+                fspath = Path(dpath) / fname
+                rel_path = str(fspath.relative_to(cache_path))
+                try:
+                    size, checksum = uploaded[rel_path]
+                except (KeyError, TypeError, ValueError):
+                    pass
+                else:
+                    if size == fspath.stat().st_size and checksum == hasher.hash_file(
+                        fspath
+                    ):
+                        continue  # already uploaded by an interrupted attempt
+                to_upload[rel_path] = fspath
+        logger.debug(
+            "Uploading %s files to %s (%s already uploaded)",
+            len(to_upload),
             entry,
+            len(uploaded),
         )
-        initial_mod_time = dir_modtime(download_dir)
-        time.sleep(delay)
-        if op.exists(target_path):
-            logger.info(
-                "The download of %s has completed "
-                "successfully in the other process, continuing",
-                entry,
-            )
-            return
-        elif initial_mod_time != dir_modtime(download_dir):
-            logger.info(
-                "The download of %s hasn't completed yet, but it has"
-                " been updated.  Waiting another %s seconds before "
-                "checking again.",
-                entry,
-                delay,
-            )
-            self._delayed_download(entry, download_dir, target_path, delay)
+
+        def upload(rel_path, fspath):
+            with semaphore:
+                self.upload_file(fspath, rel_path, entry)
+            # Hash the file while it is still in the page cache
+            return rel_path, [fspath.stat().st_size, hasher.hash_file(fspath)]
+
+        with ThreadPoolExecutor(
+            max_workers=self.MAX_CONNECTIONS_PER_SERVER
+        ) as executor:
+            futures = [executor.submit(upload, r, p) for r, p in to_upload.items()]
+            errors = []
+            for future in as_completed(futures):
+                try:
+                    rel_path, record = future.result()
+                except Exception as e:
+                    # Keep recording the files that were uploaded successfully so they
+                    # don't need to be uploaded again when the upload is resumed
+                    errors.append(e)
+                    continue
+                uploaded[rel_path] = record
+                # Record the progress after each file so it isn't lost if the process
+                # is killed
+                tmp_path = append_suffix(progress_path, f".{os.getpid()}.tmp")
+                with open(tmp_path, "w", **JSON_ENCODING) as f:
+                    json.dump(progress, f)
+                os.replace(tmp_path, progress_path)
+        if errors:
+            raise errors[0]
+        try:
+            progress_path.unlink()
+        except FileNotFoundError:
+            pass  # nothing needed to be uploaded
+
+    def _server_semaphore(self) -> threading.BoundedSemaphore:
+        """The semaphore limiting the number of concurrent transfers to/from the server
+        of the store across all threads in the process"""
+        with _server_semaphores_lock:
+            try:
+                semaphore = _server_semaphores[self.server]
+            except KeyError:
+                semaphore = _server_semaphores[
+                    self.server
+                ] = threading.BoundedSemaphore(self.MAX_CONNECTIONS_PER_SERVER)
+        return semaphore
+
+    def _cache_is_stale(self, entry: DataEntry, cache_path: Path) -> bool:
+        """Whether the entry needs to be (re)downloaded into the cache"""
+        if not cache_path.exists():
+            return True
+        try:
+            with open(append_suffix(cache_path, self.CHECKSUM_SUFFIX)) as f:
+                cached_checksums = json.load(f)
+        except (OSError, ValueError):
+            return True
+        checksums = entry.checksums
+        if checksums is None:
+            # Only the checksums need to be retrieved to check the cached copy
+            with self.connection:
+                checksums = self.get_checksums(entry.uri)
+        return cached_checksums != checksums
+
+    def _download_to_cache(self, entry: DataEntry, cache_path: Path):
+        """Downloads the file-set of an entry into the cache, coordinating with other
+        processes/threads attempting to download the same entry. Must be called within
+        an open connection to the store"""
+        download_dir = append_suffix(cache_path, self.DOWNLOAD_SUFFIX)
+        lock_path = append_suffix(cache_path, self.DOWNLOAD_LOCK_SUFFIX)
+        for attempt in range(self.MAX_DOWNLOAD_ATTEMPTS):
+            try:
+                # Creating the temporary download directory fails if another process
+                # is already downloading the entry, in which case wait for it to finish
+                os.makedirs(download_dir)
+            except FileExistsError:
+                if self._wait_for_download(entry, download_dir, lock_path, cache_path):
+                    break
+            else:
+                try:
+                    with DownloadLock(
+                        lock_path, heartbeat_interval=self.DOWNLOAD_POLL_INTERVAL
+                    ):
+                        data_path = self.download_files(entry, download_dir)
+                        if cache_path.exists():
+                            shutil.rmtree(cache_path)
+                        shutil.move(data_path, cache_path)
+                finally:
+                    shutil.rmtree(download_dir, ignore_errors=True)
+                break
         else:
+            raise ArcanaError(
+                f"Could not download {entry} into the cache after "
+                f"{self.MAX_DOWNLOAD_ATTEMPTS} attempts, as downloads by other "
+                "processes kept stalling"
+            )
+        # Save checksums for future reference, so we can check to see if cache
+        # is stale
+        checksums = self.get_checksums(entry.uri)
+        with open(str(cache_path) + self.CHECKSUM_SUFFIX, "w", **JSON_ENCODING) as f:
+            json.dump(checksums, f, indent=2)
+        self.cache_manager.added(cache_path)
+
+    def _wait_for_download(
+        self, entry: DataEntry, download_dir: Path, lock_path: Path, cache_path: Path
+    ) -> bool:
+        """Waits for a download of an entry by another process/thread to finish,
+        polling the heartbeat of its download lock at short intervals. If the download
+        hasn't made progress in `race_condition_delay` secs, or the process that owns it
+        has exited, it is assumed to have been interrupted and cleared so it can be
+        restarted
+
+        Returns
+        -------
+        bool
+            whether the entry was successfully downloaded by the other process
+        """
+        logger.info(
+            "Waiting for incomplete download of %s initiated by another process to "
+            "finish",
+            entry,
+        )
+        start = time.time()
+        last_heartbeat = None
+        last_change = time.monotonic()
+        while download_dir.exists():
+            # The heartbeat is stamped by the file server, whose clock can be skewed
+            # from the clock of this host, so instead of comparing it with the local
+            # time, the download is considered stalled if the heartbeat hasn't changed
+            # within the delay (as measured by the local clock). If the lock hasn't
+            # been written yet (or was left by an older version without locks) the
+            # delay is measured from the start of the wait
+            heartbeat = DownloadLock.heartbeat(lock_path)
+            if heartbeat != last_heartbeat:
+                last_heartbeat = heartbeat
+                last_change = time.monotonic()
+            if (
+                time.monotonic() - last_change > self.race_condition_delay
+                or DownloadLock.owner_is_dead(lock_path)
+            ):
+                logger.warning(
+                    "The download of %s hasn't updated in %s seconds (waited %.1f "
+                    "seconds), assuming that it was interrupted and restarting download",
+                    entry,
+                    self.race_condition_delay,
+                    time.time() - start,
+                )
+                self._clear_stalled_download(download_dir, lock_path)
+                return False
+            time.sleep(self.DOWNLOAD_POLL_INTERVAL)
+        waited = time.time() - start
+        if not cache_path.exists():
             logger.warning(
-                "The download of %s hasn't updated in %s "
-                "seconds, assuming that it was interrupted and "
-                "restarting download",
+                "The download of %s by another process failed after waiting %.1f "
+                "seconds, retrying",
                 entry,
-                delay,
+                waited,
             )
-            shutil.rmtree(download_dir)
-            os.mkdir(download_dir)
-            self.download_files(entry, download_dir)
+            return False
+        logger.info(
+            "The download of %s completed successfully in the other process after "
+            "waiting %.1f seconds, continuing",
+            entry,
+            waited,
+        )
+        return True
+
+    @classmethod
+    def _clear_stalled_download(cls, download_dir: Path, lock_path: Path):
+        # Move the directory out of the way atomically first so that only one of the
+        # processes waiting on the download clears it
+        stalled_dir = append_suffix(download_dir, f".stalled.{os.getpid()}")
+        try:
+            os.rename(download_dir, stalled_dir)
+        except FileNotFoundError:
+            return  # already cleared by another process
+        try:
+            lock_path.unlink()
+        except FileNotFoundError:
+            pass
+        shutil.rmtree(stalled_dir, ignore_errors=True)
 
     def cache_path(self, uri: str):
         """Path to the directory where the item is/should be cached. Note that
@@ -1,6 +1,7 @@
 from operator import itemgetter
 import pytest
 from arcana.core.data.store import DataStore
+from arcana.core.data.tree import IdInferencePlan
 from arcana.core.exceptions import ArcanaDataTreeConstructionError
 
 
@@ -102,3 +103,15 @@ def test_id_inference_fail5():
         match="Inferred IDs from decomposition conflict",
     ):
         DataStore.infer_ids(ids={"ab": "a0b0"}, id_patterns={"ab": r"ab::a(\d+)b\d+"})
+
+
+@pytest.mark.parametrize(
+    "fixture",
+    ID_INFERENCE_TESTS.items(),
+    ids=itemgetter(0),
+)
+def test_id_inference_plan(fixture):
+    test_name, (explicit_ids, id_patterns, metadata, expected_ids) = fixture
+    plan = IdInferencePlan.compile(id_patterns)
+    assert plan.infer(explicit_ids, metadata) == expected_ids
+    assert plan.infer_many([explicit_ids] * 3, [metadata] * 3) == [expected_ids] * 3
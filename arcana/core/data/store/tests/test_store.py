@@ -1,23 +1,32 @@
+import os
+import json
+import pickle
+import threading
 import operator as op
 from itertools import chain
 from functools import reduce, partial
 import time
+from pathlib import Path
 from multiprocessing import Pool, cpu_count
 import pytest
-from fileformats.generic import File
+from fileformats.generic import File, Directory
 from fileformats.text import TextFile
 from fileformats.field import Text as TextField
+from fileformats.application import Json
 from arcana.core.data.set.base import Dataset
-from arcana.core.data.store import DataStore
+from arcana.core.data.store import DataStore, RemoteStore
 from arcana.core.data.entry import DataEntry
+from arcana.core.data.row import DataRow
 from arcana.core.utils.serialize import asdict
+from arcana.core.utils.misc import append_suffix
+from arcana.core.exceptions import ArcanaDataMatchError
 from arcana.common import DirTree
 from arcana.testing.data.blueprint import (
     TestDatasetBlueprint,
     FileSetEntryBlueprint as FileBP,
     FieldEntryBlueprint as FieldBP,
 )
-from arcana.testing import MockRemote
+from arcana.testing import MockRemote, TestDataSpace
 
 
 def test_populate_tree(dataset: Dataset):
@@ -50,6 +59,21 @@ def test_populate_row(dataset):
         assert entry_paths == expected_paths
 
 
+def test_populate_rows(dataset: Dataset):
+    with dataset.tree:
+        rows = list(dataset.rows("abcd"))
+        DataRow.populate(rows)
+        assert all(r.is_populated for r in rows)
+        batched = {
+            r.id: sorted((e.path, str(e.uri)) for e in r.entries_dict.values())
+            for r in rows
+        }
+    # Compare against rows populated individually in a freshly loaded tree
+    for row in dataset.rows("abcd"):
+        assert not row.is_populated
+        assert batched[row.id] == sorted((e.path, str(e.uri)) for e in row.entries)
+
+
 def test_get(dataset: Dataset):
     blueprint = dataset.__annotations__["blueprint"]
     for entry_bp in blueprint.entries:
@@ -176,3 +200,303 @@ def delayed_download(entry: DataEntry, start_offset: float):
         with open(text_file.fspath, "w") as f:
             f.write("modified")
     return contents
+
+
+def test_datatype_verdict_cache(
+    delayed_mock_remote: MockRemote,
+    simple_dataset_blueprint: TestDatasetBlueprint,
+    monkeypatch,
+):
+    dataset = simple_dataset_blueprint.make_dataset(
+        delayed_mock_remote, "datatype_verdicts"
+    )
+    delayed_mock_remote.clear_cache()
+    downloads = []
+    download_files = MockRemote.download_files
+
+    def counting_download_files(self, entry, download_dir):
+        downloads.append(entry)
+        return download_files(self, entry, download_dir)
+
+    monkeypatch.setattr(MockRemote, "download_files", counting_download_files)
+
+    dataset.add_source("file1", TextFile)
+    assert len(list(dataset["file1"].cells())) == 1
+    assert len(downloads) == 1
+    # The verdict is reloaded from the cache by the freshly loaded tree
+    assert len(list(dataset["file1"].cells())) == 1
+    assert len(downloads) == 1
+    # Formats can be ruled out from the file names alone
+    dataset.add_source("json", Json, path="file2")
+    with pytest.raises(ArcanaDataMatchError, match="extension that matches"):
+        list(dataset["json"].cells())
+    assert len(downloads) == 1
+
+
+def test_prefetch(delayed_mock_remote: MockRemote, monkeypatch):
+    blueprint = TestDatasetBlueprint(
+        hierarchy=["abcd"],
+        space=TestDataSpace,
+        dim_lengths=[1, 1, 2, 4],
+        entries=[
+            FileBP(path="file1", datatype=TextFile, filenames=["file1.txt"]),
+        ],
+    )
+    dataset = blueprint.make_dataset(delayed_mock_remote, "prefetch")
+    dataset.add_source("file1", TextFile)
+    delayed_mock_remote.clear_cache()
+    delayed_mock_remote.mock_delay = 0.2
+    start = time.time()
+    dataset.prefetch(max_workers=4)
+    # Downloads are performed concurrently
+    assert time.time() - start < 8 * delayed_mock_remote.mock_delay
+    assert len(list(delayed_mock_remote.cache_dir.iterdir())) > 0
+
+    def fail_download(self, entry, download_dir):
+        assert False, f"{entry} should have been prefetched"
+
+    monkeypatch.setattr(MockRemote, "download_files", fail_download)
+    with dataset.tree:
+        assert sorted(i.contents for i in dataset["file1"]) == ["file1.txt"] * 8
+
+
+def test_cache_trim_and_dedup(delayed_mock_remote: MockRemote):
+    blueprint = TestDatasetBlueprint(
+        hierarchy=["abcd"],
+        space=TestDataSpace,
+        dim_lengths=[1, 1, 2, 4],
+        entries=[
+            FileBP(path="file1", datatype=TextFile, filenames=["file1.txt"]),
+        ],
+    )
+    dataset = blueprint.make_dataset(delayed_mock_remote, "cache_trim")
+    dataset.add_source("file1", TextFile)
+    delayed_mock_remote.clear_cache()
+    delayed_mock_remote.cache_dedup = True
+    with dataset.tree:
+        fspaths = [i.fspath for i in dataset["file1"]]
+    # Identical files are hard-linked to a single copy
+    assert len({p.stat().st_ino for p in fspaths}) == 1
+    file_size = fspaths[0].stat().st_size
+    entries = delayed_mock_remote.cache_manager.entries()
+    assert len(entries) == 8
+    assert sum(e.size for e in entries) == file_size
+    # Make the entries old enough to be evicted
+    for i, entry in enumerate(entries):
+        atime = time.time() - 3600 + i
+        os.utime(entry.sidecars[0], (atime, atime))
+    # The shared file is only freed once the last entry linking to it is evicted
+    assert delayed_mock_remote.trim_cache(max_size=0) == file_size
+    assert not delayed_mock_remote.cache_manager.entries()
+    assert not list((delayed_mock_remote.cache_dir / ".blobs").iterdir())
+
+
+def test_stalled_download(
+    delayed_mock_remote: MockRemote, simple_dataset_blueprint: TestDatasetBlueprint
+):
+    dataset = simple_dataset_blueprint.make_dataset(
+        delayed_mock_remote, "stalled_download"
+    )
+    entry = next(iter(dataset.rows())).entry("file1")
+    delayed_mock_remote.clear_cache()
+    delayed_mock_remote.race_condition_delay = 1
+    # Simulate a download by another process that has stopped updating its heartbeat
+    cache_path = delayed_mock_remote.cache_path(entry.uri)
+    download_dir = append_suffix(cache_path, delayed_mock_remote.DOWNLOAD_SUFFIX)
+    lock_path = append_suffix(cache_path, delayed_mock_remote.DOWNLOAD_LOCK_SUFFIX)
+    download_dir.mkdir(parents=True)
+    lock_path.write_text(json.dumps({"pid": os.getpid(), "host": None}))
+    stalled = time.time() - 60
+    os.utime(lock_path, (stalled, stalled))
+    start = time.time()
+    assert TextFile(entry.item).contents == "file1.txt"
+    assert time.time() - start < 2 * delayed_mock_remote.race_condition_delay
+    assert not download_dir.exists()
+    assert not lock_path.exists()
+
+
+def test_parallel_upload(delayed_mock_remote: MockRemote, work_dir, monkeypatch):
+    dataset = TestDatasetBlueprint(
+        hierarchy=["abcd"],
+        space=TestDataSpace,
+        dim_lengths=[1, 1, 1, 1],
+        entries=[],
+    ).make_dataset(delayed_mock_remote, "parallel_upload")
+    src_dir = work_dir / "to-upload"
+    src_dir.mkdir()
+    for i in range(8):
+        (src_dir / f"file{i}.txt").write_text(f"file {i}")
+    delayed_mock_remote.mock_delay = 0.1
+
+    def timed_put(path):
+        start = time.time()
+        with delayed_mock_remote.connection:
+            entry = delayed_mock_remote.create_entry(path, Directory, dataset.root)
+            delayed_mock_remote.put(Directory(src_dir), entry)
+        return time.time() - start
+
+    # Benchmark uploading the files one after the other against uploading them
+    # concurrently (the mock delay simulates the latency of each upload)
+    with monkeypatch.context() as m:
+        m.setattr(MockRemote, "upload_file", RemoteStore.upload_file)
+        serial = timed_put("serial@")
+    parallel = timed_put("parallel@")
+    assert parallel < serial / 2
+
+    # Stores that can upload single files but not delete them fall back to uploading
+    # whole file-sets
+    with monkeypatch.context() as m:
+        m.setattr(MockRemote, "delete_files", RemoteStore.delete_files)
+        timed_put("no_delete@")
+    with dataset.tree:
+        reloaded = dataset.root.entry("no_delete@").get_item(Directory)
+    assert sorted(p.name for p in reloaded.fspath.iterdir()) == sorted(
+        p.name for p in src_dir.iterdir()
+    )
+
+    # Interrupt an upload part-way through and check that it is resumed
+    upload_file = MockRemote.upload_file
+    uploaded = []
+    lock = threading.Lock()
+    fail_after = 3
+
+    def counting_upload_file(self, fspath, rel_path, entry):
+        with lock:
+            if fail_after is not None and len(uploaded) >= fail_after:
+                raise RuntimeError("connection dropped")
+            uploaded.append(rel_path)
+        upload_file(self, fspath, rel_path, entry)
+
+    monkeypatch.setattr(MockRemote, "upload_file", counting_upload_file)
+    with delayed_mock_remote.connection:
+        entry = delayed_mock_remote.create_entry("resumed@", Directory, dataset.root)
+        with pytest.raises(RuntimeError, match="connection dropped"):
+            delayed_mock_remote.put(Directory(src_dir), entry)
+        uploaded.clear()
+        fail_after = None
+        delayed_mock_remote.put(Directory(src_dir), entry)
+    # Only the files that weren't uploaded by the interrupted attempt are uploaded
+    assert len(uploaded) == 5
+    with dataset.tree:
+        reloaded = dataset.root.entry("resumed@").get_item(Directory)
+    assert sorted(p.name for p in reloaded.fspath.iterdir()) == sorted(
+        p.name for p in src_dir.iterdir()
+    )
+
+
+def append_fields(fpath: Path, worker: int, n_fields: int):
+    store = DirTree()
+    for i in range(n_fields):
+        store.update_json(fpath, f"field_{worker}_{i}", i)
+
+
+def test_concurrent_field_appends(work_dir: Path, monkeypatch):
+    # Compact the log frequently so that compactions overlap with appends
+    monkeypatch.setattr(DirTree, "JSON_LOG_MAX_SIZE", 256)
+    fpath = work_dir / DirTree.FIELDS_FNAME
+    # Reads don't lock the file, so don't create lock files in the dataset
+    assert DirTree().load_json(fpath) == {}
+    assert not append_suffix(fpath, DirTree.LOCK_SUFFIX).exists()
+    n_workers, n_fields = 4, 50
+    with Pool(n_workers) as p:
+        try:
+            p.starmap(append_fields, [(fpath, w, n_fields) for w in range(n_workers)])
+        finally:
+            p.close()
+            p.join()
+    store = DirTree()
+    expected = {f"field_{w}_{i}": i for w in range(n_workers) for i in range(n_fields)}
+    assert store.load_json(fpath) == expected
+    assert fpath.exists()  # the log has been compacted into the snapshot
+    store.compact_json(fpath)
+    assert not append_suffix(fpath, DirTree.JSON_LOG_SUFFIX).exists()
+    with open(fpath) as f:
+        assert json.load(f) == expected
+
+
+def read_fields(fpath: Path, n_reads: int):
+    store = DirTree()
+    for i in range(n_reads):
+        fields = store.load_json(fpath)
+        # Each writer writes its fields in order, so if a field is visible all the
+        # fields written before it by the same writer must be too
+        for key, value in fields.items():
+            writer = key.split("_")[1]
+            assert all(
+                f"field_{writer}_{j}" in fields for j in range(value)
+            ), f"Inconsistent read of {fpath}"
+
+
+def test_concurrent_field_reads(work_dir: Path):
+    fpath = work_dir / DirTree.FIELDS_FNAME
+    store = DirTree()
+    for i in range(200):
+        store.update_json(fpath, f"field_init_{i}", 0)
+    n_readers, n_writers, n_reads = 6, 2, 200
+    with Pool(n_readers + n_writers) as p:
+        try:
+            writes = p.starmap_async(
+                append_fields, [(fpath, w, 100) for w in range(n_writers)]
+            )
+            p.starmap(read_fields, [(fpath, n_reads)] * n_readers)
+            writes.get()
+        finally:
+            p.close()
+            p.join()
+    assert store.read_from_json(fpath, f"field_{n_writers - 1}_99") == 99
+
+
+def test_field_transaction(work_dir: Path):
+    fpath = work_dir / DirTree.FIELDS_FNAME
+    log_path = append_suffix(fpath, DirTree.JSON_LOG_SUFFIX)
+    store = DirTree()
+    with store.transaction:
+        with store.transaction:  # nested transactions are committed by the outermost
+            for i in range(10):
+                store.update_json(fpath, f"field_{i}", i)
+        # Updates are visible within the transaction before they are committed
+        assert store.read_from_json(fpath, "field_9") == 9
+        assert not log_path.exists()
+        # The store can be pickled within a transaction (e.g. by Pydra), but the
+        # unpickled store isn't part of it
+        assert not pickle.loads(pickle.dumps(store)).transaction.active
+    # All updates are appended in a single line
+    with open(log_path) as f:
+        assert len(f.readlines()) == 1
+    assert store.load_json(fpath) == {f"field_{i}": i for i in range(10)}
+
+
+def test_streaming_rows(delayed_mock_remote: MockRemote):
+    blueprint = TestDatasetBlueprint(
+        hierarchy=["abcd"],
+        space=TestDataSpace,
+        dim_lengths=[1, 1, 5, 5],
+        entries=[
+            FileBP(path="file1", datatype=TextFile, filenames=["file1.txt"]),
+        ],
+    )
+    dataset = blueprint.make_dataset(delayed_mock_remote, "streaming")
+    dataset.add_source("file1", TextFile)
+    with dataset.tree:
+        pages = dataset.iter_row_pages()
+        first_page = next(pages)
+        # Rows are available before the store has finished listing the leaves
+        assert len(first_page) == MockRemote.LEAVES_PAGE_SIZE
+        assert not dataset.tree.is_populated
+        # The length of the column is counted by the store
+        assert len(dataset["file1"]) == 25
+        assert not dataset.tree.is_populated
+        # Datasets can be pickled (e.g. by Pydra) while their tree is partly paged, in
+        # which case the unpickled tree is populated again when it is entered
+        unpickled = pickle.loads(pickle.dumps(dataset))
+        assert unpickled.tree.root is None
+        with unpickled.tree:
+            unpickled_ids = list(unpickled.row_ids())
+        rows = first_page + [r for p in pages for r in p]
+        assert dataset.tree.is_populated
+        assert [r.id for r in rows] == list(dataset.row_ids())
+        assert unpickled_ids == [r.id for r in rows]
+    with dataset.tree:
+        cells = list(dataset["file1"].cells())
+        assert [c.row.id for c in cells] == [r.id for r in rows]
+        assert all(not c.is_empty for c in cells)
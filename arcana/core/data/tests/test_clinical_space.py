@@ -1,4 +1,7 @@
+import pytest
 from arcana.common import Clinical
+from arcana.core.data.space import SpaceTables
+from arcana.testing.data.space import TestDataSpace
 
 
 def test_is_parent():
@@ -73,3 +76,24 @@ def test_is_parent():
     assert Clinical.dataset.is_parent(Clinical.batch)
     assert Clinical.dataset.is_parent(Clinical.matchedpoint)
     assert not Clinical.dataset.is_parent(Clinical.dataset)
+
+
+@pytest.mark.parametrize("space", [Clinical, TestDataSpace])
+def test_space_algebra(space):
+    for a in space:
+        assert a.span() == [space(b) for b in sorted(a.nonzero_bits(), reverse=True)]
+        assert sum(a.nonzero_bits()) == a.value
+        for b in space:
+            assert (a & b).value == a.value & b.value
+            assert (a | b).value == a.value | b.value
+            assert (a ^ b).value == a.value ^ b.value
+            assert a.is_parent(b) == (a.value & b.value == a.value and a != b)
+            assert a.is_parent(b, if_match=True) == (a.value & b.value == a.value)
+    assert space.leaf() == max(space)
+    assert space.axes() == max(space).span()
+    # The tables are only calculated once per space and the operators return the
+    # existing members rather than constructing new ones
+    assert SpaceTables.of(space) is SpaceTables.of(space)
+    for a in space:
+        for b in space:
+            assert (a ^ b) is space(a.value ^ b.value)
@@ -1,7 +1,9 @@
 from operator import mul
 from functools import reduce
+import pytest
 from fileformats.core import FileSet
 from arcana.core.data.set.base import Dataset
+from arcana.core.exceptions import ArcanaDataMatchError
 
 
 def test_column_api_access(dataset: Dataset):
@@ -26,3 +28,24 @@ def test_column_api_access(dataset: Dataset):
                     assert sorted(p.name for p in item.fspaths) == sorted(
                         fileset_bp.filenames
                     )
+
+
+def test_column_matcher(dataset: Dataset):
+
+    bp = dataset.__annotations__["blueprint"]
+    entry_bp = bp.entries[0]
+    col = dataset.add_source(entry_bp.path, entry_bp.datatype)
+
+    with dataset.tree:
+        matcher = col.matcher
+        assert col.matcher is matcher  # reused while the column is unchanged
+        cells = list(col.cells())
+        assert len(cells) == reduce(mul, bp.dim_lengths)
+        assert all(c.entry.path == col.match_entry(c.row).path for c in cells)
+        # Changing the criteria of the column recompiles the matcher
+        col.path = "doesnt-exist"
+        assert col.matcher is not matcher
+        row = cells[0].row
+        assert col.match_entry(row, allow_none=True) is None
+        with pytest.raises(ArcanaDataMatchError, match="that matched the path"):
+            col.match_entry(row)
@@ -1,9 +1,11 @@
 from pathlib import Path
+import pytest
 import cloudpickle as cp
 from pydra import mark, Workflow
 from pydra.utils.hash import hash_object
 from arcana.core.data.set.base import Dataset
 from arcana.core.utils.serialize import asdict, fromdict
+from arcana.core.exceptions import ArcanaNameError
 
 
 def test_dataset_asdict_roundtrip(dataset):
@@ -49,3 +51,24 @@ def test_dataset_bytes_hash(dataset):
     hsh = hash_object(dataset)
     # Check hashing is stable
     assert hash_object(dataset) == hsh
+
+
+def test_dataset_row_lookup(dataset: Dataset):
+    leaf = dataset.space.leaf()
+    with dataset.tree:
+        rows = list(dataset.rows(leaf))
+        for row in rows:
+            axis_ids = tuple(row.ids[a] for a in leaf.span())
+            assert dataset.row(leaf, row.id) is row
+            assert dataset.row(leaf, axis_ids) is row
+            assert (
+                dataset.row(leaf, **{str(a): i for a, i in zip(leaf.span(), axis_ids)})
+                is row
+            )
+        ids = [r.id for r in rows[::2]]
+        assert [r.id for r in dataset.rows_by_ids(leaf, ids)] == ids
+        assert [r.id for r in dataset.rows(leaf, ids=ids + ["not-an-id"])] == ids
+        with pytest.raises(ArcanaNameError, match="not present in data tree"):
+            dataset.rows_by_ids(leaf, ids + ["not-an-id"])
+        with pytest.raises(ArcanaNameError, match="not present in data tree"):
+            dataset.row(leaf, "not-an-id")
@@ -1,11 +1,22 @@
 from __future__ import annotations
+import os
+import time
+import copy
+import pickle
 from operator import itemgetter
 import pytest
 import typing as ty
 from fileformats.text import TextFile
+from fileformats.field import Text as TextField
 from arcana.core.exceptions import ArcanaUsageError
+from arcana.core.data.tree import DataTree
+from arcana.core.data.row import DataRow, RowIds, NO_CHILDREN
 from arcana.common import DirTree, Clinical
-from arcana.testing.data.blueprint import TestDatasetBlueprint, FileSetEntryBlueprint
+from arcana.testing.data.blueprint import (
+    TestDatasetBlueprint,
+    FileSetEntryBlueprint,
+    FieldEntryBlueprint,
+)
 from arcana.testing.data.space import TestDataSpace
 
 
@@ -149,6 +160,12 @@ def test_dataset_inclusion(
     dataset_path = work_dir / test_name
     dataset = blueprint.make_dataset(store=DirTree(), dataset_id=dataset_path)
     assert sorted(dataset.row_ids()) == expected
+    with dataset.tree:
+        # The criteria compiled into the layer plan of the tree are pickled along with
+        # the dataset (e.g. by Pydra)
+        assert dataset.tree.layer_plan is not None
+        unpickled = pickle.loads(pickle.dumps(dataset))
+    assert sorted(unpickled.row_ids()) == expected
 
 
 def test_include_exclude_fail1(work_dir):
@@ -278,3 +295,223 @@ def test_auto_ids(work_dir, fixture):
 
     for key, ids in expected.items():
         assert sorted(dataset.row_ids(key)) == ids
+
+
+def test_tree_index(work_dir, monkeypatch):
+
+    blueprint = TestDatasetBlueprint(
+        space=TestDataSpace,
+        hierarchy=["a", "b", "c", "abcd"],
+        dim_lengths=[1, 2, 2, 2],
+        entries=[
+            FileSetEntryBlueprint(
+                path="file1", datatype=TextFile, filenames=["file1.txt"]
+            ),
+        ],
+        id_patterns={"d": r"abcd::.*(d\d+)"},
+    )
+    dataset_path = work_dir / "tree-index"
+    dataset = blueprint.make_dataset(store=DirTree(), dataset_id=dataset_path)
+
+    def backdate(age):
+        old = time.time() - age
+        for dpath, _, _ in os.walk(dataset_path):
+            os.utime(dpath, (old, old))
+
+    backdate(100)
+    num_scans = []
+    populate_tree = DirTree.populate_tree
+
+    def counting_populate_tree(self, tree):
+        num_scans.append(tree)
+        return populate_tree(self, tree)
+
+    monkeypatch.setattr(DirTree, "populate_tree", counting_populate_tree)
+
+    with dataset.tree:
+        expected = sorted(dataset.row_ids())
+    assert len(num_scans) == 1
+    assert dataset.tree.index_path.exists()
+    backdate(100)  # writing the index updates the modification times
+    with dataset.tree:
+        assert sorted(dataset.row_ids()) == expected
+    assert len(num_scans) == 2
+    with dataset.tree:
+        assert sorted(dataset.row_ids()) == expected
+        assert sorted(dataset.row_ids("d")) == ["d0", "d1"]
+    assert len(num_scans) == 2  # tree loaded from index
+    # Adding a new leaf changes the fingerprint
+    (dataset_path / "a0" / "b0" / "c0" / "a0b0c0d2").mkdir()
+    backdate(50)
+    with dataset.tree:
+        assert "a0b0c0d2" in dataset.row_ids()
+    assert len(num_scans) == 3
+
+
+def test_entries_manifest(work_dir, monkeypatch):
+
+    blueprint = TestDatasetBlueprint(
+        space=TestDataSpace,
+        hierarchy=["a", "b", "c", "abcd"],
+        dim_lengths=[1, 1, 2, 2],
+        entries=[
+            FileSetEntryBlueprint(
+                path="file1", datatype=TextFile, filenames=["file1.txt"]
+            ),
+            FieldEntryBlueprint(
+                path="field1",
+                row_frequency="abcd",
+                datatype=TextField,
+                value="sample-text",
+            ),
+        ],
+        id_patterns={"d": r"abcd::.*(d\d+)"},
+    )
+    dataset_path = work_dir / "entries-manifest"
+    dataset = blueprint.make_dataset(store=DirTree(), dataset_id=dataset_path)
+    start = time.time()
+
+    def backdate(age):
+        # Only backdate paths modified since the fixed time, so the fingerprints of
+        # unmodified rows don't change
+        old = start - age
+        for dpath, _, fnames in os.walk(dataset_path):
+            for fspath in [dpath] + [os.path.join(dpath, f) for f in fnames]:
+                if os.stat(fspath).st_mtime > old:
+                    os.utime(fspath, (old, old))
+
+    def list_entries():
+        with dataset.tree:
+            rows = list(dataset.rows())
+            DataRow.populate(rows)
+            return {
+                row.id: sorted(
+                    (e.path, e.datatype, str(e.uri), e.quality) for e in row.entries
+                )
+                for row in rows
+            }
+
+    backdate(100)
+    scanned = []
+    scan_row = DirTree._scan_row
+
+    def counting_scan_row(self, row, root_dir):
+        scanned.append(row.id)
+        return scan_row(self, row, root_dir)
+
+    monkeypatch.setattr(DirTree, "_scan_row", counting_scan_row)
+
+    expected = list_entries()
+    assert len(scanned) == 4
+    assert all(len(e) == 2 for e in expected.values())
+    assert dataset.tree.entries_manifest_path.exists()
+    backdate(100)
+    # The rows are populated from the manifest while they are unchanged
+    assert list_entries() == expected
+    assert len(scanned) == 4
+    # Reloaded from the saved manifest by a new data tree
+    dataset.tree._entries_manifest = None
+    assert list_entries() == expected
+    assert len(scanned) == 4
+    # Adding a file-set to a row changes the modification time of its directory
+    row_path = dataset_path / "a0" / "b0" / "c0" / "a0b0c0d1"
+    (row_path / "file2.txt").write_text("file2")
+    # Adding a field to a row appends it to the log of the fields JSON
+    dataset.store.update_json(
+        dataset_path / "a0" / "b0" / "c1" / "a0b0c1d0" / DirTree.FIELDS_FNAME,
+        "field2",
+        "more-text",
+    )
+    backdate(50)
+    changed = list_entries()
+    assert sorted(scanned[4:]) == ["a0b0c0d1", "a0b0c1d0"]
+    assert len(changed["a0b0c0d1"]) == 3
+    assert len(changed["a0b0c1d0"]) == 3
+    assert changed["a0b0c0d0"] == expected["a0b0c0d0"]
+    # Rows accessed outside of the tree context don't rewrite the manifest each time
+    # they are populated, their entries are saved when the tree context next exits
+    with dataset.tree:
+        rows = list(dataset.rows())
+    (row_path / "file3.txt").write_text("file3")
+    backdate(25)
+    manifest_mtime = dataset.tree.entries_manifest_path.stat().st_mtime
+    assert len(rows[1].entries) == 4
+    assert dataset.tree.entries_manifest_path.stat().st_mtime == manifest_mtime
+    with dataset.tree:
+        pass
+    dataset.tree._entries_manifest = None
+    assert len(list_entries()["a0b0c0d1"]) == 4
+    assert sorted(scanned[6:]) == ["a0b0c0d1"]
+
+
+def test_add_leaves_bulk(work_dir):
+
+    blueprint = TestDatasetBlueprint(
+        space=Clinical,
+        hierarchy=["subject", "timepoint"],
+        dim_lengths=[1, 1, 1],
+        entries=[],
+    )
+    dataset = blueprint.make_dataset(store=DirTree(), dataset_id=work_dir / "bulk")
+    num_subjects, num_timepoints = 20, 5
+    tree_paths = [
+        (f"sub{i}", f"tp{j}")
+        for i in range(num_subjects)
+        for j in range(num_timepoints)
+    ]
+    tree = DataTree(dataset=dataset)
+    rows = tree.add_leaves(tree_paths)
+    assert len(rows) == num_subjects * num_timepoints
+    assert len(tree.root.children[Clinical.session]) == len(tree_paths)
+    assert len(tree.root.children[Clinical.subject]) == num_subjects
+    assert len(tree.root.children[Clinical.timepoint]) == num_timepoints
+    assert rows[-1].frequency_id("member") == f"sub{num_subjects - 1}"
+    # Check the bulk path builds the same tree as adding the leaves one at a time
+    single_tree = DataTree(dataset=dataset)
+    for tree_path in tree_paths:
+        single_tree.add_leaf(tree_path)
+    assert single_tree._leaves == tree._leaves
+
+
+def test_compact_rows(work_dir):
+
+    blueprint = TestDatasetBlueprint(
+        space=Clinical,
+        hierarchy=["subject", "timepoint"],
+        dim_lengths=[1, 1, 1],
+        entries=[],
+    )
+    dataset = blueprint.make_dataset(store=DirTree(), dataset_id=work_dir / "compact")
+    # Create new label strings for each leaf as a store would when scanning them
+    tree_paths = [
+        ("sub" + str(i), "".join(["tp", str(j)])) for i in range(1000) for j in range(5)
+    ]
+    tree = DataTree(dataset=dataset)
+    rows = tree.add_leaves(tree_paths)
+    assert isinstance(rows[0].ids, RowIds)
+    assert dict(rows[7].ids) == {
+        Clinical.dataset: None,
+        Clinical.member: "sub1",
+        Clinical.group: None,
+        Clinical.subject: "sub1",
+        Clinical.timepoint: "tp2",
+        Clinical.batch: "tp2",
+        Clinical.matchedpoint: ("tp2", "sub1"),
+        Clinical.session: ("tp2", "sub1"),
+    }
+    # Identical IDs are shared between rows
+    assert rows[2].ids[Clinical.timepoint] is rows[7].ids[Clinical.timepoint]
+    # Children and cells are only created when they are needed
+    assert rows[0].children is NO_CHILDREN
+    assert rows[0]._cells is None
+    # The shared empty children are restored when rows are pickled or copied
+    assert pickle.loads(pickle.dumps(rows[0].children)) is NO_CHILDREN
+    assert copy.deepcopy(rows[0].children) is NO_CHILDREN
+    subject = tree.root.children[Clinical.subject]["sub1"]
+    assert list(subject.children[Clinical.session]) == [
+        "tp0",
+        "tp1",
+        "tp2",
+        "tp3",
+        "tp4",
+    ]
@@ -1,17 +1,25 @@
 from __future__ import annotations
 import logging
+import os
 import typing as ty
 import re
+import json
+import hashlib
+import tempfile
+from functools import lru_cache
+from pathlib import Path
 from collections import defaultdict
 import attrs
 import attrs.filters
 from arcana.core.utils.misc import NestedContext
+from arcana.core.utils.serialize import ClassResolver
 from arcana.core.data.space import DataSpace
 from arcana.core.exceptions import (
-    ArcanaNameError,
     ArcanaDataTreeConstructionError,
+    ArcanaUsageError,
 )
-from .row import DataRow
+from .quality import DataQuality
+from .row import DataRow, RowIds, NO_CHILDREN
 
 if ty.TYPE_CHECKING:  # pragma: no cover
     from .set.base import Dataset
@@ -24,6 +32,397 @@ def auto_ids_default():
     return defaultdict(dict)
 
 
+@lru_cache(maxsize=None)
+def resolve_datatype(datatype_str: str) -> type:
+    return ClassResolver.fromstr(datatype_str)
+
+
+@attrs.define
+class Layer:
+    """A layer of the hierarchy of a dataset
+
+    Parameters
+    ----------
+    name : str
+        the frequency of the layer
+    span : list[str]
+        the axes spanned by the layer
+    new_span : list[str]
+        the axes spanned by the layer that aren't spanned by the layers above it
+    all_new : bool
+        whether none of the axes spanned by the layer are spanned by the layers above
+    """
+
+    name: str
+    span: ty.List[str]
+    new_span: ty.List[str]
+    all_new: bool
+
+
+@attrs.define
+class LayerPlan:
+    """The quantities derived from the definition of a dataset (its space, hierarchy
+    and inclusion/exclusion criteria) that are used to add each leaf to its data tree,
+    so they only need to be calculated once per tree instead of once per leaf
+
+    Parameters
+    ----------
+    hierarchy : list[str]
+        the frequencies of the layers of the hierarchy
+    layers : list[Layer]
+        the axes spanned by each layer of the hierarchy
+    composites : list[tuple[str, list[str]]]
+        the non-basis frequencies of the space and the axes they span
+    frequencies : list[DataSpace]
+        the frequencies of the space
+    spans : dict[DataSpace, tuple[DataSpace, ...]]
+        the axes spanned by each frequency of the space
+    freq_strs : list[str]
+        the names of the frequencies of the space
+    leaf : DataSpace
+        the leaf frequency of the space
+    parents : dict[DataSpace, list[tuple[DataSpace, DataSpace]]]
+        for each frequency, its (non-root) parent frequencies and the axes that
+        differentiate rows of the frequency within the parent rows
+    row_ids_keys : dict[DataSpace, tuple[list[DataSpace], dict[DataSpace, int]]]
+        for each frequency, the frequencies the IDs of its rows are keyed by and their
+        positions, which are shared between the ``RowIds`` of all rows of the
+        frequency
+    exclude : dict[str, Callable]
+        functions that check whether a label matches the exclusion criteria of its
+        frequency
+    include : dict[str, Callable]
+        functions that check whether an ID matches the inclusion criteria of its
+        frequency
+    id_inference : IdInferencePlan
+        the compiled ID-inference patterns of the dataset
+    """
+
+    hierarchy: ty.List[str]
+    layers: ty.List[Layer]
+    composites: ty.List[ty.Tuple[str, ty.List[str]]]
+    frequencies: ty.List[DataSpace]
+    spans: ty.Dict[DataSpace, ty.Tuple[DataSpace, ...]]
+    freq_strs: ty.List[str]
+    leaf: DataSpace
+    parents: ty.Dict[DataSpace, ty.List[ty.Tuple[DataSpace, DataSpace]]]
+    row_ids_keys: ty.Dict[
+        DataSpace, ty.Tuple[ty.List[DataSpace], ty.Dict[DataSpace, int]]
+    ]
+    exclude: ty.Dict[str, ty.Callable[[str], bool]]
+    include: ty.Dict[str, ty.Callable[[str], bool]]
+    id_inference: IdInferencePlan
+
+    @classmethod
+    def compile(cls, dataset: Dataset) -> LayerPlan:
+        """Derives the layer plan from the definition of the dataset
+
+        Parameters
+        ----------
+        dataset : Dataset
+            the dataset to derive the plan for
+
+        Returns
+        -------
+        LayerPlan
+            the derived plan
+        """
+        space = dataset.space
+        hierarchy = [str(h) for h in dataset.hierarchy]
+        layers = []
+        cummulative_freq = space(0)
+        for layer_str in hierarchy:
+            layer_freq = space[layer_str]
+            # If all the axes introduced by the layer not present in parent layers
+            # and none of the IDs of these axes have been inferred from other IDs,
+            # then the ID of the axis out of the layer's axes with the least-
+            # significant bit can be considered to be equivalent to the
+            # ID of the layer and the IDs of the other axes of the layer set to None
+            # (the order of # the bits in the DataSpace class should be arranged to
+            # account for this default behaviour).
+            #
+            # For example, given a hierarchy of ['subject', 'session'] in the `Clinical`
+            # data space, no groups are assumed to be present by default (i.e. if not
+            # specified by the `id_patterns` attr of the dataset), and the `member`
+            # ID is assumed to be equivalent to the `subject` ID, since `member`
+            # correspdonds to the least significant bit in the value of the subject in
+            # the `Clinical` data space enum.
+            #
+            # Conversely, the timepoint can't be assumed to be equal to the `session`
+            # ID, since the session ID could be expected to also contain both the `member` and
+            # `group` ID in it, and should be explicitly extracted by via `id_patterns`
+            #
+            #       session ID: MRH010_CONTROL03_MR02
+            #
+            # with the '02' part representing as the timepoint can be extracted with the
+            #
+            #       id_inference = {
+            #           'timepoint': r'session:id:.*MR(0-9+)$'
+            #       }
+            # Axes already added by predecessor layers
+            prev_accounted_for = layer_freq & cummulative_freq
+            # Axes added by this layer
+            new = prev_accounted_for ^ layer_freq
+            assert new, f"{layer_str} doesn't add any new axes on predecessor layers"
+            layers.append(
+                Layer(
+                    name=layer_str,
+                    span=[str(f) for f in layer_freq.span()],
+                    new_span=[str(f) for f in new.span()],
+                    all_new=not prev_accounted_for,
+                )
+            )
+            cummulative_freq |= layer_freq
+        assert cummulative_freq == space.leaf()
+        frequencies = list(space)
+        axes = set(space.axes())
+        composites = [
+            (str(f), [str(b) for b in f.span()]) for f in frequencies if f not in axes
+        ]
+        parents = {}
+        row_ids_keys = {}
+        for freq in frequencies:
+            parents[freq] = [
+                (parent_freq, freq ^ parent_freq)
+                for parent_freq in frequencies
+                if parent_freq and parent_freq.is_parent(freq)
+            ]
+            id_freqs = [f for f in frequencies if f.is_parent(freq, if_match=True)]
+            row_ids_keys[freq] = (
+                id_freqs,
+                {f: i for i, f in enumerate(id_freqs)},
+            )
+        return cls(
+            hierarchy=hierarchy,
+            layers=layers,
+            composites=composites,
+            frequencies=frequencies,
+            spans={f: tuple(f.span()) for f in frequencies},
+            freq_strs=[str(f) for f in frequencies],
+            leaf=space.leaf(),
+            parents=parents,
+            row_ids_keys=row_ids_keys,
+            exclude={f: cls._compile_criteria(c) for f, c in dataset.exclude.items()},
+            include={f: cls._compile_criteria(c) for f, c in dataset.include.items()},
+            id_inference=dataset.id_inference_plan,
+        )
+
+    @classmethod
+    def _compile_criteria(
+        cls, criteria: ty.Union[ty.List[str], str]
+    ) -> ty.Callable[[str], bool]:
+        if isinstance(criteria, list):
+            return frozenset(criteria).__contains__
+        # Bound methods are returned rather than closures so the plan can be pickled
+        # along with the tree
+        return re.compile(criteria).match
+
+
+@attrs.define
+class IdComponent:
+    """A component of an ID-inference pattern, which extracts a value from either
+    the label or a metadata field of a row in one of the layers of the hierarchy
+
+    Parameters
+    ----------
+    source_freq : str
+        the frequency of the layer to extract the value from
+    attr_name : str
+        the metadata field to extract the value from, "ID" for the label
+    regex : re.Pattern, optional
+        a regular expression with a single group used to extract the value
+    """
+
+    source_freq: str
+    attr_name: str
+    regex: ty.Optional[ty.Pattern] = None
+
+
+@attrs.define
+class IdInference:
+    """Infers the ID of a frequency from the components of a single ID-inference
+    pattern
+
+    Parameters
+    ----------
+    freq : str
+        the frequency whose ID is inferred
+    components : list[IdComponent]
+        the components extracted from the labels and metadata of the row
+    literals : list[str], optional
+        the literal parts of a templated pattern, between which the extracted
+        components are inserted. None if the pattern consists of a single component
+    """
+
+    freq: str
+    components: ty.List[IdComponent]
+    literals: ty.Optional[ty.List[str]] = None
+
+
+@attrs.define
+class IdInferencePlan:
+    """The ID-inference patterns of a dataset (see ``DataStore.infer_ids``) compiled
+    into regular expressions, sources and templates, so the patterns don't need to be
+    parsed again for every leaf of the data tree
+
+    Parameters
+    ----------
+    id_patterns : dict[str, str]
+        the patterns the plan was compiled from
+    inferences : list[IdInference]
+        the compiled inference for each pattern
+    """
+
+    id_patterns: ty.Dict[str, str]
+    inferences: ty.List[IdInference]
+
+    # Matches components to be substituted into ID-inference templates
+    pattern_comp_re = re.compile(r"#[^\#]+#")
+
+    @classmethod
+    def compile(cls, id_patterns: ty.Optional[ty.Dict[str, str]]) -> IdInferencePlan:
+        """Compiles the ID-inference patterns into a plan
+
+        Parameters
+        ----------
+        id_patterns : dict[str, str]
+            patterns used to infer IDs not explicitly in the hierarchy of the dataset
+
+        Returns
+        -------
+        IdInferencePlan
+            the compiled plan
+        """
+        id_patterns = dict(id_patterns) if id_patterns else {}
+        inferences = []
+        for freq, pattern in id_patterns.items():
+            comps = cls.pattern_comp_re.findall(pattern)
+            if comps:
+                literals = cls.pattern_comp_re.split(pattern)
+            else:
+                comps = [pattern]
+                literals = None
+            components = []
+            for comp in comps:
+                parts = comp.strip("#").split(":")
+                attr_name = parts[1] if len(parts) >= 2 and parts[1] else "ID"
+                if attr_name.lower() == "id":
+                    attr_name = "ID"
+                regex = ":".join(parts[2:])
+                components.append(
+                    IdComponent(
+                        source_freq=parts[0] if parts[0] else freq,
+                        attr_name=attr_name,
+                        regex=re.compile(regex) if regex else None,
+                    )
+                )
+            inferences.append(
+                IdInference(freq=freq, components=components, literals=literals)
+            )
+        return cls(id_patterns=id_patterns, inferences=inferences)
+
+    def infer(
+        self,
+        ids: ty.Dict[str, str],
+        metadata: ty.Optional[ty.Dict[str, ty.Dict[str, str]]] = None,
+    ) -> ty.Dict[str, str]:
+        """Infers IDs from those explicitly provided
+
+        Parameters
+        ----------
+        ids : dict[str, str]
+            explicitly provided IDs
+        metadata : dict[str, ty.Dict[str, str]]
+            metadata associated with the nodes in each layer
+
+        Returns
+        -------
+        inferred_ids : dict[str, str]
+            IDs inferred from the decomposition
+        """
+        if not self.inferences:
+            return {}
+        if metadata is None:
+            metadata = {}
+        conflicting = set(ids).intersection(self.id_patterns)
+        if conflicting:
+            raise ArcanaDataTreeConstructionError(
+                "Inferred IDs from decomposition conflict with explicitly provided IDs: "
+                + str(conflicting)
+            )
+        inferred_ids = {}
+        for inference in self.inferences:
+            substitutions = [
+                self._extract(c, ids, metadata) for c in inference.components
+            ]
+            if inference.literals is None:
+                inferred_ids[inference.freq] = substitutions[0]
+            else:
+                parts = [inference.literals[0]]
+                for sub, literal in zip(substitutions, inference.literals[1:]):
+                    parts.append(sub)
+                    parts.append(literal)
+                inferred_ids[inference.freq] = "".join(parts)
+        return inferred_ids
+
+    def infer_many(
+        self,
+        ids: ty.Iterable[ty.Dict[str, str]],
+        metadata: ty.Optional[ty.Iterable[ty.Dict[str, ty.Dict[str, str]]]] = None,
+    ) -> ty.List[ty.Dict[str, str]]:
+        """Infers IDs for multiple leaves at once
+
+        Parameters
+        ----------
+        ids : Iterable[dict[str, str]]
+            the explicitly provided IDs of each leaf
+        metadata : Iterable[dict[str, dict[str, str]]], optional
+            the metadata associated with each leaf (in the same order as the IDs)
+
+        Returns
+        -------
+        list[dict[str, str]]
+            the IDs inferred for each leaf
+        """
+        if metadata is None:
+            return [self.infer(i) for i in ids]
+        return [self.infer(i, m) for i, m in zip(ids, metadata)]
+
+    @classmethod
+    def _extract(
+        cls,
+        comp: IdComponent,
+        ids: ty.Dict[str, str],
+        metadata: ty.Dict[str, ty.Dict[str, str]],
+    ) -> str:
+        if comp.attr_name == "ID":
+            attr = ids[comp.source_freq]
+        else:
+            try:
+                attr = str(metadata[comp.source_freq][comp.attr_name])
+            except KeyError:
+                raise ArcanaDataTreeConstructionError(
+                    f"'{ids[comp.source_freq]}' {comp.source_freq} row doesn't have "
+                    f"the metadata field '{comp.attr_name}'"
+                )
+        if comp.regex is None:
+            return attr
+        match = comp.regex.fullmatch(attr)
+        if not match or comp.regex.groups != 1:
+            match_msg = (
+                f"matched {comp.regex.groups} groups"
+                if match
+                else "didn't match the pattern"
+            )
+            raise ArcanaDataTreeConstructionError(
+                f"Provided ID-pattern component,'{comp.regex.pattern}', needs to match "
+                f"exactly one group on '{comp.attr_name}' attribute of "
+                f"'{ids[comp.source_freq]}' {comp.source_freq} row, '{attr}', when it "
+                + match_msg
+            )
+        return match.group(1)
+
+
 @attrs.define
 class DataTree(NestedContext):
 
@@ -32,14 +431,124 @@ class DataTree(NestedContext):
     _auto_ids: ty.Dict[ty.Tuple[str, ...], ty.Dict[str, int]] = attrs.field(
         factory=auto_ids_default
     )
+    # Log of the leaves added to the tree (tree path and IDs for each frequency in
+    # the data space), which is saved to the tree index after the tree is populated
+    _leaves: ty.List[ty.Tuple[ty.Tuple[str, ...], list]] = attrs.field(
+        factory=list, init=False, repr=False
+    )
+    _layer_plan: ty.Optional[LayerPlan] = attrs.field(
+        default=None, init=False, repr=False
+    )
+    # IDs of the rows in the tree, so that rows with the same ID share the same object
+    _interned_ids: ty.Dict[ty.Any, ty.Any] = attrs.field(
+        factory=dict, init=False, repr=False
+    )
+    # Pages of leaves listed by the store that are still to be added to the tree
+    _pending_pages: ty.Optional[
+        ty.Iterator[ty.List[ty.Optional[DataRow]]]
+    ] = attrs.field(default=None, init=False, repr=False)
+    # Rows of each frequency keyed by the IDs of the axes they span, built on demand
+    _axes_index: ty.Dict[DataSpace, ty.Dict[tuple, DataRow]] = attrs.field(
+        factory=dict, init=False, repr=False
+    )
+    # Entries of the rows saved the last time they were populated, keyed by the
+    # frequency and ID of the row, along with the fingerprint of the row at the time
+    _entries_manifest: ty.Optional[ty.Dict[str, list]] = attrs.field(
+        default=None, init=False, repr=False
+    )
+    # Rows that have been (re)scanned since the manifest was last saved
+    _entries_manifest_updates: ty.Dict[str, list] = attrs.field(
+        factory=dict, init=False, repr=False
+    )
+
+    INDEX_VERSION = "1"
+    ENTRIES_MANIFEST_VERSION = "1"
 
     def enter(self):
         assert self.root is None
         self._set_root()
-        self.dataset.store.populate_tree(self)
+        fingerprint = self.dataset.store.tree_fingerprint(self.dataset)
+        if fingerprint is not None and self._load_index(fingerprint):
+            self._leaves = []
+            return
+        try:
+            pages = self.dataset.store.list_leaves(self.dataset)
+        except NotImplementedError:
+            self.dataset.store.populate_tree(self)
+            self._populated(fingerprint)
+        else:
+            # The leaves are added as they are listed by the store, as the tree is
+            # accessed
+            self._pending_pages = self._add_pages(pages, fingerprint)
 
     def exit(self):
+        self.save_entries_manifest()
+        if self._pending_pages is not None:
+            self._pending_pages.close()
+            self._pending_pages = None
         self.root = None
+        self._axes_index = {}
+
+    def __getstate__(self):
+        state = {a.name: getattr(self, a.name) for a in attrs.fields(type(self))}
+        if self._pending_pages is not None:
+            # The generator listing the remaining pages can't be pickled, so the
+            # unpickled tree starts outside of its context and is populated again when
+            # it is next entered
+            state.update(
+                depth=0,
+                root=None,
+                _pending_pages=None,
+                _leaves=[],
+                _interned_ids={},
+                _axes_index={},
+            )
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+    @property
+    def is_populated(self) -> bool:
+        "Whether all the leaves listed by the store have been added to the tree"
+        return self._pending_pages is None
+
+    def populate(self):
+        """Adds any leaves that are still to be listed by the store to the tree"""
+        while self.add_next_page() is not None:
+            pass
+
+    def add_next_page(self) -> ty.Optional[ty.List[ty.Optional[DataRow]]]:
+        """Adds the next page of leaves listed by the store to the tree
+
+        Returns
+        -------
+        list[DataRow or None] or None
+            the rows added for the leaves of the page (None for excluded leaves), or
+            None if all the leaves have already been added
+        """
+        if self._pending_pages is None:
+            return None
+        try:
+            return next(self._pending_pages)
+        except StopIteration:
+            self._pending_pages = None
+            return None
+
+    def _add_pages(
+        self,
+        pages: ty.Iterable[ty.List[ty.Sequence[str]]],
+        fingerprint: ty.Optional[str],
+    ) -> ty.Iterator[ty.List[ty.Optional[DataRow]]]:
+        for page in pages:
+            yield self.add_leaves(page)
+        self._populated(fingerprint)
+
+    def _populated(self, fingerprint: ty.Optional[str]):
+        if fingerprint is not None:
+            self._save_index(fingerprint)
+        self._leaves = []
 
     @property
     def dataset_id(self):
@@ -82,133 +591,141 @@ class DataTree(NestedContext):
             raised if one of the groups specified in the ID inference reg-ex
             doesn't match a valid row_frequency in the data dimensions
         """
+        if self.root is None:
+            self._set_root()
+        return self._add_leaf(tree_path, metadata, self.layer_plan)
 
-        def matches_criteria(
-            label: str, freq_str: str, criteria: ty.Dict[str, ty.Union[list, str]]
-        ):
-            try:
-                freq_criteria = criteria[freq_str]
-            except KeyError:
-                return None
-            if isinstance(freq_criteria, list):
-                return label in freq_criteria
-            else:
-                return bool(re.match(freq_criteria, label))
+    def add_leaves(
+        self,
+        tree_paths: ty.Iterable[ty.Sequence[str]],
+        metadata: ty.Optional[ty.Iterable[ty.Dict[str, ty.Dict[str, str]]]] = None,
+    ) -> ty.List[ty.Optional[DataRow]]:
+        """Adds multiple leaves to the tree in bulk, which avoids repeating the
+        calculations that depend only on the dataset definition for each leaf
+
+        Parameters
+        ----------
+        tree_paths : Iterable[Sequence[str]]
+            the sequence of labels for each layer in the hierarchy leading to each leaf
+        metadata : Iterable[dict[str, dict[str, str]]], optional
+            metadata for each leaf (in the same order as the tree paths) passed to
+            ``DataStore.infer_ids()`` to infer IDs not directly represented in the
+            hierarchy of the data tree
 
+        Returns
+        -------
+        list[DataRow or None]
+            the added rows, with None for leaves excluded from the dataset
+        """
         if self.root is None:
             self._set_root()
+        plan = self.layer_plan
         if metadata is None:
-            metadata = {}
-        # Get basis frequencies covered at the given depth of the
-        if len(tree_path) != len(self.dataset.hierarchy):
+            return [self._add_leaf(p, None, plan) for p in tree_paths]
+        return [self._add_leaf(p, m, plan) for p, m in zip(tree_paths, metadata)]
+
+    @property
+    def layer_plan(self) -> LayerPlan:
+        """The quantities derived from the dataset definition used to add leaves to
+        the tree, which are calculated once each time the tree is built"""
+        if self._layer_plan is None:
+            self._layer_plan = LayerPlan.compile(self.dataset)
+        return self._layer_plan
+
+    def axes_index(self, frequency: DataSpace) -> ty.Dict[tuple, DataRow]:
+        """An index of the rows of the given frequency keyed by the IDs of the axes
+        the frequency spans (in the order returned by ``DataSpace.span``), which is
+        built the first time it is requested and kept up to date as rows are added
+
+        Parameters
+        ----------
+        frequency : DataSpace
+            the frequency of the rows
+
+        Returns
+        -------
+        dict[tuple, DataRow]
+            the rows of the frequency keyed by their axis IDs
+        """
+        try:
+            return self._axes_index[frequency]
+        except KeyError:
+            pass
+        span = self.layer_plan.spans[frequency]
+        index = {
+            tuple(r.ids[a] for a in span): r
+            for r in self.root.children.get(frequency, {}).values()
+        }
+        self._axes_index[frequency] = index
+        return index
+
+    def _add_leaf(
+        self,
+        tree_path: ty.Sequence[str],
+        metadata: ty.Optional[ty.Dict[str, ty.Dict[str, str]]],
+        plan: LayerPlan,
+    ) -> ty.Optional[DataRow]:
+        if len(tree_path) != len(plan.hierarchy):
             raise ArcanaDataTreeConstructionError(
                 f"Tree path ({tree_path}) should have the same length as "
                 f"the hierarchy ({self.dataset.hierarchy}) of {self}"
             )
-        if self.dataset.exclude:
-            for freq_str, label in zip(self.dataset.hierarchy, tree_path):
-                if matches_criteria(label, freq_str, self.dataset.exclude):
+        if plan.exclude:
+            for freq_str, label in zip(plan.hierarchy, tree_path):
+                try:
+                    matches = plan.exclude[freq_str]
+                except KeyError:
+                    continue
+                if matches(label):
                     return None  # Don't add leaf
-        # Set a default ID of None for all parent frequencies that could be
-        # inferred from a row at this depth
-        # ids = {f: None for f in self.dataset.space}
-        ids = dict(zip(self.dataset.hierarchy, tree_path))
+        ids = dict(zip(plan.hierarchy, tree_path))
         # Infer IDs and add them to those explicitly in the hierarchy
-        inferred_ids = self.dataset.infer_ids(ids, metadata=metadata)
-        ids.update(inferred_ids)
-        # Calculate the combined freqs after each layer is added
-        cummulative_freq = self.dataset.space(0)
-        for i, layer_str in enumerate(self.dataset.hierarchy):
-            layer_freq = self.dataset.space[layer_str]
-            # If all the axes introduced by the layer not present in parent layers
-            # and none of the IDs of these axes have been inferred from other IDs,
-            # then the ID of the axis out of the layer's axes with the least-
-            # significant bit can be considered to be equivalent to the
-            # ID of the layer and the IDs of the other axes of the layer set to None
-            # (the order of # the bits in the DataSpace class should be arranged to
-            # account for this default behaviour).
-            #
-            # For example, given a hierarchy of ['subject', 'session'] in the `Clinical`
-            # data space, no groups are assumed to be present by default (i.e. if not
-            # specified by the `id_patterns` attr of the dataset), and the `member`
-            # ID is assumed to be equivalent to the `subject` ID, since `member`
-            # correspdonds to the least significant bit in the value of the subject in
-            # the `Clinical` data space enum.
-            #
-            # Conversely, the timepoint can't be assumed to be equal to the `session`
-            # ID, since the session ID could be expected to also contain both the `member` and
-            # `group` ID in it, and should be explicitly extracted by via `id_patterns`
-            #
-            #       session ID: MRH010_CONTROL03_MR02
-            #
-            # with the '02' part representing as the timepoint can be extracted with the
-            #
-            #       id_inference = {
-            #           'timepoint': r'session:id:.*MR(0-9+)$'
-            #       }
-            # Axes already added by predecessor layers
-            prev_accounted_for = layer_freq & cummulative_freq
-            # Axes added by this layer
-            new = prev_accounted_for ^ layer_freq
-            assert new, f"{layer_str} doesn't add any new axes on predecessor layers"
-            layer_span = [str(f) for f in layer_freq.span()]
-            # Axes that have an ID already
-            unresolved_axes = [f for f in layer_span if f not in ids]
-            if unresolved_axes:
-                for axis in unresolved_axes[:-1]:
-                    ids[axis] = None
-                # If all axes added by the layer are new and none are resolved to IDs
-                # we can just use the ID for the layer to be equivalent to the last axis
-                if not prev_accounted_for and unresolved_axes == layer_span:
-                    assumed_id = ids[layer_str]
-                else:
-                    node_path = tuple(tree_path[:i]) + tuple(
-                        ids[str(f)] for f in new.span() if str(f) in ids
-                    )
-                    layer_label = tree_path[i]
-                    try:
-                        assumed_id = self._auto_ids[node_path][layer_label]
-                    except KeyError:
-                        assumed_id = str(len(self._auto_ids[node_path]) + 1)
-                        self._auto_ids[node_path][layer_label] = assumed_id
-                ids[unresolved_axes[-1]] = assumed_id
-            cummulative_freq |= layer_freq
-        assert cummulative_freq == self.dataset.space.leaf()
-        assert set(ids).issuperset(str(f) for f in self.dataset.space.axes())
-        # # Set or override any inferred IDs within the ones that have been
-        # # explicitly provided
-        # clashing_ids = set(ids) & set(additional_ids)
-        # if clashing_ids:
-        #     raise ArcanaUsageError(
-        #         f"Additional IDs clash with those inferred: {clashing_ids}"
-        #     )
-        # ids.update(additional_ids)
+        if plan.id_inference.inferences:
+            ids.update(plan.id_inference.infer(ids, metadata))
+        # See the comments in `LayerPlan.compile` for how IDs of axes that are not
+        # explicitly in the hierarchy are assumed
+        for i, layer in enumerate(plan.layers):
+            unresolved_axes = [a for a in layer.span if a not in ids]
+            if not unresolved_axes:
+                continue
+            for axis in unresolved_axes[:-1]:
+                ids[axis] = None
+            # If all axes added by the layer are new and none are resolved to IDs
+            # we can just use the ID for the layer to be equivalent to the last axis
+            if layer.all_new and len(unresolved_axes) == len(layer.span):
+                assumed_id = ids[layer.name]
+            else:
+                node_path = tuple(tree_path[:i]) + tuple(
+                    ids[a] for a in layer.new_span if a in ids
+                )
+                layer_label = tree_path[i]
+                auto_ids = self._auto_ids[node_path]
+                try:
+                    assumed_id = auto_ids[layer_label]
+                except KeyError:
+                    assumed_id = auto_ids[layer_label] = str(len(auto_ids) + 1)
+            ids[unresolved_axes[-1]] = assumed_id
         # Create composite IDs for non-basis frequencies if they are not
         # explicitly in the layer dimensions
-        for freq in set(self.dataset.space) - set(self.dataset.space.axes()):
-            freq_str = str(freq)
+        for freq_str, span in plan.composites:
             if freq_str not in ids:
-                id_ = tuple(ids[str(b)] for b in freq.span() if ids[str(b)] is not None)
-                if id_:
-                    if len(id_) == 1:
-                        id_ = id_[0]
-                else:
+                id_ = tuple(ids[a] for a in span if ids[a] is not None)
+                if not id_:
                     id_ = None
+                elif len(id_) == 1:
+                    id_ = id_[0]
                 ids[freq_str] = id_
         # Determine whether leaf node is included in the dataset definition according
         # to the include and exclude criteria
-        if self.dataset.include:
-            for freq in self.dataset.space:
-                freq_str = str(freq)
-                if (
-                    matches_criteria(ids[freq_str], freq_str, self.dataset.include)
-                    is False
-                ):
-                    return None
-        return self._add_row(
-            ids={f: ids.get(str(f)) for f in self.dataset.space},
-            row_frequency=self.dataset.space.leaf(),
+        for freq_str, matches in plan.include.items():
+            if not matches(ids[freq_str]):
+                return None
+        row_ids = [ids.get(s) for s in plan.freq_strs]
+        row = self._add_row(
+            ids=dict(zip(plan.frequencies, row_ids)), row_frequency=plan.leaf
         )
+        self._leaves.append((tuple(tree_path), row_ids))
+        return row
 
     def _add_row(self, ids: ty.Dict[DataSpace, str], row_frequency):
         """Adds a row to the dataset, creating all parent "aggregate" rows
@@ -227,59 +744,59 @@ class DataTree(NestedContext):
             If inserting a multiple IDs of the same class within the tree if
             one of their ids is None
         """
-        # logger.debug(
-        #     "Found %s row in %s dataset: %s", row_frequency, self.dataset_id, ids
-        # )
         row_frequency = self.dataset.parse_frequency(row_frequency)
-        row = DataRow(ids=ids, frequency=row_frequency, dataset=self.dataset)
+        plan = self.layer_plan
+        # Store the IDs compactly, sharing identical IDs between rows
+        id_freqs, positions = plan.row_ids_keys[row_frequency]
+        intern = self._interned_ids.setdefault
+        row_ids = RowIds(positions, tuple([intern(ids[f], ids[f]) for f in id_freqs]))
+        row = DataRow(ids=row_ids, frequency=row_frequency, dataset=self.dataset)
         # Create new data row
+        root_children = self.root.children
         try:
-            row_dict = self.root.children[row.frequency]
+            row_dict = root_children[row_frequency]
         except KeyError:
-            row_dict = self.root.children[row.frequency] = {}
-        if row.id in row_dict:
+            row_dict = root_children[row_frequency] = {}
+        row_id = row_ids[row_frequency]
+        if row_id in row_dict:
             raise ArcanaDataTreeConstructionError(
-                f"ID clash ({row.id}) between rows inserted into the data tree of "
+                f"ID clash ({row_id}) between rows inserted into the data tree of "
                 f"{self.dataset.id} in {self.dataset.store.name} store:\n"
                 "  exist: "
-                + ", ".join(f"{f}={i}" for f, i in sorted(row_dict[row.id].ids.items()))
+                + ", ".join(f"{f}={i}" for f, i in sorted(row_dict[row_id].ids.items()))
                 + "\n  added: "
-                + ", ".join(f"{f}={i}" for f, i in sorted(row.ids.items()))
+                + ", ".join(f"{f}={i}" for f, i in sorted(row_ids.items()))
             )
-        row_dict[row.id] = row
-        # Insert root row
+        row_dict[row_id] = row
+        axes_index = self._axes_index.get(row_frequency)
+        if axes_index is not None:
+            axes_index[tuple(row_ids[a] for a in plan.spans[row_frequency])] = row
         # Insert parent rows if not already present and link them with
         # inserted row
-        for parent_freq, parent_id in row.ids.items():
-            if not parent_freq:
-                continue  # Don't need to insert root row again
-            diff_freq = (row.frequency ^ parent_freq) & row.frequency
-            if diff_freq:
-                try:
-                    parent_row = self.dataset.row(frequency=parent_freq, id=parent_id)
-                except ArcanaNameError:
-                    parent_ids = {
-                        f: i
-                        for f, i in row.ids.items()
-                        if f.is_parent(parent_freq, if_match=True)
-                    }
-                    parent_row = self._add_row(parent_ids, parent_freq)
-                # Set reference to level row in new row
-                diff_id = row.frequency_id(diff_freq)
-                try:
-                    children_dict = parent_row.children[row_frequency]
-                except KeyError:
-                    children_dict = parent_row.children[row_frequency] = {}
-                if diff_id in children_dict:
-                    raise ArcanaDataTreeConstructionError(
-                        f"ID clash between rows inserted into data tree, {diff_id}, "
-                        f"in {diff_freq} children of {parent_row} "
-                        f"({children_dict[diff_id]} and {row}). You may "
-                        f"need to set the `id_patterns` attr of the dataset "
-                        "to disambiguate ID components (e.g. how to extract "
-                        "the timepoint ID from a session label)"
-                    )
-                children_dict[diff_id] = row
+        for parent_freq, diff_freq in plan.parents[row_frequency]:
+            parent_id = row_ids[parent_freq]
+            try:
+                parent_row = root_children[parent_freq][parent_id]
+            except KeyError:
+                parent_row = self._add_row(row_ids, parent_freq)
+            # Set reference to level row in new row
+            diff_id = row_ids[diff_freq]
+            if parent_row.children is NO_CHILDREN:
+                parent_row.children = {}
+            try:
+                children_dict = parent_row.children[row_frequency]
+            except KeyError:
+                children_dict = parent_row.children[row_frequency] = {}
+            if diff_id in children_dict:
+                raise ArcanaDataTreeConstructionError(
+                    f"ID clash between rows inserted into data tree, {diff_id}, "
+                    f"in {diff_freq} children of {parent_row} "
+                    f"({children_dict[diff_id]} and {row}). You may "
+                    f"need to set the `id_patterns` attr of the dataset "
+                    "to disambiguate ID components (e.g. how to extract "
+                    "the timepoint ID from a session label)"
+                )
+            children_dict[diff_id] = row
         return row
 
     def _set_root(self):
@@ -288,4 +805,297 @@ class DataTree(NestedContext):
             frequency=self.dataset.root_freq,
             dataset=self.dataset,
         )
+        self.root.children = {}
         self._auto_ids = auto_ids_default()
+        self._leaves = []
+        self._layer_plan = None
+        self._interned_ids = {}
+        self._axes_index = {}
+
+    @property
+    def index_path(self) -> ty.Optional[Path]:
+        """Path to the persistent index of the tree, which is specific to the
+        parameters of the dataset definition that affect the tree structure (i.e.
+        space, hierarchy, ID patterns and inclusion/exclusion criteria)"""
+        index_dir = self.dataset.store.tree_index_dir(self.dataset)
+        if index_dir is None:
+            return None
+        definition = {
+            "space": f"{self.dataset.space.__module__}.{self.dataset.space.__name__}",
+            "hierarchy": [str(h) for h in self.dataset.hierarchy],
+            "id_patterns": self.dataset.id_patterns,
+            "include": self.dataset.include,
+            "exclude": self.dataset.exclude,
+        }
+        key = hashlib.md5(
+            json.dumps(definition, sort_keys=True, default=str).encode()
+        ).hexdigest()
+        return Path(index_dir) / (key + ".json")
+
+    def _load_index(self, fingerprint: str) -> bool:
+        """Attempts to rebuild the tree from a previously saved index, which is only
+        reused if the fingerprint of the store hasn't changed since it was saved
+
+        Parameters
+        ----------
+        fingerprint : str
+            the current fingerprint of the dataset in the store
+
+        Returns
+        -------
+        bool
+            whether the tree was successfully loaded from the index
+        """
+        index_path = self.index_path
+        if index_path is None or not index_path.exists():
+            return False
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+            if (
+                index["version"] != self.INDEX_VERSION
+                or index["fingerprint"] != fingerprint
+                or index["frequencies"] != [str(f) for f in self.dataset.space]
+            ):
+                return False
+            leaf_freq = self.dataset.space.leaf()
+            for _, ids in index["leaves"]:
+                self._add_row(
+                    ids={
+                        f: tuple(i) if isinstance(i, list) else i
+                        for f, i in zip(self.dataset.space, ids)
+                    },
+                    row_frequency=leaf_freq,
+                )
+            for node_path, labels in index["auto_ids"]:
+                self._auto_ids[tuple(node_path)] = labels
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(
+                "Could not load data tree index for %s from %s (%s), rescanning store",
+                self.dataset,
+                index_path,
+                e,
+            )
+            self._set_root()
+            return False
+        logger.debug(
+            "Loaded data tree of %s from index at %s", self.dataset, index_path
+        )
+        return True
+
+    def _save_index(self, fingerprint: str):
+        """Saves the leaves added to the tree to an index so they can be loaded
+        without rescanning the store the next time the tree is built
+
+        Parameters
+        ----------
+        fingerprint : str
+            the fingerprint of the dataset in the store at the time it was scanned
+        """
+        index_path = self.index_path
+        if index_path is None:
+            return
+        index = {
+            "version": self.INDEX_VERSION,
+            "fingerprint": fingerprint,
+            "frequencies": [str(f) for f in self.dataset.space],
+            "leaves": self._leaves,
+            "auto_ids": [[list(p), ids] for p, ids in self._auto_ids.items()],
+        }
+        try:
+            index_path.parent.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file and then move it into place so concurrent
+            # processes never read a partially written index
+            fd, tmp_path = tempfile.mkstemp(dir=index_path.parent, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            logger.debug(
+                "Could not save data tree index for %s to %s: %s",
+                self.dataset,
+                index_path,
+                e,
+            )
+
+    @property
+    def entries_manifest_path(self) -> ty.Optional[Path]:
+        """Path to the manifest of the entries found in each row the last time it was
+        populated, which is saved alongside the index of the tree"""
+        index_path = self.index_path
+        if index_path is None:
+            return None
+        return index_path.with_suffix(".entries.json")
+
+    def populate_entries(self, rows: ty.Sequence[DataRow]):
+        """Populates the rows with their entries, reusing the entries saved in the
+        manifest for rows whose fingerprint in the store hasn't changed since they
+        were last populated and scanning the remaining rows with the store
+
+        Parameters
+        ----------
+        rows : Sequence[DataRow]
+            the rows to populate, which should have an empty entries dict
+        """
+        store = self.dataset.store
+        to_scan = []
+        with store.connection:
+            for row in rows:
+                fingerprint = store.row_fingerprint(row)
+                if fingerprint is None or not self._load_entries(row, fingerprint):
+                    to_scan.append((row, fingerprint))
+            if len(to_scan) == 1:
+                store.populate_row(to_scan[0][0])
+            elif to_scan:
+                store.populate_rows([r for r, _ in to_scan])
+            # Rows that were modified while they were being scanned aren't saved in
+            # the manifest, as their entries may not match the fingerprint
+            to_save = [
+                (r, f)
+                for r, f in to_scan
+                if f is not None and store.row_fingerprint(r) == f
+            ]
+        for row, fingerprint in to_save:
+            self._entries_manifest_updates[self._row_key(row)] = [
+                fingerprint,
+                [
+                    [
+                        e.path,
+                        ClassResolver.tostr(e.datatype, strip_prefix=False),
+                        str(e.uri) if e.uri is not None else None,
+                        dict(e.item_metadata.loaded),
+                        e.order,
+                        e.quality.name,
+                        e.checksums,
+                    ]
+                    for e in row._entries_dict.values()
+                ],
+            ]
+        logger.debug(
+            "Reused the saved entries of %s rows of %s, scanned %s rows",
+            len(rows) - len(to_scan),
+            self.dataset,
+            len(to_scan),
+        )
+
+    def save_entries_manifest(self):
+        """Saves the entries of the rows that have been scanned since the manifest was
+        last saved. The manifest is reloaded before it is saved so that rows scanned
+        by concurrent processes aren't dropped from it"""
+        if not self._entries_manifest_updates:
+            return
+        manifest_path = self.entries_manifest_path
+        if manifest_path is not None:
+            manifest = self._read_entries_manifest(manifest_path)
+        else:
+            manifest = dict(self._entries_manifest or {})
+        manifest.update(self._entries_manifest_updates)
+        self._entries_manifest = manifest
+        self._entries_manifest_updates = {}
+        if manifest_path is None:
+            return
+        try:
+            manifest_path.parent.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file and then move it into place so concurrent
+            # processes never read a partially written manifest
+            fd, tmp_path = tempfile.mkstemp(dir=manifest_path.parent, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(
+                        {"version": self.ENTRIES_MANIFEST_VERSION, "rows": manifest},
+                        f,
+                    )
+                os.replace(tmp_path, manifest_path)
+            except (TypeError, ValueError):
+                os.unlink(tmp_path)
+                raise
+        except (OSError, TypeError, ValueError) as e:
+            logger.debug(
+                "Could not save entries manifest for %s to %s: %s",
+                self.dataset,
+                manifest_path,
+                e,
+            )
+
+    def _load_entries(self, row: DataRow, fingerprint: str) -> bool:
+        """Adds the entries saved in the manifest to the row if the fingerprint of the
+        row hasn't changed since they were saved
+
+        Parameters
+        ----------
+        row : DataRow
+            the row to add the entries to
+        fingerprint : str
+            the current fingerprint of the row in the store
+
+        Returns
+        -------
+        bool
+            whether the entries were loaded from the manifest
+        """
+        key = self._row_key(row)
+        try:
+            saved = self._entries_manifest_updates[key]
+        except KeyError:
+            if self._entries_manifest is None:
+                manifest_path = self.entries_manifest_path
+                self._entries_manifest = (
+                    self._read_entries_manifest(manifest_path)
+                    if manifest_path is not None
+                    else {}
+                )
+            saved = self._entries_manifest.get(key)
+        if saved is None or saved[0] != fingerprint:
+            return False
+        try:
+            for saved_entry in saved[1]:
+                (
+                    path,
+                    datatype,
+                    uri,
+                    item_metadata,
+                    order,
+                    quality,
+                    checksums,
+                ) = saved_entry
+                row.add_entry(
+                    path=path,
+                    datatype=resolve_datatype(datatype),
+                    uri=uri,
+                    item_metadata=item_metadata,
+                    order=order,
+                    quality=DataQuality[quality],
+                    checksums=checksums,
+                )
+        except (ValueError, KeyError, TypeError, ImportError, ArcanaUsageError) as e:
+            logger.debug(
+                "Could not load saved entries of %s (%s), rescanning it", row, e
+            )
+            row._entries_dict = {}
+            return False
+        return True
+
+    def _read_entries_manifest(self, manifest_path: Path) -> ty.Dict[str, list]:
+        if not manifest_path.exists():
+            return {}
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.debug(
+                "Could not read entries manifest for %s from %s: %s",
+                self.dataset,
+                manifest_path,
+                e,
+            )
+            return {}
+        if (
+            not isinstance(manifest, dict)
+            or manifest.get("version") != self.ENTRIES_MANIFEST_VERSION
+        ):
+            return {}
+        return manifest.get("rows", {})
+
+    @staticmethod
+    def _row_key(row: DataRow) -> str:
+        return json.dumps([str(row.frequency), row.id])
@@ -238,6 +238,7 @@ class ContainerCommand:
         parameter_values = dict(parameter_values) if parameter_values else {}
 
         input_configs = []
+        source_names = []
         converter_args = {}  # Arguments passed to converter
         for inpt in self.inputs:
             if not input_values[inpt.name] and inpt.datatype != DataRow:
@@ -273,6 +274,7 @@ class ContainerCommand:
                     is_regex=True,
                     **source_kwargs,
                 )
+            source_names.append(inpt.name)
             if input_config := inpt.config_dict:
                 input_configs.append(input_config)
 
@@ -380,6 +382,10 @@ class ContainerCommand:
         if ids is not None:
             ids = ids.split(",")
 
+        # Download the inputs of all rows to be processed concurrently up front,
+        # instead of one at a time as each row is processed
+        dataset.prefetch(source_names, ids=ids)
+
         # execute the workflow
         try:
             result = wf(ids=ids, plugin=plugin)
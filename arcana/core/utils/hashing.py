@@ -0,0 +1,159 @@
+from __future__ import annotations
+import os
+import time
+import json
+import hashlib
+import logging
+import typing as ty
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import attrs
+from .misc import HASH_CHUNK_SIZE, JSON_ENCODING, append_suffix
+
+
+logger = logging.getLogger("arcana")
+
+
+@attrs.define
+class FileHasher:
+    """Calculates the checksums of files, hashing multiple files concurrently in a pool
+    of threads (the hashlib algorithms release the GIL while hashing large buffers).
+    The checksums can be saved in a JSON "sidecar" file, keyed by the size and
+    modification time of each file, so files that haven't changed since they were
+    last hashed aren't hashed again
+
+    Parameters
+    ----------
+    algorithm : str
+        the name of the hashlib algorithm used to calculate the checksums
+    max_workers : int, optional
+        the maximum number of files to hash concurrently, by default the default of
+        `concurrent.futures.ThreadPoolExecutor`
+    chunk_size : int
+        the size of the buffer the files are read into
+    """
+
+    algorithm: str = "md5"
+    max_workers: ty.Optional[int] = None
+    chunk_size: int = HASH_CHUNK_SIZE
+
+    # Files modified more recently than this (in ns) aren't saved in the sidecar, as
+    # they could be modified again without their modification time changing
+    MIN_CACHE_AGE = 2 * 10**9
+
+    def hash_file(self, fspath: Path) -> str:
+        """Calculates the checksum of a single file
+
+        Parameters
+        ----------
+        fspath : Path
+            path to the file to hash
+
+        Returns
+        -------
+        str
+            the hex digest of the file contents
+        """
+        crypto = hashlib.new(self.algorithm)
+        buffer = bytearray(self.chunk_size)
+        view = memoryview(buffer)
+        with open(fspath, "rb", buffering=0) as f:
+            while n_bytes := f.readinto(buffer):
+                crypto.update(view[:n_bytes])
+        return crypto.hexdigest()
+
+    def hash_files(
+        self,
+        fspaths: ty.Iterable[Path],
+        relative_to: Path,
+        sidecar: ty.Optional[Path] = None,
+    ) -> ty.Dict[str, str]:
+        """Calculates the checksums of the files, and of the files within directories
+
+        Parameters
+        ----------
+        fspaths : Iterable[Path]
+            paths to the files and directories to hash
+        relative_to : Path
+            the directory the checksums are keyed relative to
+        sidecar : Path, optional
+            a JSON file to load previously calculated checksums from and save the
+            newly calculated ones to
+
+        Returns
+        -------
+        dict[str, str]
+            the checksums of the files keyed by their paths relative to `relative_to`
+        """
+        files = {}
+        for fspath in fspaths:
+            fspath = Path(fspath)
+            if fspath.is_dir():
+                for dpath, _, fnames in os.walk(fspath):
+                    for fname in sorted(fnames):
+                        fpath = Path(dpath) / fname
+                        files[str(fpath.relative_to(relative_to))] = fpath
+            else:
+                files[str(fspath.relative_to(relative_to))] = fspath
+        saved = self._load_sidecar(sidecar) if sidecar is not None else {}
+        checksums = {}
+        stats = {}
+        to_hash = {}
+        for rel_path, fpath in files.items():
+            stat = fpath.stat()
+            stats[rel_path] = [stat.st_size, stat.st_mtime_ns]
+            try:
+                size, mtime, checksum = saved[rel_path]
+            except (KeyError, TypeError, ValueError):
+                to_hash[rel_path] = fpath
+            else:
+                if [size, mtime] == stats[rel_path]:
+                    checksums[rel_path] = checksum
+                else:
+                    to_hash[rel_path] = fpath
+        if len(to_hash) == 1:
+            ((rel_path, fpath),) = to_hash.items()
+            checksums[rel_path] = self.hash_file(fpath)
+        elif to_hash:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for rel_path, checksum in zip(
+                    to_hash, executor.map(self.hash_file, to_hash.values())
+                ):
+                    checksums[rel_path] = checksum
+        logger.debug(
+            "Hashed %s files, reused the checksums of %s unchanged files",
+            len(to_hash),
+            len(files) - len(to_hash),
+        )
+        if sidecar is not None and to_hash:
+            min_mtime = time.time_ns() - self.MIN_CACHE_AGE
+            self._save_sidecar(
+                sidecar,
+                {
+                    p: stats[p] + [checksums[p]]
+                    for p in files
+                    if stats[p][1] < min_mtime
+                },
+            )
+        return {p: checksums[p] for p in files}
+
+    def _load_sidecar(self, sidecar: Path) -> ty.Dict[str, list]:
+        try:
+            with open(sidecar, **JSON_ENCODING) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if saved.get("algorithm") != self.algorithm:
+            return {}
+        return saved.get("files", {})
+
+    def _save_sidecar(self, sidecar: Path, files: ty.Dict[str, list]):
+        # Write to a temporary file and then move it into place so concurrent
+        # processes never read a partially written file
+        tmp_path = append_suffix(sidecar, f".{os.getpid()}.tmp")
+        try:
+            with open(tmp_path, "w", **JSON_ENCODING) as f:
+                json.dump({"algorithm": self.algorithm, "files": files}, f)
+            os.replace(tmp_path, sidecar)
+        except OSError as e:
+            logger.debug("Could not save checksums to %s: %s", sidecar, e)
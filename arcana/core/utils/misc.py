@@ -11,6 +11,7 @@ import tarfile
 import logging
 import docker
 import os.path
+import threading
 import attrs
 from contextlib import contextmanager
 from collections.abc import Iterable
@@ -42,6 +43,8 @@ ARCANA_PIP = "git+ssh://git@github.com/australian-imaging-service/arcana.git"
 
 HASH_CHUNK_SIZE = 2**20  # 1MB in calc. checksums to avoid mem. issues
 
+_nested_context_lock = threading.Lock()
+
 
 @attrs.define
 class NestedContext:
@@ -65,15 +68,20 @@ class NestedContext:
         # but still only use one connection. This is useful for calling
         # methods that need connections, and therefore control their
         # own connection, in batches using the same connection by
-        # placing the batch calls within an outer context.
-        self.depth += 1
-        if self.depth == 1:
+        # placing the batch calls within an outer context. The depth is updated under
+        # a lock so worker threads can use a context held open by their parent thread
+        with _nested_context_lock:
+            self.depth += 1
+            is_outermost = self.depth == 1
+        if is_outermost:
             self.enter()
         return self
 
     def __exit__(self, exception_type, exception_value, traceback):
-        self.depth -= 1
-        if self.depth == 0:
+        with _nested_context_lock:
+            self.depth -= 1
+            is_outermost = self.depth == 0
+        if is_outermost:
             self.exit()
 
     def enter(self):
@@ -671,6 +679,34 @@ def append_suffix(path: Path, suffix: str) -> Path:
     return Path(str(path) + suffix)
 
 
+SIZE_UNITS = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+
+
+def parse_size(size: ty.Union[str, int]) -> int:
+    """Parses a size in bytes, which can be specified with a K, M, G or T (binary)
+    unit suffix, e.g. '500G'
+
+    Parameters
+    ----------
+    size : str or int
+        the size to parse
+
+    Returns
+    -------
+    int
+        the size in bytes
+    """
+    if isinstance(size, int):
+        return size
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$", size, re.IGNORECASE)
+    if not match:
+        raise ArcanaUsageError(
+            f"Could not parse size '{size}', should be a number of bytes optionally "
+            "followed by a K, M, G or T unit suffix"
+        )
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
 # Minimum version of Arcana that this version can read the serialisation from
 MIN_SERIAL_VERSION = "0.0.0"
 
@@ -1,5 +1,13 @@
+import os
+import time
+import hashlib
+import pytest
+from fileformats.generic import Directory
 from arcana.core.utils.packaging import package_from_module
-from arcana.core.utils.misc import path2varname, varname2path
+from arcana.core.utils.misc import path2varname, varname2path, parse_size
+from arcana.core.utils.hashing import FileHasher
+from arcana.core.utils.transfer import transfer_fileset, TRANSFER_MODES
+from arcana.core.exceptions import ArcanaUsageError
 
 
 def test_package_from_module():
@@ -24,3 +32,63 @@ def test_path2varname():
         assert path2varname(path) == varname
         assert varname2path(varname) == path
         assert varname2path(varname2path(path2varname(path2varname(path)))) == path
+
+
+def test_parse_size():
+    assert parse_size("100") == 100
+    assert parse_size("2K") == 2048
+    assert parse_size("1.5GiB") == int(1.5 * 2**30)
+    assert parse_size("2T") == 2 * 2**40
+    with pytest.raises(ArcanaUsageError):
+        parse_size("lots")
+
+
+def test_file_hasher(tmp_path, monkeypatch):
+    fileset_dir = tmp_path / "fileset"
+    (fileset_dir / "subdir").mkdir(parents=True)
+    contents = {"a.txt": b"a" * 100, "subdir/b.txt": b"b" * 10}
+    for rel_path, data in contents.items():
+        (fileset_dir / rel_path).write_bytes(data)
+        # Old enough to be saved in the sidecar
+        os.utime(fileset_dir / rel_path, (time.time() - 60, time.time() - 60))
+    sidecar = tmp_path / "fileset.hashes.json"
+    hasher = FileHasher(chunk_size=16)
+    checksums = hasher.hash_files(
+        [fileset_dir / "a.txt", fileset_dir / "subdir"], fileset_dir, sidecar=sidecar
+    )
+    assert checksums == {p: hashlib.md5(d).hexdigest() for p, d in contents.items()}
+    hashed = []
+    hash_file = FileHasher.hash_file
+
+    def counting_hash_file(self, fspath):
+        hashed.append(fspath)
+        return hash_file(self, fspath)
+
+    monkeypatch.setattr(FileHasher, "hash_file", counting_hash_file)
+    # Unchanged files aren't hashed again
+    assert hasher.hash_files([fileset_dir], fileset_dir, sidecar=sidecar) == checksums
+    assert not hashed
+    (fileset_dir / "a.txt").write_bytes(b"modified")
+    checksums = hasher.hash_files([fileset_dir], fileset_dir, sidecar=sidecar)
+    assert checksums["a.txt"] == hashlib.md5(b"modified").hexdigest()
+    assert hashed == [fileset_dir / "a.txt"]
+
+
+@pytest.mark.parametrize("mode", TRANSFER_MODES)
+def test_transfer_fileset(tmp_path, mode):
+    src_dir = tmp_path / "src" / "fileset"
+    (src_dir / "subdir").mkdir(parents=True)
+    contents = {"a.txt": b"a" * 100, "subdir/b.txt": b"b" * 10}
+    for rel_path, data in contents.items():
+        (src_dir / rel_path).write_bytes(data)
+    transferred = transfer_fileset(
+        Directory(src_dir), tmp_path / "dest", mode=mode, make_dirs=True
+    )
+    dest_dir = tmp_path / "dest" / "fileset"
+    assert transferred.fspath == dest_dir
+    for rel_path, data in contents.items():
+        assert not (dest_dir / rel_path).is_symlink()
+        assert (dest_dir / rel_path).read_bytes() == data
+        if mode == "hardlink":
+            assert os.path.samefile(src_dir / rel_path, dest_dir / rel_path)
+    assert src_dir.exists() == (mode != "move")
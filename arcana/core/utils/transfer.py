@@ -0,0 +1,147 @@
+from __future__ import annotations
+import os
+import errno
+import shutil
+import logging
+from pathlib import Path
+from fileformats.core import FileSet
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+
+logger = logging.getLogger("arcana")
+
+
+# Modes that files can be transferred into a store with, in order of how much I/O
+# and disk space they save:
+#     copy - the files are copied
+#     reflink - the files are cloned copy-on-write (e.g. on Btrfs or XFS), so they
+#         share the same blocks on disk until either copy is modified
+#     hardlink - the files are hard-linked, so both paths refer to the same file and
+#         modifying one modifies the other
+#     move - the files are moved (renamed), removing them from their original location
+# Modes other than copy fall back to copying if they aren't supported between the
+# source and destination (e.g. they are on different devices)
+TRANSFER_MODES = ("copy", "reflink", "hardlink", "move")
+
+# ioctl request to clone a file on Linux (from linux/fs.h)
+FICLONE = 0x40049409
+
+# Errors raised when a file can't be hard-linked or cloned to the destination, in
+# which case it is copied instead
+_FALLBACK_ERRNOS = frozenset(
+    e
+    for e in (
+        errno.EXDEV,
+        errno.EPERM,
+        errno.EMLINK,
+        errno.EINVAL,
+        errno.ENOTTY,
+        errno.EOPNOTSUPP,
+        getattr(errno, "ENOTSUP", None),
+    )
+    if e is not None
+)
+
+
+def transfer_fileset(
+    fileset: FileSet, dest_dir: Path, mode: str = "copy", **kwargs
+) -> FileSet:
+    """Transfers a file-set into a directory, copying, cloning, hard-linking or moving
+    the files depending on the transfer mode
+
+    Parameters
+    ----------
+    fileset : FileSet
+        the file-set to transfer
+    dest_dir : Path
+        the directory to transfer the file-set into
+    mode : str
+        the transfer mode, one of `TRANSFER_MODES`
+    **kwargs
+        passed through to ``FileSet.copy`` to control how the files are named and
+        arranged within the destination directory
+
+    Returns
+    -------
+    FileSet
+        the transferred file-set
+    """
+    if mode not in TRANSFER_MODES:
+        raise ValueError(
+            f"Unrecognised transfer mode '{mode}', can be one of {TRANSFER_MODES}"
+        )
+    if mode == "copy":
+        return fileset.copy(dest_dir, **kwargs)
+    # Map the paths of the file-set to their destinations by symlinking them into place,
+    # then replace the symlinks with the transferred files
+    linked = fileset.copy(dest_dir, mode=FileSet.CopyMode.symlink, **kwargs)
+    for dest in linked.fspaths:
+        src = Path(os.readlink(dest))
+        dest.unlink()
+        transfer_path(src, dest, mode)
+    return linked
+
+
+def transfer_path(src: Path, dest: Path, mode: str = "copy"):
+    """Transfers a file or directory to a new path
+
+    Parameters
+    ----------
+    src : Path
+        the file or directory to transfer
+    dest : Path
+        the path to transfer it to, which shouldn't exist
+    mode : str
+        the transfer mode, one of `TRANSFER_MODES`
+    """
+    if mode == "move":
+        # Renames the path if it is on the same device, otherwise copies and removes it
+        shutil.move(str(src), str(dest))
+    elif src.is_dir():
+        for dpath, _, fnames in os.walk(src):
+            dest_dpath = dest / Path(dpath).relative_to(src)
+            dest_dpath.mkdir(parents=True, exist_ok=True)
+            for fname in fnames:
+                transfer_file(Path(dpath) / fname, dest_dpath / fname, mode)
+    else:
+        transfer_file(src, dest, mode)
+
+
+def transfer_file(src: Path, dest: Path, mode: str = "copy"):
+    """Transfers a single file to a new path, falling back to copying it if the
+    transfer mode isn't supported between the source and destination
+
+    Parameters
+    ----------
+    src : Path
+        the file to transfer
+    dest : Path
+        the path to transfer it to, which shouldn't exist
+    mode : str
+        the transfer mode, one of `TRANSFER_MODES`
+    """
+    if mode == "move":
+        shutil.move(str(src), str(dest))
+        return
+    if mode == "hardlink":
+        try:
+            os.link(src, dest)
+            return
+        except OSError as e:
+            if e.errno not in _FALLBACK_ERRNOS:
+                raise
+            logger.debug("Could not hard-link %s to %s (%s), copying", src, dest, e)
+    elif mode == "reflink" and fcntl is not None:
+        with open(src, "rb") as fsrc, open(dest, "wb") as fdest:
+            try:
+                fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+                return
+            except OSError as e:
+                if e.errno not in _FALLBACK_ERRNOS:
+                    raise
+                logger.debug("Could not clone %s to %s (%s), copying", src, dest, e)
+    shutil.copyfile(src, dest)
@@ -1,6 +1,8 @@
 from __future__ import annotations
 import typing as ty
+import os
 import json
+import hashlib
 import shutil
 from pathlib import Path
 import attrs
@@ -46,6 +48,7 @@ class MockRemote(RemoteStore):
     NON_LEAVES_DIR = "non-leaves"
     FIELDS_FILE = "__FIELD__"
     CHECKSUMS_FILE = "__CHECKSUMS__.json"
+    LEAVES_PAGE_SIZE = 10
 
     #############################
     # DataStore abstractmethods #
@@ -54,24 +57,81 @@ class MockRemote(RemoteStore):
     def populate_tree(self, tree: DataTree):
         """
         Find all data rows for a dataset in the store and populate the
-        Dataset object using its `add_leaf` method.
+        Dataset object using its `add_leaves` method.
 
         Parameters
         ----------
         dataset : Dataset
             The dataset to populate with rows
         """
+        for page in self.list_leaves(tree.dataset):
+            tree.add_leaves(page)
+
+    def list_leaves(self, dataset) -> ty.Iterator[ty.List[ty.List[str]]]:
+        """Lists the leaves in pages of `LEAVES_PAGE_SIZE` to mock the paginated
+        queries of a remote API"""
         with self.connection:
             self._check_connected()
-            leaves_dir = self.dataset_fspath(tree.dataset_id) / self.LEAVES_DIR
-            if not leaves_dir.exists():
-                raise RuntimeError(
-                    f"Leaves dir {leaves_dir} for flat-dir data store doesn't exist, which "
-                    "means it hasn't been initialised properly"
-                )
+            leaves_dir = self._leaves_dir(dataset)
+            page = []
             for row_dir in self.iterdir(leaves_dir):
                 ids = self.get_ids_from_row_dirname(row_dir)
-                tree.add_leaf([ids[h] for h in tree.hierarchy])
+                page.append([ids[h] for h in dataset.hierarchy])
+                if len(page) == self.LEAVES_PAGE_SIZE:
+                    yield page
+                    page = []
+            if page:
+                yield page
+
+    def count_rows(self, dataset, frequency: DataSpace) -> int:
+        """Only leaves are counted, as counting rows of other frequencies would require
+        the IDs of the leaves to be listed"""
+        if frequency != dataset.space.leaf():
+            raise NotImplementedError
+        with self.connection:
+            self._check_connected()
+            return len(list(self.iterdir(self._leaves_dir(dataset))))
+
+    def _leaves_dir(self, dataset) -> Path:
+        leaves_dir = self.dataset_fspath(dataset.id) / self.LEAVES_DIR
+        if not leaves_dir.exists():
+            raise RuntimeError(
+                f"Leaves dir {leaves_dir} for flat-dir data store doesn't exist, which "
+                "means it hasn't been initialised properly"
+            )
+        return leaves_dir
+
+    def tree_fingerprint(self, dataset) -> ty.Optional[str]:
+        """Leaves are stored flat within the leaves directory so its modification
+        time changes whenever a leaf is added or removed"""
+        leaves_dir = self.dataset_fspath(dataset) / self.LEAVES_DIR
+        if not leaves_dir.exists():
+            return None
+        mtime = leaves_dir.stat().st_mtime
+        if mtime > time.time() - self.TREE_FINGERPRINT_MIN_AGE:
+            return None
+        return str(leaves_dir.stat().st_mtime_ns)
+
+    def row_fingerprint(self, row: DataRow) -> ty.Optional[str]:
+        """Fingerprints the entries of the row from the "last-modified" times of the
+        row directory and the entry directories within it, analogous to the ETags
+        returned when listing the resources of a session in a remote store"""
+        with self.connection:
+            self._check_connected()
+            try:
+                row_dir = self.get_row_path(row)
+            except NotInHierarchyException:
+                return None
+            if not row_dir.exists():
+                return None
+            min_mtime = time.time() - self.TREE_FINGERPRINT_MIN_AGE
+            hsh = hashlib.md5()
+            for path in [row_dir] + sorted(self.iterdir(row_dir)):
+                stat = path.stat()
+                if stat.st_mtime > min_mtime:
+                    return None
+                hsh.update(f"{path.name}:{stat.st_mtime_ns};".encode())
+            return hsh.hexdigest()
 
     def populate_row(self, row: DataRow):
         """
@@ -164,7 +224,7 @@ class MockRemote(RemoteStore):
 
     def get_provenance(self, entry: DataEntry) -> ty.Dict[str, ty.Any]:
         self._check_connected()
-        prov_path = entry.uri.with_suffix(".json")
+        prov_path = (self.remote_dir / entry.uri).with_suffix(".json")
         if prov_path.exists():
             with open(prov_path) as f:
                 provenance = json.load(f)
@@ -174,7 +234,7 @@ class MockRemote(RemoteStore):
 
     def put_provenance(self, provenance: ty.Dict[str, ty.Any], entry: DataEntry):
         self._check_connected()
-        prov_path = entry.uri.with_suffix(".json")
+        prov_path = (self.remote_dir / entry.uri).with_suffix(".json")
         with open(prov_path, "w") as f:
             json.dump(provenance, f)
 
@@ -227,10 +287,30 @@ class MockRemote(RemoteStore):
             shutil.rmtree(entry_fspath)
         entry_fspath.parent.mkdir(exist_ok=True)
         shutil.copytree(cache_path, entry_fspath)
+        # Simulate the time taken to upload each file one after the other
+        time.sleep(self.mock_delay * sum(len(fs) for _, _, fs in os.walk(cache_path)))
         checksums = self.calculate_checksums(FileSet(cache_path.iterdir()))
         with open(self.remote_dir / entry.uri / self.CHECKSUMS_FILE, "w") as f:
             json.dump(checksums, f)
 
+    def upload_file(self, fspath: Path, rel_path: str, entry: DataEntry):
+        self._check_connected()
+        dest_path = self.entry_fspath(entry) / rel_path
+        dest_path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(fspath, dest_path)
+        time.sleep(self.mock_delay)
+        # The checksums are recalculated by the "server" when they are next requested
+        try:
+            (self.entry_fspath(entry) / self.CHECKSUMS_FILE).unlink()
+        except FileNotFoundError:
+            pass
+
+    def delete_files(self, entry: DataEntry):
+        self._check_connected()
+        entry_fspath = self.entry_fspath(entry)
+        if entry_fspath.exists():
+            shutil.rmtree(entry_fspath)
+
     def download_value(
         self, entry: DataEntry
     ) -> ty.Union[float, int, str, ty.List[float], ty.List[int], ty.List[str]]:
@@ -278,7 +358,14 @@ class MockRemote(RemoteStore):
         """
         fspath = self.remote_dir / uri / self.CHECKSUMS_FILE
         if not fspath.exists():
-            return None
+            if not (self.remote_dir / uri).exists():
+                return None
+            # Recalculate the checksums after files have been uploaded individually
+            checksums = self.calculate_checksums(
+                FileSet(self.iterdir(self.remote_dir / uri))
+            )
+            with open(fspath, "w") as f:
+                json.dump(checksums, f)
         with open(fspath) as f:
             checksums = json.load(f)
         return checksums
@@ -294,7 +381,9 @@ class MockRemote(RemoteStore):
         uri: str
             uri of the data item to download the checksums for
         """
-        return fileset.hash_files()
+        # Key the checksums by the file names within the entry as they would be in
+        # a typical remote store (e.g. the files in an XNAT resource)
+        return self.hash_files(fileset, algorithm="sha256")
 
     ##################
     # Helper methods #
@@ -309,6 +398,11 @@ class MockRemote(RemoteStore):
     def entry_fspath(self, entry):
         return self.remote_dir / entry.uri
 
+    def cache_path(self, uri: str):
+        # URIs are relative to the remote dir, so unlike typical REST URIs there are no
+        # leading segments to strip
+        return self.cache_dir.joinpath(*str(uri).split("/"))
+
     def _create_entry(self, path: str, datatype: type, row: DataRow) -> DataEntry:
         self._check_connected()
         entry = row.add_entry(